@@ -0,0 +1,128 @@
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Optional
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-row predictions into one batched model call.
+
+    Requests are put on an asyncio queue and a background task flushes them as
+    one stacked NumPy batch as soon as either max_batch_size rows are waiting
+    or the oldest row has waited max_wait_ms. Rows meant for different model
+    versions are scored in separate calls. Each caller gets back its own row
+    of the result.
+
+    Attributes:
+    predict_fn (Callable): Coroutine function scoring an (n_rows, n_features) array with a model and returning one result per row.
+    max_batch_size (int): Maximum number of rows flushed together (default is 64).
+    max_wait_ms (float): Maximum time the first row of a batch waits for company (default is 2.0).
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray, Any], Awaitable[np.ndarray]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 2.0,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flushes = set()
+        # Counters used to tune the throughput/latency trade-off
+        self.batch_size_counts = Counter()
+        self.requests_total = 0
+        self.queue_delay_seconds_total = 0.0
+        self.queue_delay_seconds_max = 0.0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, row: np.ndarray, model=None):
+        """Queue one feature row and wait for its prediction by model."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((row, future, loop.time(), model))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = batch[0][2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                # Take whatever is already waiting before sleeping on the queue
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Flush in the background so the next batch can be collected while
+            # this one is being scored on the inference executor
+            flush = asyncio.create_task(self._flush(batch, loop.time()))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list, flushed_at: float):
+        self.batch_size_counts[len(batch)] += 1
+        self.requests_total += len(batch)
+        by_model = {}
+        for row, future, enqueued, model in batch:
+            delay = flushed_at - enqueued
+            self.queue_delay_seconds_total += delay
+            self.queue_delay_seconds_max = max(self.queue_delay_seconds_max, delay)
+            by_model.setdefault(id(model), (model, []))[1].append((row, future))
+        await asyncio.gather(
+            *(self._predict(model, items) for model, items in by_model.values())
+        )
+
+    async def _predict(self, model, items: list):
+        rows, futures = zip(*items)
+        try:
+            results = await self.predict_fn(np.stack(rows), model)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            # The caller may have gone away (e.g. client disconnect)
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        batches = sum(self.batch_size_counts.values())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches_total": batches,
+            "requests_total": self.requests_total,
+            "mean_batch_size": self.requests_total / batches if batches else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+            "queue_delay_seconds_total": self.queue_delay_seconds_total,
+            "queue_delay_seconds_mean": (
+                self.queue_delay_seconds_total / self.requests_total
+                if self.requests_total
+                else 0.0
+            ),
+            "queue_delay_seconds_max": self.queue_delay_seconds_max,
+        }
@@ -0,0 +1,258 @@
+"""
+Compact, memory-mappable model artifacts.
+
+A compact artifact holds an ArrayForest and the bundle metadata in a single
+file:
+- the 8-byte magic string COMPACT_MAGIC
+- the length of the header, as a little-endian uint64
+- a UTF-8 JSON header with the bundle metadata and the dtype, shape and
+  offset of every array
+- the arrays, each aligned to ARRAY_ALIGNMENT bytes
+
+Loading one maps the arrays from disk instead of unpickling the forest, so
+it takes milliseconds. Processes that map the same file share one copy of
+it in the page cache.
+
+Usage (from app/backend), to export the committed model:
+    python compact_model.py model.joblib model.forest
+"""
+
+import argparse
+import json
+import mmap
+import os
+
+import joblib
+import numpy as np
+from forest_engine import _LEAF_VALUES_ARE_FRACTIONS, ArrayForest
+
+COMPACT_MAGIC = b"\x93FOREST1"
+ARRAY_ALIGNMENT = 64
+_ARRAYS = ("feature", "threshold", "left", "right", "value", "value_index", "roots")
+
+
+def is_compact(path: os.PathLike) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(COMPACT_MAGIC)) == COMPACT_MAGIC
+
+
+def _smallest_int(max_value: int) -> np.dtype:
+    for dtype in ("<u1", "<u2", "<i4"):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype("<i8")
+
+
+def _round_down_float32(threshold: np.ndarray) -> np.ndarray:
+    """
+    Convert float64 thresholds to the largest float32 not above them.
+
+    For any float32 x, x <= t holds exactly when x <= round_down(t), so the
+    float32 inputs take the same branches as with the float64 thresholds.
+    """
+    rounded = threshold.astype(np.float32)
+    too_high = rounded.astype(np.float64) > threshold
+    rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+    return rounded
+
+
+def _prune_tree(tree, n_classes: int):
+    """
+    Collapse the subtrees whose leaves all hold the same class distribution.
+
+    Such splits can't change any prediction. Returns the kept node ids in
+    depth-first order, whether each kept node is a leaf, the class
+    distribution of every node and the depth of the pruned tree.
+    """
+    children_left = tree.children_left
+    children_right = tree.children_right
+    value = tree.value[:, 0, :n_classes]
+    if not _LEAF_VALUES_ARE_FRACTIONS:
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        value = value / normalizer
+    value = value.copy()
+
+    # Children always have larger ids than their parent, so visiting the
+    # nodes backwards sees every subtree before its root
+    is_leaf = children_left == -1
+    for node in range(tree.node_count - 1, -1, -1):
+        if is_leaf[node]:
+            continue
+        left, right = children_left[node], children_right[node]
+        if is_leaf[left] and is_leaf[right] and np.array_equal(value[left], value[right]):
+            is_leaf[node] = True
+            value[node] = value[left]
+
+    kept, depth = [], 0
+    stack = [(0, 0)]
+    while stack:
+        node, node_depth = stack.pop()
+        kept.append(node)
+        depth = max(depth, node_depth)
+        if not is_leaf[node]:
+            stack.append((children_right[node], node_depth + 1))
+            stack.append((children_left[node], node_depth + 1))
+    return np.asarray(kept), is_leaf, value, depth
+
+
+def compact_forest(forest) -> ArrayForest:
+    """
+    Build a compact ArrayForest from a fitted RandomForestClassifier.
+
+    The forest is pruned, its thresholds are stored as float32, feature and
+    value indices use the smallest integer types that fit, and leaves share
+    deduplicated class distributions. Only what inference reads is kept.
+    Predictions and probabilities are identical to the original forest's.
+    """
+    if forest.n_outputs_ != 1:
+        raise ValueError("Only single-output forests are supported")
+    n_classes = len(forest.classes_)
+    feature, threshold, left, right, leaf_values, is_leaf, roots = [], [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        kept, tree_is_leaf, tree_value, depth = _prune_tree(tree, n_classes)
+        # Renumber the kept nodes globally
+        new_ids = np.full(tree.node_count, -1, dtype=np.int64)
+        new_ids[kept] = np.arange(len(kept)) + offset
+        kept_is_leaf = tree_is_leaf[kept]
+        roots.append(offset)
+        feature.append(np.where(kept_is_leaf, 0, tree.feature[kept]))
+        threshold.append(np.where(kept_is_leaf, 0.0, tree.threshold[kept]))
+        # Leaves loop back onto themselves, as in ArrayForest.from_sklearn
+        self_ids = new_ids[kept]
+        left.append(np.where(kept_is_leaf, self_ids, new_ids[tree.children_left[kept]]))
+        right.append(np.where(kept_is_leaf, self_ids, new_ids[tree.children_right[kept]]))
+        leaf_values.append(tree_value[kept])
+        is_leaf.append(kept_is_leaf)
+        max_depth = max(max_depth, depth)
+        offset += len(kept)
+
+    is_leaf = np.concatenate(is_leaf)
+    node_values = np.concatenate(leaf_values)
+    # Internal nodes point at row 0; their distribution is never read
+    value, leaf_index = np.unique(node_values[is_leaf], axis=0, return_inverse=True)
+    value_index = np.zeros(offset, dtype=_smallest_int(len(value)))
+    value_index[is_leaf] = leaf_index.ravel()
+    # Node links stay 64-bit: NumPy converts narrower index arrays on every
+    # gather, which makes the traversal about 1.7x slower
+    node_dtype = np.dtype("<i8")
+    return ArrayForest(
+        feature=np.concatenate(feature).astype(_smallest_int(forest.n_features_in_)),
+        threshold=_round_down_float32(np.concatenate(threshold)),
+        left=np.concatenate(left).astype(node_dtype),
+        right=np.concatenate(right).astype(node_dtype),
+        value=np.ascontiguousarray(value, dtype=np.float64),
+        roots=np.asarray(roots, dtype=node_dtype),
+        max_depth=max_depth,
+        classes=forest.classes_,
+        n_features=forest.n_features_in_,
+        value_index=value_index,
+    )
+
+
+def write_compact(bundle: dict, path: os.PathLike):
+    """
+    Write a model bundle as a compact artifact.
+
+    Parameters:
+    bundle (dict): A bundle written by app/model/model_preprocessing.py, with a RandomForestClassifier.
+    path (os.PathLike): Destination; written to a temporary file then renamed over it.
+    """
+    engine = compact_forest(bundle["model"])
+    arrays = {name: np.ascontiguousarray(getattr(engine, name)) for name in _ARRAYS}
+    # Going through a list turns object arrays of labels into fixed-width strings
+    arrays["classes"] = np.asarray(engine.classes_.tolist())
+
+    metadata = {key: value for key, value in bundle.items() if key != "model"}
+    metadata["max_depth"] = int(engine.max_depth)
+    layout, position = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": position,
+        }
+        position += -(-array.nbytes // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    # NumPy values in the metadata are stored as plain JSON values
+    header = json.dumps(
+        {"metadata": metadata, "arrays": layout}, default=lambda value: value.tolist()
+    ).encode()
+    preamble = len(COMPACT_MAGIC) + 8 + len(header)
+    data_start = -(-preamble // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+    partial = f"{path}.partial"
+    with open(partial, "wb") as f:
+        f.write(COMPACT_MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + position)
+    os.replace(partial, path)
+
+
+def load_compact(path: os.PathLike, mmap_arrays: bool = True) -> dict:
+    """
+    Load a compact artifact.
+
+    With mmap_arrays the arrays are views of a read-only memory map of the
+    file, so they are paged in on first use and shared between processes.
+
+    Returns:
+    dict: The bundle, with "model" an ArrayForest and "class_names" as a NumPy array.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(COMPACT_MAGIC)) != COMPACT_MAGIC:
+            raise ValueError(f"{path} is not a compact model artifact")
+        header_length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_length))
+        preamble = len(COMPACT_MAGIC) + 8 + header_length
+        data_start = -(-preamble // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+        if mmap_arrays:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            f.seek(0)
+            buffer = f.read()
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + spec["offset"]
+        ).reshape(spec["shape"])
+
+    metadata = header["metadata"]
+    forest = ArrayForest(
+        feature=arrays["feature"],
+        threshold=arrays["threshold"],
+        left=arrays["left"],
+        right=arrays["right"],
+        value=arrays["value"],
+        roots=arrays["roots"],
+        max_depth=metadata["max_depth"],
+        classes=arrays["classes"],
+        n_features=metadata["n_features"],
+        value_index=arrays["value_index"],
+    )
+    return dict(
+        metadata,
+        model=forest,
+        class_names=np.asarray(metadata["class_names"]),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a model bundle as a compact artifact")
+    parser.add_argument("source", help="Model bundle written by model_preprocessing.py")
+    parser.add_argument("destination")
+    args = parser.parse_args()
+
+    write_compact(joblib.load(args.source), args.destination)
+    print(
+        f"{args.source} ({os.path.getsize(args.source) / 1024:.0f} KiB) -> "
+        f"{args.destination} ({os.path.getsize(args.destination) / 1024:.0f} KiB)"
+    )
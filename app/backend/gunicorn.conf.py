@@ -0,0 +1,17 @@
+import os
+
+from inference import available_cpus
+
+# Multi-worker production setup:
+#   gunicorn main:app -c gunicorn.conf.py
+# The app (and the model) is loaded once in the master process before the
+# workers are forked, so the forest's arrays are shared copy-on-write instead
+# of being unpickled once per worker.
+bind = "0.0.0.0:8000"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# One worker per core by default. main.py reads the same variable to give each
+# worker an equal share of the cores for its inference pool.
+workers = int(os.getenv("WEB_CONCURRENCY", available_cpus()))
+os.environ["WEB_CONCURRENCY"] = str(workers)
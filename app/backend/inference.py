@@ -0,0 +1,267 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import joblib
+import numpy as np
+from compact_model import is_compact, load_compact
+from forest_engine import ArrayForest
+
+# Newest bundle layout written by app/model/model_preprocessing.py that this
+# backend understands
+BUNDLE_FORMAT_VERSION = 1
+
+# Bundles loaded in this process, keyed on (path, engine). The paths are
+# immutable snapshots written by the model registry. Forked pool workers
+# inherit this dict, so they share the parent's copy of the forest through
+# copy-on-write instead of each unpickling a private one.
+_bundles = OrderedDict()
+_MAX_CACHED_BUNDLES = 4
+# Bundles are loaded on worker threads and forgotten on the event loop
+_bundles_lock = threading.Lock()
+
+
+def _reset_bundles_lock():
+    # A process worker forked while another thread held the lock would
+    # otherwise never get it
+    global _bundles_lock
+    _bundles_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_bundles_lock)
+
+# Largest model call the ArrayForest engine handles. Its cost grows with the
+# rows while sklearn's is mostly fixed overhead, and sklearn is faster from
+# about a thousand rows (see app/benchmarks/engine_benchmark.py), so larger
+# calls go to the original forest when the bundle still has it.
+ARRAY_ENGINE_MAX_ROWS = int(os.getenv("ARRAY_ENGINE_MAX_ROWS", "1024"))
+
+
+def load_bundle(path: os.PathLike, mmap: bool = True, engine: str = "sklearn") -> dict:
+    """
+    Load a model bundle written by the training script.
+
+    With mmap enabled, joblib memory-maps the plain NumPy arrays of the
+    pickle, and compact artifacts are views of a map of the file. The trees
+    of a sklearn forest still copy their node arrays into private buffers
+    when unpickled, so forked workers only share them copy-on-write, when
+    the model was loaded before the fork. With the "array" engine the forest is
+    flattened into an ArrayForest for faster small-batch inference, and the
+    original forest is kept as "sklearn_model" for large batches. Compact
+    artifacts written by compact_model.py always use the ArrayForest engine.
+
+    Returns:
+    dict: The bundle, with "model" ready for inference and "class_names" as a NumPy array.
+    """
+    if is_compact(path):
+        bundle = load_compact(path, mmap_arrays=mmap)
+    else:
+        bundle = joblib.load(path, mmap_mode="r" if mmap else None)
+    if not isinstance(bundle, dict) or "format_version" not in bundle:
+        raise ValueError(
+            f"{path} is not a model bundle, re-run app/model/model_preprocessing.py"
+        )
+    if bundle["format_version"] > BUNDLE_FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has bundle format {bundle['format_version']}, "
+            f"this backend only supports up to {BUNDLE_FORMAT_VERSION}"
+        )
+    bundle = dict(bundle, class_names=np.asarray(bundle["class_names"]))
+    if engine not in ("sklearn", "array"):
+        raise ValueError(f"Unknown inference engine: {engine}")
+    if engine == "array" and not isinstance(bundle["model"], ArrayForest):
+        bundle["sklearn_model"] = bundle["model"]
+        bundle["model"] = ArrayForest.from_sklearn(bundle["model"])
+    return bundle
+
+
+def get_bundle(path: os.PathLike, mmap: bool = True, engine: str = "sklearn") -> dict:
+    """Return the bundle stored at path, loading it once per process."""
+    key = (path, engine)
+    with _bundles_lock:
+        bundle = _bundles.get(key)
+    if bundle is None:
+        # Loaded outside the lock; two threads may load the same snapshot once
+        bundle = load_bundle(path, mmap=mmap, engine=engine)
+        with _bundles_lock:
+            bundle = _bundles.setdefault(key, bundle)
+            while len(_bundles) > _MAX_CACHED_BUNDLES:
+                _bundles.popitem(last=False)
+    return bundle
+
+
+def forget_bundle(path: os.PathLike):
+    with _bundles_lock:
+        for key in [key for key in _bundles if key[0] == path]:
+            del _bundles[key]
+
+
+def score(bundle: dict, features: np.ndarray, with_proba: bool = False):
+    """
+    Run one vectorized model call over a block of rows.
+
+    Returns:
+    tuple: The index of the predicted class in bundle["class_names"] and the
+           class probabilities, or None when with_proba is False.
+    """
+    model = bundle["model"]
+    if len(features) > ARRAY_ENGINE_MAX_ROWS and "sklearn_model" in bundle:
+        model = bundle["sklearn_model"]
+    if with_proba:
+        # predict is the argmax of predict_proba, so reuse it instead of
+        # walking the forest twice
+        probabilities = model.predict_proba(features)
+        return np.argmax(probabilities, axis=1), probabilities
+    # sklearn keeps classes_ sorted, so this maps labels back to their index
+    return np.searchsorted(model.classes_, model.predict(features)), None
+
+
+def warmup(bundle: dict):
+    """Exercise the inference paths once so the first request doesn't pay for lazy initialisation."""
+    sizes = (1, 64)
+    if "sklearn_model" in bundle:
+        # Also the large calls that go to the original forest
+        sizes += (ARRAY_ENGINE_MAX_ROWS + 1,)
+    for n_rows in sizes:
+        features = np.zeros((n_rows, bundle["n_features"]))
+        score(bundle, features)
+        score(bundle, features, with_proba=True)
+
+
+def _score_from_path(path, features, with_proba, mmap, engine):
+    # Runs in process pool workers, which load each model version once
+    bundle = get_bundle(path, mmap=mmap, engine=engine)
+    return score(bundle, features, with_proba=with_proba)
+
+
+def _warmup_from_path(path, mmap, engine):
+    warmup(get_bundle(path, mmap=mmap, engine=engine))
+
+
+def _warmup_on_own_thread(bundle: dict, barrier: threading.Barrier):
+    warmup(bundle)
+    # Hold the thread until every warmup has started, so an idle thread can't
+    # take a second one and leave another thread cold
+    try:
+        barrier.wait(timeout=30)
+    except threading.BrokenBarrierError:
+        pass
+
+
+def available_cpus() -> int:
+    """Number of cores this process may use, honouring affinity and cgroup quotas."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        # cgroup v2 CPU quota, e.g. "200000 100000" for `docker run --cpus=2`
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def default_pool_size(web_workers: int = 1) -> int:
+    """Split the available cores evenly between the web workers."""
+    return max(1, available_cpus() // max(1, web_workers))
+
+
+class InferenceExecutor:
+    """
+    Run CPU-bound model calls off the event loop.
+
+    Attributes:
+    kind (str): "thread" for a thread pool, "process" for a process pool or "none" to score inline.
+    max_workers (int): Size of the pool (default is one worker per available core).
+    mmap (bool): Memory-map the model arrays when a worker loads the artifact (default is True).
+    engine (str): "sklearn" to call the estimator directly or "array" for the ArrayForest engine (default is "sklearn").
+    """
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        max_workers: Optional[int] = None,
+        mmap: bool = True,
+        engine: str = "sklearn",
+    ):
+        self.kind = kind
+        self.max_workers = max_workers or default_pool_size()
+        self.mmap = mmap
+        self.engine = engine
+        if kind == "thread":
+            self._pool = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="inference"
+            )
+        elif kind == "process":
+            # Fork so the workers start with the parent's already-loaded model
+            context = (
+                multiprocessing.get_context("fork")
+                if "fork" in multiprocessing.get_all_start_methods()
+                else None
+            )
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=context)
+        elif kind == "none":
+            self._pool = None
+        else:
+            raise ValueError(f"Unknown inference executor: {kind}")
+
+    async def score(self, model, features: np.ndarray, with_proba=False):
+        """
+        Score features with a resident model version.
+
+        Thread workers use model.bundle directly; process workers load the
+        version from the model.path snapshot once and keep it.
+        """
+        if self._pool is None:
+            return score(model.bundle, features, with_proba)
+        loop = asyncio.get_running_loop()
+        if self.kind == "process":
+            return await loop.run_in_executor(
+                self._pool,
+                _score_from_path,
+                model.path,
+                features,
+                with_proba,
+                self.mmap,
+                self.engine,
+            )
+        return await loop.run_in_executor(
+            self._pool, score, model.bundle, features, with_proba
+        )
+
+    async def warmup(self, model):
+        """
+        Warm up a resident model version in the workers of the pool.
+
+        Every thread of a thread pool runs one warmup. A process pool gets
+        one warmup per worker too, but an idle process may take two, and
+        then the process left out loads the version on its first call.
+        """
+        if self._pool is None:
+            return warmup(model.bundle)
+        loop = asyncio.get_running_loop()
+        if self.kind == "process":
+            call = (_warmup_from_path, model.path, self.mmap, self.engine)
+        else:
+            call = (_warmup_on_own_thread, model.bundle, threading.Barrier(self.max_workers))
+        # Wait for every worker before failing, so none is still reading the
+        # snapshot once the caller discards a version that failed
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._pool, *call) for _ in range(self.max_workers)),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,15 +1,254 @@
-import joblib
+import asyncio
+import hmac
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from time import perf_counter_ns
+
 import numpy as np
-from fastapi import FastAPI
-from sklearn.datasets import load_iris
+from batching import MicroBatcher
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from fastapi.routing import APIRoute
+from inference import InferenceExecutor, default_pool_size
+from metrics import Metrics, MetricsMiddleware
+from prediction_cache import PredictionCache
+from registry import ModelRegistry, ResidentModel
+from streaming import (
+    FullDuplexStreamingResponse,
+    ResultSpool,
+    encode_float32,
+    encode_ndjson,
+    iter_float32_chunks,
+    iter_ndjson_chunks,
+    result_dtype,
+)
+
+started_at = time.perf_counter()
+
+MODEL_PATH = os.getenv("MODEL_PATH", "model.joblib")
+# Memory-map the plain arrays of a joblib artifact, or a whole compact one,
+# when loading it; sklearn trees copy their nodes out of the map regardless
+MODEL_MMAP = os.getenv("MODEL_MMAP", "true").lower() == "true"
+# "sklearn" calls the estimator directly, "array" flattens the forest into the
+# ArrayForest engine which is much faster for small batches
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "sklearn")
+
+# Maximum number of rows scored by one vectorized predict call; larger
+# payloads are split into chunks of this size. Streamed bodies are decoded
+# and scored in chunks of this many rows.
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "4096"))
+
+# Opt-in coalescing of concurrent /predict/ calls into one model call
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "false").lower() == "true"
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "64"))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "2"))
+
+# Where model calls run: "thread", "process" or "none" (on the event loop).
+# By default the available cores are split evenly between the web workers.
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+INFERENCE_POOL_SIZE = int(
+    os.getenv("INFERENCE_POOL_SIZE", "0")
+) or default_pool_size(WEB_CONCURRENCY)
+
+# In-process LRU cache of /predict/ results keyed on the features rounded to
+# PREDICTION_CACHE_PRECISION decimals; a size of 0 disables it
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_PRECISION = int(os.getenv("PREDICTION_CACHE_PRECISION", "2"))
+
+# Number of model versions kept in memory, so a new artifact can be warmed up
+# and compared with the active one before it is promoted
+MODEL_MAX_RESIDENT = int(os.getenv("MODEL_MAX_RESIDENT", "2"))
+# Poll MODEL_PATH every MODEL_WATCH_INTERVAL seconds and hot-reload it when it
+# changes; 0 disables the watcher. With MODEL_AUTO_PROMOTE=false a reloaded
+# version stays resident until it is promoted through /models/.
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+MODEL_AUTO_PROMOTE = os.getenv("MODEL_AUTO_PROMOTE", "true").lower() == "true"
+# Token the /models/ endpoints that change state require in the X-Admin-Token
+# header; while it is unset, or with several web workers, those endpoints are
+# disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Load the model bundle. With `gunicorn --preload` this happens once in the
+# master process and the workers share it through copy-on-write.
+startup_timings = {}
+registry = ModelRegistry(
+    MODEL_PATH,
+    mmap=MODEL_MMAP,
+    engine=INFERENCE_ENGINE,
+    max_resident=MODEL_MAX_RESIDENT,
+)
+registry.load_active()
+startup_timings["load_bundle_seconds"] = time.perf_counter() - started_at
+
+ready = False
+executor = None
+batcher = None
+cache = (
+    PredictionCache(PREDICTION_CACHE_SIZE, precision=PREDICTION_CACHE_PRECISION)
+    if PREDICTION_CACHE_SIZE > 0
+    else None
+)
+
+
+async def predict_classes(rows: np.ndarray, model: ResidentModel) -> np.ndarray:
+    return (await predict_rows(rows, model))[0]
+
+
+async def read_json(request: Request) -> dict:
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Body must be valid JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=422, detail="Body must be a JSON object")
+    return data
+
+
+def json_response(content: dict, headers: dict = None) -> Response:
+    return Response(
+        content=json.dumps(content), media_type="application/json", headers=headers
+    )
+
+
+def resolve_model(version: str = None) -> ResidentModel:
+    """Pick the model version serving a request; 404 for an unknown version."""
+    try:
+        return registry.resolve(version or None)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {version} is not loaded")
+
+
+def forget_model(version: str):
+    # Called by the registry when a version leaves memory
+    if cache is not None:
+        cache.invalidate(version)
+    metrics.forget_model(version)
+
+
+async def warm_up_model(model: ResidentModel):
+    await executor.warmup(model)
+
+
+async def warm_up():
+    """Run warmup inferences on every inference worker, then report ready."""
+    global ready
+    warmup_started_at = time.perf_counter()
+    model = registry.active
+    try:
+        await warm_up_model(model)
+    except Exception:
+        logging.exception("Model warmup failed")
+        return
+    model.warm = True
+    startup_timings["warmup_seconds"] = time.perf_counter() - warmup_started_at
+    startup_timings["startup_seconds"] = time.perf_counter() - started_at
+    ready = True
+    logging.info(f"Model {model.version} ready: {startup_timings}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global executor, batcher
+    registry.on_unload = forget_model
+    # Pools are created per worker, after gunicorn has forked
+    executor = InferenceExecutor(
+        INFERENCE_EXECUTOR,
+        max_workers=INFERENCE_POOL_SIZE,
+        mmap=MODEL_MMAP,
+        engine=INFERENCE_ENGINE,
+    )
+    if MICRO_BATCHING:
+        batcher = MicroBatcher(
+            predict_classes,
+            max_batch_size=MICRO_BATCH_MAX_SIZE,
+            max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+        )
+        await batcher.start()
+    # Warm up in the background, so liveness probes are answered meanwhile
+    tasks = [asyncio.create_task(warm_up())]
+    if MODEL_WATCH_INTERVAL > 0:
+        tasks.append(
+            asyncio.create_task(
+                registry.watch(
+                    warm_up_model,
+                    interval=MODEL_WATCH_INTERVAL,
+                    promote=MODEL_AUTO_PROMOTE,
+                )
+            )
+        )
+    yield
+    for task in tasks:
+        task.cancel()
+    if batcher is not None:
+        await batcher.stop()
+    executor.shutdown()
+    registry.close()
+
 
-# Load the iris dataset
-iris = load_iris()
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+
+async def predict_rows(
+    features: np.ndarray, model: ResidentModel, with_proba: bool = False
+):
+    """
+    Score a block of feature rows with vectorized model calls.
+
+    The block is split into MAX_BATCH_SIZE chunks which are scored
+    concurrently on the inference executor.
 
-# Load the trained model
-model = joblib.load("model.joblib")
+    Parameters:
+    features (np.ndarray): A 2D array of shape (n_rows, n_features).
+    model (ResidentModel): The model version scoring the rows.
+    with_proba (bool): Also compute the class probabilities (default is False).
+
+    Returns:
+    tuple: The index of each predicted class in the bundle's class_names and
+           the probabilities as an (n_rows, n_classes) array, or None when
+           with_proba is False.
+    """
+    start_ns = perf_counter_ns()
+    results = await asyncio.gather(
+        *(
+            executor.score(model, features[start : start + MAX_BATCH_SIZE], with_proba)
+            for start in range(0, len(features), MAX_BATCH_SIZE)
+        )
+    )
+    metrics.observe_model(model.version, start_ns)
+    indices = np.concatenate([result[0] for result in results])
+    probabilities = (
+        np.concatenate([result[1] for result in results]) if with_proba else None
+    )
+    return indices, probabilities
+
+
+async def predict_one(row: np.ndarray, model: ResidentModel) -> int:
+    """Return the class index predicted for one feature row."""
+    if batcher is not None:
+        # Share one model call with the other requests currently in flight
+        return await batcher.submit(row, model)
+    indices, _ = await predict_rows(row.reshape(1, -1), model)
+    return indices[0]
+
+
+def parse_feature_matrix(rows, model: ResidentModel) -> np.ndarray:
+    """Validate a list of feature rows and convert it to an (N, n_features) array."""
+    try:
+        features = np.asarray(rows, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="Features must be numeric")
+    n_features = model.bundle["n_features"]
+    if features.ndim != 2 or features.shape[1] != n_features:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Features must be a list of rows with {n_features} values each",
+        )
+    return features
 
 
 # Define FastAPI endpoints
@@ -18,10 +257,357 @@ async def read_root():
     return {"message": "Welcome to the model API!"}
 
 
+@app.get("/health")
+async def health():
+    # Liveness: the process is up and serving the event loop
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def readiness():
+    # Readiness: the model is loaded and warmed up on every inference worker
+    if not ready:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {
+        "ready": True,
+        "model_version": registry.active.version,
+        "startup": startup_timings,
+    }
+
+
 @app.post("/predict/")
-async def predict_species(data: dict):
-    # Implement your prediction logic here using the loaded model
-    features = np.array(data["features"]).reshape(1, -1)
-    prediction = model.predict(features)
-    class_name = iris.target_names[prediction][0]
-    return {"class": class_name}
+async def predict_species(
+    request: Request, x_model_version: str = Header(default=None)
+):
+    endpoint = "/predict/"
+    t = perf_counter_ns()
+    # Resolve the version once, so a concurrent promotion can't mix models
+    # within a request
+    model = resolve_model(x_model_version)
+    with registry.using(model):
+        data = await read_json(request)
+        t = metrics.observe(endpoint, "decode", t)
+        row = parse_feature_matrix([data.get("features")], model)[0]
+        t = metrics.observe(endpoint, "parse", t)
+        metrics.add_rows(endpoint, 1)
+
+        if cache is None:
+            index = await predict_one(row, model)
+            t = metrics.observe(endpoint, "predict", t)
+            class_name = model.bundle["class_names"][index]
+            t = metrics.observe(endpoint, "lookup", t)
+        else:
+            # The version is part of the key, so a new model never serves the
+            # predictions of another one
+            key = cache.key(row, model.version)
+            class_name = cache.get(key)
+            t = metrics.observe(endpoint, "cache", t)
+            if class_name is None:
+                # The submitted row is scored; the rounding only applies to the key
+                index = await predict_one(row, model)
+                t = metrics.observe(endpoint, "predict", t)
+                class_name = model.bundle["class_names"][index]
+                t = metrics.observe(endpoint, "lookup", t)
+                cache.put(key, class_name)
+
+        response = json_response({"class": class_name}, {"X-Model-Version": model.version})
+        metrics.observe(endpoint, "encode", t)
+        return response
+
+
+@app.post("/predict/batch/")
+async def predict_species_batch(
+    request: Request, x_model_version: str = Header(default=None)
+):
+    # Score all the rows of the payload in as few model calls as possible
+    endpoint = "/predict/batch/"
+    t = perf_counter_ns()
+    model = resolve_model(x_model_version)
+    with registry.using(model):
+        data = await read_json(request)
+        t = metrics.observe(endpoint, "decode", t)
+        features = parse_feature_matrix(data.get("features"), model)
+        with_proba = bool(data.get("probabilities", False))
+        t = metrics.observe(endpoint, "parse", t)
+        metrics.add_rows(endpoint, len(features))
+
+        indices, probabilities = await predict_rows(features, model, with_proba=with_proba)
+        t = metrics.observe(endpoint, "predict", t)
+        class_names = model.bundle["class_names"]
+        content = {"classes": class_names[indices].tolist()}
+        t = metrics.observe(endpoint, "lookup", t)
+
+        if with_proba:
+            content["labels"] = class_names.tolist()
+            content["probabilities"] = probabilities.tolist()
+        response = json_response(content, {"X-Model-Version": model.version})
+        metrics.observe(endpoint, "encode", t)
+        return response
+
+
+@app.post("/predict/stream/")
+async def predict_species_stream(
+    request: Request,
+    probabilities: bool = False,
+    x_model_version: str = Header(default=None),
+):
+    """
+    Score a streamed body chunk by chunk and stream the results back.
+
+    Accepted bodies:
+    - application/x-ndjson: one feature list (or {"features": [...]}) per line.
+      The response is NDJSON with one {"class": ...} object per row.
+    - application/octet-stream: little-endian float32 rows, raw or as a .npy
+      file. The response is one <i4 class index per row, followed by n_classes
+      <f4 probabilities with ?probabilities=true, as described by the
+      X-Result-Dtype header. The class names are a JSON list in the
+      X-Class-Names header.
+
+    At most MAX_BATCH_SIZE rows are decoded at a time, and results the client
+    hasn't read yet are spooled to disk, so memory stays flat whatever the
+    size of the body.
+    """
+    # The whole stream is scored by the version resolved here, and its
+    # snapshot is kept until the scoring task is done with it
+    model = registry.acquire(resolve_model(x_model_version))
+    try:
+        bundle = model.bundle
+        content_type = request.headers.get("content-type", "").split(";")[0].strip()
+        if content_type in ("application/x-ndjson", "application/jsonl"):
+            chunks = iter_ndjson_chunks(request.stream(), bundle["n_features"], MAX_BATCH_SIZE)
+            media_type = "application/x-ndjson"
+            headers = {"X-Model-Version": model.version}
+        elif content_type == "application/octet-stream":
+            chunks = iter_float32_chunks(request.stream(), bundle["n_features"], MAX_BATCH_SIZE)
+            media_type = "application/octet-stream"
+            headers = {
+                "X-Model-Version": model.version,
+                # JSON, so class names can hold commas; non-ASCII is escaped
+                "X-Class-Names": json.dumps(bundle["class_names"].tolist()),
+                "X-Result-Dtype": result_dtype(len(bundle["class_names"]), probabilities),
+            }
+        else:
+            raise HTTPException(
+                status_code=415,
+                detail="Send application/x-ndjson or application/octet-stream",
+            )
+
+        # Decode the first chunk up front, so a malformed body still gets a 422
+        try:
+            first_chunk = await anext(chunks, None)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    except BaseException:
+        registry.release(model)
+        raise
+
+    async def score_chunks(spool: ResultSpool):
+        endpoint = "/predict/stream/"
+        chunk = first_chunk
+        try:
+            while chunk is not None:
+                metrics.add_rows(endpoint, len(chunk))
+                t = perf_counter_ns()
+                indices, chunk_probabilities = await executor.score(
+                    model, chunk, probabilities
+                )
+                metrics.observe_model(model.version, t)
+                t = metrics.observe(endpoint, "predict", t)
+                if media_type == "application/x-ndjson":
+                    class_names = bundle["class_names"][indices]
+                    t = metrics.observe(endpoint, "lookup", t)
+                    spool.write(encode_ndjson(class_names, chunk_probabilities))
+                else:
+                    spool.write(encode_float32(indices, chunk_probabilities))
+                metrics.observe(endpoint, "encode", t)
+                chunk = await anext(chunks, None)
+        except ValueError as e:
+            if media_type != "application/x-ndjson":
+                spool.close(error=e)
+                return
+            # The status line is already sent, so report the error in-band
+            spool.write((json.dumps({"error": str(e)}) + "\n").encode())
+        except Exception as e:
+            spool.close(error=e)
+            return
+        spool.close()
+
+    async def results():
+        spool = ResultSpool()
+        # Keep reading the body while the client is still uploading it
+        scoring = asyncio.create_task(score_chunks(spool))
+        scoring.add_done_callback(lambda _: registry.release(model))
+        try:
+            async for data in spool:
+                yield data
+        finally:
+            scoring.cancel()
+
+    return FullDuplexStreamingResponse(results(), media_type=media_type, headers=headers)
+
+
+def check_model_admin(token):
+    if WEB_CONCURRENCY > 1:
+        # Each web worker holds its own registry, so a call would only change
+        # the worker that happens to receive it
+        raise HTTPException(
+            status_code=409,
+            detail="Model administration needs a single web worker;"
+            " with several, replace MODEL_PATH and let MODEL_WATCH_INTERVAL reload it",
+        )
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=403, detail="Model administration is disabled, set ADMIN_TOKEN"
+        )
+    if not hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def artifact_path(path: str) -> str:
+    """Resolve an artifact name inside the directory of MODEL_PATH; 422 for anything outside it."""
+    model_dir = os.path.realpath(os.path.dirname(os.path.abspath(MODEL_PATH)))
+    resolved = os.path.realpath(os.path.join(model_dir, path))
+    if os.path.dirname(resolved) != model_dir:
+        raise HTTPException(
+            status_code=422, detail="The artifact must be a file in the MODEL_PATH directory"
+        )
+    return resolved
+
+
+def describe_models() -> dict:
+    return {
+        "active": registry.active.version,
+        "routes": registry.routes,
+        "resident": [model.describe() for model in registry.resident.values()],
+    }
+
+
+@app.get("/models")
+async def list_models():
+    return describe_models()
+
+
+@app.post("/models/reload")
+async def reload_model(request: Request, x_admin_token: str = Header(default=None)):
+    """
+    Load and warm up a model artifact while the current version keeps serving.
+
+    The optional JSON body holds "path", the name of an artifact in the
+    MODEL_PATH directory (default is MODEL_PATH), and "promote" (default is true).
+    """
+    check_model_admin(x_admin_token)
+    data = await read_json(request) if await request.body() else {}
+    path = data.get("path")
+    if path is not None and not isinstance(path, str):
+        raise HTTPException(status_code=422, detail="path must be a string")
+    try:
+        model = await registry.reload(
+            warm_up_model,
+            path=artifact_path(path) if path else None,
+            promote=bool(data.get("promote", True)),
+        )
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Model could not be loaded: {e}")
+    return {"loaded": model.version, **describe_models()}
+
+
+@app.post("/models/{version}/promote")
+async def promote_model(version: str, x_admin_token: str = Header(default=None)):
+    check_model_admin(x_admin_token)
+    model = resolve_model(version)
+    if not model.warm:
+        with registry.using(model):
+            await warm_up_model(model)
+        model.warm = True
+    registry.promote(model.version)
+    return describe_models()
+
+
+@app.put("/models/routing")
+async def route_models(request: Request, x_admin_token: str = Header(default=None)):
+    """Split unpinned requests between resident versions, e.g. {"weights": {"a": 0.9, "b": 0.1}}."""
+    check_model_admin(x_admin_token)
+    weights = (await read_json(request)).get("weights") or {}
+    if not isinstance(weights, dict) or not all(
+        isinstance(weight, (int, float)) and weight >= 0 for weight in weights.values()
+    ):
+        raise HTTPException(status_code=422, detail="Weights must be non-negative numbers")
+    try:
+        registry.set_routes(weights)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return describe_models()
+
+
+@app.delete("/models/{version}")
+async def unload_model(version: str, x_admin_token: str = Header(default=None)):
+    check_model_admin(x_admin_token)
+    resolve_model(version)
+    try:
+        registry.unload(version)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return describe_models()
+
+
+@app.get("/batching/stats")
+async def batching_stats():
+    if batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **batcher.stats()}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    metrics.info = {
+        "model_version": registry.active.version,
+        "engine": INFERENCE_ENGINE,
+        "executor": INFERENCE_EXECUTOR,
+    }
+    extra = {
+        "model_api_model_reloads_total": (
+            "counter", "Model artifacts loaded after startup.", registry.reloads_total
+        ),
+        "model_api_model_reload_failures_total": (
+            "counter", "Model artifacts that failed to load or warm up.", registry.reload_failures_total
+        ),
+        "model_api_models_resident": (
+            "gauge", "Model versions held in memory.", len(registry.resident)
+        ),
+    }
+    if batcher is not None:
+        stats = batcher.stats()
+        extra["model_api_microbatch_batches_total"] = (
+            "counter", "Micro-batches flushed.", stats["batches_total"]
+        )
+        extra["model_api_microbatch_requests_total"] = (
+            "counter", "Requests scored through micro-batches.", stats["requests_total"]
+        )
+        extra["model_api_microbatch_queue_delay_seconds_total"] = (
+            "counter", "Time requests waited for their micro-batch.", stats["queue_delay_seconds_total"]
+        )
+    if cache is not None:
+        stats = cache.stats()
+        for name in ("hits", "misses", "evictions", "invalidations"):
+            extra[f"model_api_cache_{name}_total"] = (
+                "counter", f"Prediction cache {name}.", stats[name]
+            )
+        extra["model_api_cache_size"] = ("gauge", "Prediction cache entries.", stats["size"])
+    return PlainTextResponse(
+        metrics.render(extra), media_type="text/plain; version=0.0.4"
+    )
+
+
+# Track every API route individually; the metrics are allocated up front so
+# recording a request only increments integers
+metrics = Metrics(
+    endpoints=[route.path for route in app.routes if isinstance(route, APIRoute)]
+)
+app.add_middleware(MetricsMiddleware, metrics=metrics, routes=app.routes)
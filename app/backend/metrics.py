@@ -0,0 +1,239 @@
+from bisect import bisect_left
+from time import perf_counter_ns
+
+from starlette.routing import Match
+
+# Upper bounds of the latency histogram buckets, in nanoseconds (50µs to 10s)
+LATENCY_BUCKETS_NS = (
+    50_000,
+    100_000,
+    250_000,
+    500_000,
+    1_000_000,
+    2_500_000,
+    5_000_000,
+    10_000_000,
+    25_000_000,
+    50_000_000,
+    100_000_000,
+    250_000_000,
+    500_000_000,
+    1_000_000_000,
+    2_500_000_000,
+    10_000_000_000,
+)
+
+# Stages a scoring request goes through
+STAGES = ("decode", "parse", "cache", "predict", "lookup", "encode")
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations; observing one is a few integer increments."""
+
+    __slots__ = ("counts", "sum_ns", "count")
+
+    def __init__(self):
+        # One slot per bucket plus the +Inf bucket
+        self.counts = [0] * (len(LATENCY_BUCKETS_NS) + 1)
+        self.sum_ns = 0
+        self.count = 0
+
+    def observe_ns(self, duration_ns: int):
+        self.counts[bisect_left(LATENCY_BUCKETS_NS, duration_ns)] += 1
+        self.sum_ns += duration_ns
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_NS, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound / 1e9:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum_ns / 1e9}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    """
+    Request, row and per-stage latency metrics of the model API.
+
+    Every counter and histogram is allocated up front for a fixed set of
+    endpoints, so recording a request only increments integers. The metrics
+    are rendered in the Prometheus text format.
+
+    Attributes:
+    endpoints (tuple[str]): Route templates tracked individually, e.g.
+        "/models/{version}"; requests matching no route are tracked as "other".
+    """
+
+    def __init__(self, endpoints=()):
+        self.endpoints = tuple(endpoints) + ("other",)
+        self.requests_total = dict.fromkeys(self.endpoints, 0)
+        # Responses with a 4xx or 5xx status; an exception counts as a 5xx
+        self.errors_total = {endpoint: {"4xx": 0, "5xx": 0} for endpoint in self.endpoints}
+        self.rows_total = dict.fromkeys(self.endpoints, 0)
+        self.in_flight = dict.fromkeys(self.endpoints, 0)
+        self.request_latency = {endpoint: LatencyHistogram() for endpoint in self.endpoints}
+        self.stage_latency = {
+            endpoint: {stage: LatencyHistogram() for stage in STAGES}
+            for endpoint in self.endpoints
+        }
+        # Latency of the model calls of each resident model version
+        self.model_latency = {}
+        # Labels of the model_info metric, e.g. the model version
+        self.info = {}
+
+    def endpoint(self, route_path: str) -> str:
+        return route_path if route_path in self.requests_total else "other"
+
+    def add_error(self, endpoint: str, status: int):
+        self.errors_total[endpoint]["4xx" if status < 500 else "5xx"] += 1
+
+    def observe(self, endpoint: str, stage: str, start_ns: int) -> int:
+        """Record the time spent in stage since start_ns and return the current time."""
+        now = perf_counter_ns()
+        self.stage_latency[endpoint][stage].observe_ns(now - start_ns)
+        return now
+
+    def observe_model(self, version: str, start_ns: int):
+        """Record the duration of a model call made by one model version."""
+        histogram = self.model_latency.get(version)
+        if histogram is None:
+            histogram = self.model_latency[version] = LatencyHistogram()
+        histogram.observe_ns(perf_counter_ns() - start_ns)
+
+    def forget_model(self, version: str):
+        self.model_latency.pop(version, None)
+
+    def add_rows(self, endpoint: str, n_rows: int):
+        self.rows_total[endpoint] += n_rows
+
+    def render(self, extra: dict = None) -> str:
+        """
+        Render all metrics in the Prometheus text format.
+
+        Parameters:
+        extra (dict): Additional gauges and counters, mapping a metric name to (type, help, value).
+        """
+        lines = [
+            "# HELP model_api_model_info Model currently served.",
+            "# TYPE model_api_model_info gauge",
+            "model_api_model_info{"
+            + ",".join(f'{key}="{value}"' for key, value in self.info.items())
+            + "} 1",
+        ]
+        for name, kind, help_text, values in (
+            ("model_api_requests_total", "counter", "HTTP requests handled.", self.requests_total),
+            ("model_api_rows_total", "counter", "Feature rows scored.", self.rows_total),
+            ("model_api_requests_in_flight", "gauge", "HTTP requests being handled.", self.in_flight),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for endpoint, value in values.items():
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        lines.append("# HELP model_api_errors_total HTTP requests answered with a 4xx or 5xx status.")
+        lines.append("# TYPE model_api_errors_total counter")
+        for endpoint, statuses in self.errors_total.items():
+            for status, value in statuses.items():
+                lines.append(
+                    f'model_api_errors_total{{endpoint="{endpoint}",status="{status}"}} {value}'
+                )
+
+        lines.append("# HELP model_api_request_latency_seconds End-to-end HTTP request latency.")
+        lines.append("# TYPE model_api_request_latency_seconds histogram")
+        for endpoint, histogram in self.request_latency.items():
+            if histogram.count:
+                lines += histogram.render(
+                    "model_api_request_latency_seconds", f'endpoint="{endpoint}"'
+                )
+
+        lines.append("# HELP model_api_stage_latency_seconds Latency of each stage of a scoring request.")
+        lines.append("# TYPE model_api_stage_latency_seconds histogram")
+        for endpoint, stages in self.stage_latency.items():
+            for stage, histogram in stages.items():
+                if histogram.count:
+                    lines += histogram.render(
+                        "model_api_stage_latency_seconds",
+                        f'endpoint="{endpoint}",stage="{stage}"',
+                    )
+
+        lines.append("# HELP model_api_model_predict_latency_seconds Latency of the model calls of each model version.")
+        lines.append("# TYPE model_api_model_predict_latency_seconds histogram")
+        for version, histogram in self.model_latency.items():
+            lines += histogram.render(
+                "model_api_model_predict_latency_seconds", f'model_version="{version}"'
+            )
+
+        for name, (kind, help_text, value) in (extra or {}).items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests, error responses, in-flight requests and
+    end-to-end latency per route template.
+
+    Attributes:
+    routes (list): The routes of the app, matched against each request to find its template.
+    """
+
+    # Requests are matched once per method and path, up to this many pairs
+    _MAX_CACHED_PATHS = 1024
+
+    def __init__(self, app, metrics: Metrics, routes=()):
+        self.app = app
+        self.metrics = metrics
+        self.routes = routes
+        self._endpoints = {}
+
+    def _endpoint(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            # The same matching as the router, which only sets scope["route"]
+            # once the request is inside the app
+            endpoint = "other"
+            for route in self.routes:
+                match, _ = route.matches(scope)
+                if match != Match.NONE:
+                    endpoint = self.metrics.endpoint(getattr(route, "path", ""))
+                    if match == Match.FULL:
+                        break
+            if len(self._endpoints) >= self._MAX_CACHED_PATHS:
+                self._endpoints.clear()
+            self._endpoints[key] = endpoint
+        return endpoint
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        metrics = self.metrics
+        endpoint = self._endpoint(scope)
+        metrics.requests_total[endpoint] += 1
+        metrics.in_flight[endpoint] += 1
+        start_ns = perf_counter_ns()
+        status = None
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        except Exception:
+            # Also when a streamed response fails after a 200 was sent
+            status = 500
+            raise
+        finally:
+            if status is not None and status >= 400:
+                metrics.add_error(endpoint, status)
+            metrics.in_flight[endpoint] -= 1
+            metrics.request_latency[endpoint].observe_ns(perf_counter_ns() - start_ns)
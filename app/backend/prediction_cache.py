@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from typing import Hashable
+
+import numpy as np
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of predictions keyed on quantized feature vectors.
+
+    Keys are the feature values rounded to a fixed number of decimals, so the
+    slider values sent by the frontend map onto a small set of entries. The
+    model version is part of the key, so a new model never serves the
+    predictions of the previous one, and the entries of a version are dropped
+    when it is unloaded.
+
+    Attributes:
+    max_size (int): Maximum number of cached predictions (default is 10000).
+    precision (int): Number of decimals the features are rounded to (default is 2).
+    """
+
+    def __init__(self, max_size: int = 10000, precision: int = 2):
+        self.max_size = max_size
+        self.precision = precision
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def quantize(self, row: np.ndarray) -> np.ndarray:
+        return np.round(row, self.precision)
+
+    def key(self, row: np.ndarray, model_version: Hashable) -> tuple:
+        return (model_version, *self.quantize(row).tolist())
+
+    def get(self, key: tuple):
+        """Return the cached prediction for key, or None on a miss."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: tuple, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, model_version: Hashable = None):
+        """Drop the entries of one model version, or all entries."""
+        if model_version is None:
+            stale = list(self._entries)
+        else:
+            stale = [key for key in self._entries if key[0] == model_version]
+        if stale:
+            self.invalidations += 1
+        for key in stale:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "max_size": self.max_size,
+            "precision": self.precision,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,336 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from bisect import bisect_right
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from inference import forget_bundle, get_bundle
+
+
+class ResidentModel:
+    """
+    A model version loaded in memory.
+
+    Attributes:
+    version (str): Unique id of the version: the bundle's model_version plus a content hash.
+    path (str): Immutable snapshot of the artifact this version was loaded from.
+    bundle (dict): The loaded bundle, as returned by get_bundle.
+    load_seconds (float): Time spent reading and unpickling the artifact.
+    loaded_at (float): Unix time at which the version was loaded.
+    """
+
+    def __init__(self, version: str, path: str, bundle: dict, load_seconds: float):
+        self.version = version
+        self.path = path
+        self.bundle = bundle
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.warm = False
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "model_version": self.bundle["model_version"],
+            "trained_at": self.bundle.get("trained_at"),
+            "load_seconds": self.load_seconds,
+            "loaded_at": self.loaded_at,
+            "warm": self.warm,
+        }
+
+
+class ModelRegistry:
+    """
+    Keep one or more model versions resident and swap them without downtime.
+
+    New artifacts are loaded and warmed up in the background while requests
+    keep being served by the active version, then promoted with a single
+    attribute assignment. Requests already in flight finish on the version
+    they started with. Besides the active version, requests can be routed to
+    any resident version by name or by a weighted split, to shadow-test a new
+    forest before promoting it.
+
+    Attributes:
+    path (str): Model artifact to watch.
+    mmap (bool): Memory-map the model arrays when loading (default is True).
+    engine (str): Inference engine the bundles are prepared for (default is "sklearn").
+    max_resident (int): Maximum number of versions kept in memory (default is 2).
+    snapshot_dir (str): Directory holding an immutable copy of every resident artifact.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mmap: bool = True,
+        engine: str = "sklearn",
+        max_resident: int = 2,
+        snapshot_dir: Optional[str] = None,
+    ):
+        self.path = path
+        self.mmap = mmap
+        self.engine = engine
+        self.max_resident = max(1, max_resident)
+        self.snapshot_dir = snapshot_dir or tempfile.mkdtemp(prefix="model-store-")
+        # With `gunicorn --preload` the registry is created before the fork and
+        # the workers share the snapshot directory; only its creator removes it
+        self._owner_pid = os.getpid()
+        self.resident = OrderedDict()
+        self.active: Optional[ResidentModel] = None
+        self.reloads_total = 0
+        self.reload_failures_total = 0
+        # Weighted split of the requests that don't ask for a version
+        self._routes = []
+        self._cumulative_weights = []
+        self._watched_stat = None
+        self._failed_stat = None
+        self._loading = asyncio.Lock()
+        # Requests using each snapshot, and the snapshots of versions that
+        # left memory, removed once no request or process worker needs them
+        self._users = Counter()
+        self._retired = set()
+        # Called with the version id whenever a version leaves memory
+        self.on_unload: Optional[Callable[[str], None]] = None
+
+    def load(self, path: Optional[str] = None) -> ResidentModel:
+        """
+        Load an artifact into a new resident version, or return the resident
+        version with the same content.
+        """
+        return self._add(self._read(path))
+
+    def _read(self, path: Optional[str] = None) -> ResidentModel:
+        # The blocking part of a load; it doesn't touch the registry's state,
+        # so it can run in a thread while requests are served
+        path = path or self.path
+        started_at = time.perf_counter()
+        with open(path, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        for model in list(self.resident.values()):
+            if model.version.endswith(digest):
+                return model
+
+        # Load from a private snapshot, so the version stays available to
+        # process workers after the watched file has been replaced
+        snapshot = os.path.join(self.snapshot_dir, f"{digest}.joblib")
+        if not os.path.exists(snapshot):
+            # Write then rename, so readers never see a partial snapshot
+            partial = f"{snapshot}.{os.getpid()}.partial"
+            with open(partial, "wb") as f:
+                f.write(content)
+            os.replace(partial, snapshot)
+        try:
+            bundle = get_bundle(snapshot, mmap=self.mmap, engine=self.engine)
+        except Exception:
+            os.remove(snapshot)
+            raise
+        model = ResidentModel(
+            version=f"{bundle['model_version']}-{digest}",
+            path=snapshot,
+            bundle=bundle,
+            load_seconds=time.perf_counter() - started_at,
+        )
+        return model
+
+    def _add(self, model: ResidentModel) -> ResidentModel:
+        if model.version not in self.resident:
+            self.resident[model.version] = model
+            self._evict(keep=model.version)
+        return model
+
+    def load_active(self) -> ResidentModel:
+        """Load the watched artifact synchronously and make it the active version."""
+        stat = os.stat(self.path)
+        model = self.load()
+        self._watched_stat = (stat.st_mtime_ns, stat.st_size)
+        return self.promote(model.version)
+
+    def promote(self, version: str) -> ResidentModel:
+        """Make a resident version the active one and send it all unpinned requests."""
+        model = self.resident[version]
+        # A single assignment, so every request sees either version in full
+        self.active = model
+        if self._routes:
+            # A split would keep sending the requests to the versions it names
+            logging.info(f"Traffic split {self.routes} dropped")
+            self.set_routes({})
+        logging.info(f"Model {version} promoted")
+        return model
+
+    def unload(self, version: str):
+        if self.active is not None and version == self.active.version:
+            raise ValueError("The active model can't be unloaded")
+        model = self.resident.pop(version)
+        routes = {v: w for v, w in self._routes if v != version}
+        # What is left of a split between two versions would pin all the
+        # unpinned requests to the other one, whatever is active
+        self.set_routes(routes if len(routes) > 1 else {})
+        self._remove_snapshot(model)
+
+    def set_routes(self, weights: dict):
+        """Split the requests that don't ask for a version between resident versions by weight."""
+        unknown = set(weights) - set(self.resident)
+        if unknown:
+            raise KeyError(f"Unknown model versions: {sorted(unknown)}")
+        routes = [(version, weight) for version, weight in weights.items() if weight > 0]
+        cumulative, total = [], 0.0
+        for _, weight in routes:
+            total += weight
+            cumulative.append(total)
+        self._routes = routes
+        self._cumulative_weights = cumulative
+
+    @property
+    def routes(self) -> dict:
+        return dict(self._routes)
+
+    def resolve(self, version: Optional[str] = None) -> ResidentModel:
+        """
+        Pick the model serving a request.
+
+        Returns the requested version if given, else a version drawn from the
+        weighted split, else the active version.
+        """
+        if version is not None:
+            return self.resident[version]
+        if self._routes:
+            total = self._cumulative_weights[-1]
+            index = bisect_right(self._cumulative_weights, random.random() * total)
+            return self.resident[self._routes[min(index, len(self._routes) - 1)][0]]
+        return self.active
+
+    def _evict(self, keep: str):
+        # Drop the oldest versions that are neither active, routed to nor kept
+        protected = {keep} | {version for version, _ in self._routes}
+        if self.active is not None:
+            protected.add(self.active.version)
+        for version in list(self.resident):
+            if len(self.resident) <= self.max_resident:
+                break
+            if version not in protected:
+                self._remove_snapshot(self.resident.pop(version))
+
+    def _remove_snapshot(self, model: ResidentModel):
+        if self.on_unload is not None:
+            self.on_unload(model.version)
+        self._retire(model)
+
+    def _retire(self, model: ResidentModel):
+        forget_bundle(model.path)
+        self._retired.add(model.path)
+        self._remove_unused()
+
+    def _remove_unused(self):
+        # A load in progress may be writing or reading a retired snapshot
+        # again; it sweeps the snapshots once it is done
+        if self._loading.locked():
+            return
+        in_use = {model.path for model in self.resident.values()}
+        for path in list(self._retired):
+            if self._users[path] or path in in_use:
+                continue
+            self._retired.discard(path)
+            # Another worker sharing the directory may have removed it already
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def acquire(self, model: ResidentModel) -> ResidentModel:
+        """Keep the snapshot of a version on disk until release, even if it leaves memory."""
+        self._users[model.path] += 1
+        return model
+
+    def release(self, model: ResidentModel):
+        self._users[model.path] -= 1
+        if not self._users[model.path]:
+            del self._users[model.path]
+            if model.path in self._retired:
+                self._remove_unused()
+
+    @contextlib.contextmanager
+    def using(self, model: ResidentModel):
+        self.acquire(model)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    def artifact_changed(self) -> bool:
+        """Cheap check of the watched file, based on its size and modification time."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        # A broken artifact is retried once it is written again
+        return (stat.st_mtime_ns, stat.st_size) not in (self._watched_stat, self._failed_stat)
+
+    async def reload(
+        self,
+        warmup: Callable[[ResidentModel], Awaitable[None]],
+        path: Optional[str] = None,
+        promote: bool = True,
+    ) -> ResidentModel:
+        """
+        Load and warm up an artifact in the background, then optionally promote it.
+
+        Requests keep being served by the current versions meanwhile. A new
+        version only becomes resident once its warmup succeeded, so a broken
+        artifact never takes the place of a working version.
+        """
+        try:
+            async with self._loading:
+                return await self._reload(warmup, path, promote)
+        finally:
+            self._remove_unused()
+
+    async def _reload(self, warmup, path: Optional[str], promote: bool) -> ResidentModel:
+        if path is None:
+            stat = os.stat(self.path)
+        model = None
+        try:
+            model = await asyncio.to_thread(self._read, path)
+            if not model.warm:
+                await warmup(model)
+                model.warm = True
+        except Exception:
+            self.reload_failures_total += 1
+            if path is None:
+                self._failed_stat = (stat.st_mtime_ns, stat.st_size)
+            if model is not None and model.version not in self.resident:
+                self._retire(model)
+            raise
+        model = self._add(model)
+        if path is None:
+            # Only remember the artifact once it loaded, so a half-written
+            # file is retried on the next check
+            self._watched_stat = (stat.st_mtime_ns, stat.st_size)
+        self.reloads_total += 1
+        if promote and model is not self.active:
+            self.promote(model.version)
+        return model
+
+    async def watch(
+        self,
+        warmup: Callable[[ResidentModel], Awaitable[None]],
+        interval: float = 5.0,
+        promote: bool = True,
+    ):
+        """Poll the watched artifact and hot-reload it whenever it changes."""
+        while True:
+            await asyncio.sleep(interval)
+            if not self.artifact_changed():
+                continue
+            try:
+                model = await self.reload(warmup, promote=promote)
+                logging.info(f"Model artifact reloaded as {model.version}")
+            except Exception:
+                logging.exception(f"Reloading {self.path} failed, keeping the current model")
+
+    def close(self):
+        if os.getpid() == self._owner_pid:
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
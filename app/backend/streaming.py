@@ -0,0 +1,248 @@
+import asyncio
+import io
+import json
+import tempfile
+from typing import AsyncIterator, Optional
+
+import numpy as np
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+
+NPY_MAGIC = b"\x93NUMPY"
+# Only little-endian float32 rows are accepted on the binary path
+FLOAT32_LE = np.dtype("<f4")
+# Longest NDJSON line accepted, so a body without newlines isn't buffered whole
+MAX_NDJSON_LINE_BYTES = 64 * 1024
+
+
+async def iter_ndjson_chunks(
+    body: AsyncIterator[bytes], n_features: int, chunk_rows: int
+) -> AsyncIterator[np.ndarray]:
+    """
+    Decode an NDJSON request body into (chunk_rows, n_features) feature blocks.
+
+    Every line is either a list of feature values or an object with a
+    "features" list. Blank lines are skipped. Only one block of rows is held
+    in memory at a time, and lines longer than MAX_NDJSON_LINE_BYTES are
+    rejected.
+    """
+    pending = b""
+    rows = []
+    line_number = 0
+    async for data in body:
+        lines = (pending + data).split(b"\n")
+        # The last piece may be a partial line continued in the next read
+        pending = lines.pop()
+        if len(pending) > MAX_NDJSON_LINE_BYTES:
+            raise ValueError(
+                f"Line {line_number + len(lines) + 1} is longer than"
+                f" {MAX_NDJSON_LINE_BYTES} bytes"
+            )
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                rows.append(_parse_ndjson_line(line, n_features, line_number))
+            if len(rows) == chunk_rows:
+                yield np.array(rows, dtype=np.float64)
+                rows = []
+    if pending.strip():
+        rows.append(_parse_ndjson_line(pending, n_features, line_number + 1))
+    if rows:
+        yield np.array(rows, dtype=np.float64)
+
+
+def _parse_ndjson_line(line: bytes, n_features: int, line_number: int) -> list:
+    try:
+        row = json.loads(line)
+    except ValueError:
+        raise ValueError(f"Line {line_number} is not valid JSON")
+    if isinstance(row, dict):
+        row = row.get("features")
+    if (
+        not isinstance(row, list)
+        or len(row) != n_features
+        # bool is a subclass of int, but true/false aren't measurements
+        or not all(
+            isinstance(value, (int, float)) and not isinstance(value, bool) for value in row
+        )
+    ):
+        raise ValueError(f"Line {line_number} must hold {n_features} numeric features")
+    return row
+
+
+async def iter_float32_chunks(
+    body: AsyncIterator[bytes], n_features: int, chunk_rows: int
+) -> AsyncIterator[np.ndarray]:
+    """
+    Decode a binary request body into (chunk_rows, n_features) feature blocks.
+
+    The body is either raw little-endian float32 values in row-major order or
+    a .npy file holding such a 2D array. The buffered bytes are viewed as a
+    NumPy array directly, without creating a Python object per row.
+    """
+    row_bytes = n_features * FLOAT32_LE.itemsize
+    chunk_bytes = chunk_rows * row_bytes
+    buffer = bytearray()
+    header_checked = False
+    async for data in body:
+        buffer += data
+        if not header_checked:
+            if len(buffer) < len(NPY_MAGIC):
+                continue
+            if buffer.startswith(NPY_MAGIC):
+                header_length = _npy_header_length(buffer)
+                if header_length is None or len(buffer) < header_length:
+                    continue
+                _check_npy_header(bytes(buffer[:header_length]), n_features)
+                del buffer[:header_length]
+            header_checked = True
+        while len(buffer) >= chunk_bytes:
+            yield _take_rows(buffer, chunk_rows, n_features)
+    if len(buffer) % row_bytes:
+        raise ValueError(
+            f"Body does not hold whole rows of {n_features} float32 values"
+        )
+    if buffer:
+        yield _take_rows(buffer, len(buffer) // row_bytes, n_features)
+
+
+def _take_rows(buffer: bytearray, n_rows: int, n_features: int) -> np.ndarray:
+    """Pop the first n_rows rows off buffer as a float32 array."""
+    # Copy out of the view before shrinking the buffer: a bytearray can't be
+    # resized while an array still references its memory
+    rows = np.frombuffer(buffer, dtype=FLOAT32_LE, count=n_rows * n_features).copy()
+    del buffer[: rows.nbytes]
+    return rows.reshape(n_rows, n_features)
+
+
+def _npy_header_length(buffer: bytearray):
+    """Total length of the .npy preamble, or None if more bytes are needed."""
+    # Magic string, then one byte each for the major and minor version
+    if len(buffer) < 8:
+        return None
+    if buffer[6] == 1:
+        if len(buffer) < 10:
+            return None
+        return 10 + int.from_bytes(buffer[8:10], "little")
+    if len(buffer) < 12:
+        return None
+    return 12 + int.from_bytes(buffer[8:12], "little")
+
+
+def _check_npy_header(header: bytes, n_features: int):
+    stream = io.BytesIO(header)
+    major, _ = np.lib.format.read_magic(stream)
+    if major == 1:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype != FLOAT32_LE or fortran_order or len(shape) != 2 or shape[1] != n_features:
+        raise ValueError(
+            f"The .npy body must hold a C-ordered <f4 array of shape (n_rows, {n_features})"
+        )
+
+
+def encode_ndjson(class_names: np.ndarray, probabilities=None) -> bytes:
+    """Encode one scored block as NDJSON, one object per row."""
+    if probabilities is None:
+        lines = (json.dumps({"class": name}) for name in class_names.tolist())
+    else:
+        lines = (
+            json.dumps({"class": name, "probabilities": row})
+            for name, row in zip(class_names.tolist(), probabilities.tolist())
+        )
+    return "".join(line + "\n" for line in lines).encode()
+
+
+def result_dtype(n_classes: int, probabilities: bool) -> str:
+    """
+    Return the NumPy dtype of one row of a binary streaming response.
+
+    Every row is the <i4 class index, followed by n_classes <f4
+    probabilities when they were asked for, e.g. "<i4,(3,)<f4". The string
+    is sent in the X-Result-Dtype header.
+    """
+    return f"<i4,({n_classes},)<f4" if probabilities else "<i4"
+
+
+def encode_float32(indices: np.ndarray, probabilities=None) -> bytes:
+    """Encode one scored block as raw little-endian rows of result_dtype."""
+    if probabilities is None:
+        return indices.astype("<i4").tobytes()
+    # The class index is sent too, since the argmax of the rounded float32
+    # probabilities can pick another class when two of them are close
+    rows = np.empty(len(indices), dtype=np.dtype(result_dtype(probabilities.shape[1], True)))
+    rows["f0"] = indices
+    rows["f1"] = probabilities
+    return rows.tobytes()
+
+
+class FullDuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body generator is still reading the request body.
+
+    For ASGI servers older than spec 2.4, StreamingResponse watches for client
+    disconnects by consuming receive() messages, which would swallow the body
+    chunks the generator is waiting for. Here a disconnect surfaces through
+    request.stream() instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+class ResultSpool:
+    """
+    Buffer between the task scoring a streamed body and the response.
+
+    Most HTTP clients upload the whole body before they read the response.
+    If the scoring task wrote straight into the response it would block once
+    the socket buffers are full and stop reading the body, and client and
+    server would wait on each other forever. Results are written here instead
+    and read back by the response as fast as the client takes them. Up to
+    max_memory bytes are kept in RAM; beyond that the spool moves to a
+    temporary file, so memory stays flat whatever the size of the body.
+    """
+
+    def __init__(self, max_memory: int = 8 * 1024 * 1024, read_size: int = 1024 * 1024):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self._read_size = read_size
+        self._written = 0
+        self._read = 0
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def write(self, data: bytes):
+        self._file.seek(self._written)
+        self._file.write(data)
+        self._written += len(data)
+        self._changed.set()
+
+    def close(self, error: Optional[BaseException] = None):
+        self._closed = True
+        self._error = error
+        self._changed.set()
+
+    async def __aiter__(self):
+        try:
+            while True:
+                if self._read < self._written:
+                    self._file.seek(self._read)
+                    data = self._file.read(min(self._written - self._read, self._read_size))
+                    self._read += len(data)
+                    yield data
+                elif self._closed:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    self._changed.clear()
+                    await self._changed.wait()
+        finally:
+            self._file.close()
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import shutil
+import sys
+
+import joblib
+
+sys.path.insert(0, os.path.dirname(__file__))
+from registry import ModelRegistry  # noqa: E402
+
+MODEL = os.path.join(os.path.dirname(__file__), "model.joblib")
+
+
+def write_version(path, model_version):
+    bundle = joblib.load(MODEL)
+    bundle["model_version"] = model_version
+    joblib.dump(bundle, path)
+
+
+async def no_warmup(model):
+    pass
+
+
+def test_deleting_one_side_of_a_split_then_promoting_serves_the_new_version(tmp_path):
+    path = str(tmp_path / "model.joblib")
+    shutil.copy(MODEL, path)
+    (tmp_path / "store").mkdir()
+    registry = ModelRegistry(path, max_resident=3, snapshot_dir=str(tmp_path / "store"))
+    try:
+        baseline = registry.load_active()
+        candidate_path = str(tmp_path / "candidate.joblib")
+        write_version(candidate_path, "v2")
+        candidate = asyncio.run(registry.reload(no_warmup, path=candidate_path, promote=False))
+        registry.set_routes({baseline.version: 0.5, candidate.version: 0.5})
+
+        registry.unload(candidate.version)
+        assert registry.routes == {}
+
+        # The watcher picks up a new artifact and promotes it
+        write_version(path, "v3")
+        promoted = asyncio.run(registry.reload(no_warmup))
+        assert registry.active is promoted
+        assert all(registry.resolve() is promoted for _ in range(100))
+    finally:
+        registry.close()
+
+
+def test_promoting_drops_the_traffic_split(tmp_path):
+    path = str(tmp_path / "model.joblib")
+    shutil.copy(MODEL, path)
+    (tmp_path / "store").mkdir()
+    registry = ModelRegistry(path, max_resident=3, snapshot_dir=str(tmp_path / "store"))
+    try:
+        baseline = registry.load_active()
+        candidate_path = str(tmp_path / "candidate.joblib")
+        write_version(candidate_path, "v2")
+        candidate = asyncio.run(registry.reload(no_warmup, path=candidate_path, promote=False))
+        registry.set_routes({baseline.version: 0.9, candidate.version: 0.1})
+
+        registry.promote(candidate.version)
+        assert registry.routes == {}
+        assert all(registry.resolve() is candidate for _ in range(100))
+    finally:
+        registry.close()
@@ -0,0 +1,94 @@
+"""
+Compare the joblib model bundle with its compact export: file size, load
+time, memory held after loading and predict latency. The compact forest is
+first checked to predict exactly like the original one.
+
+Usage (from the repository root):
+    python app/benchmarks/artifact_benchmark.py --model app/backend/model.joblib
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+from compact_model import load_compact, write_compact  # noqa: E402
+from engine_benchmark import FEATURE_HIGH, FEATURE_LOW, check_parity  # noqa: E402
+from inference import load_bundle  # noqa: E402
+
+
+def held_after_load(load) -> int:
+    """Bytes allocated by load() that are still held once it returns."""
+    gc.collect()
+    tracemalloc.start()
+    bundle = load()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del bundle
+    return held
+
+
+def measure(name: str, path: str, load, repeat: int) -> dict:
+    load_ms = np.asarray(timeit.repeat(load, number=1, repeat=repeat)) * 1e3
+    return {
+        "name": name,
+        "size_kib": os.path.getsize(path) / 1024,
+        "load_ms_min": load_ms.min(),
+        "load_ms_median": float(np.median(load_ms)),
+        "heap_kib": held_after_load(load) / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the joblib and compact model artifacts")
+    parser.add_argument("--model", default="app/backend/model.joblib")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--batch-sizes", default="1,64,4096")
+    args = parser.parse_args()
+
+    bundle = joblib.load(args.model)
+    compact_path = os.path.join(tempfile.mkdtemp(), "model.forest")
+    write_compact(bundle, compact_path)
+    compact = load_compact(compact_path)["model"]
+    check_parity(bundle["model"], compact)
+
+    results = [
+        measure("joblib", args.model, lambda: joblib.load(args.model), args.repeat),
+        measure(
+            "joblib, array engine",
+            args.model,
+            lambda: load_bundle(args.model, mmap=False, engine="array"),
+            args.repeat,
+        ),
+        measure("compact, mmap", compact_path, lambda: load_compact(compact_path), args.repeat),
+        measure(
+            "compact, read",
+            compact_path,
+            lambda: load_compact(compact_path, mmap_arrays=False),
+            args.repeat,
+        ),
+    ]
+    print(f"\n{'artifact':<22} {'size KiB':>9} {'load ms':>9} {'median':>9} {'heap KiB':>9}")
+    for r in results:
+        print(
+            f"{r['name']:<22} {r['size_kib']:>9.1f} {r['load_ms_min']:>9.2f}"
+            f" {r['load_ms_median']:>9.2f} {r['heap_kib']:>9.1f}"
+        )
+
+    array_engine = load_bundle(args.model, mmap=False, engine="array")["model"]
+    rng = np.random.default_rng(1)
+    print(f"\n{'rows':>6} {'sklearn ms':>11} {'array ms':>9} {'compact ms':>11}")
+    for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+        X = rng.uniform(FEATURE_LOW, FEATURE_HIGH, size=(batch_size, len(FEATURE_LOW)))
+        timings = [
+            min(timeit.repeat(lambda: model.predict(X), number=1, repeat=args.repeat * 5)) * 1e3
+            for model in (bundle["model"], array_engine, compact)
+        ]
+        print(f"{batch_size:>6} {timings[0]:>11.3f} {timings[1]:>9.3f} {timings[2]:>11.3f}")
@@ -0,0 +1,67 @@
+"""
+Check that the ArrayForest engine matches sklearn exactly, then compare the
+latency of both engines at the batch sizes the API sees.
+
+Usage (from the repository root):
+    python app/benchmarks/engine_benchmark.py --model app/backend/model.joblib
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+from forest_engine import ArrayForest  # noqa: E402
+
+# Ranges of the Streamlit sliders, used to generate realistic inputs
+FEATURE_LOW = [4.0, 2.0, 1.0, 0.0]
+FEATURE_HIGH = [8.0, 5.0, 6.9, 2.5]
+
+
+def check_parity(forest, engine, n_rows: int = 100_000, seed: int = 0):
+    """Raise an AssertionError if the engines disagree on any random input."""
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(FEATURE_LOW, FEATURE_HIGH, size=(n_rows, len(FEATURE_LOW)))
+    # Slider values are rounded, so also hit the split thresholds exactly
+    X = np.vstack([X, np.round(X, 1)])
+    expected = forest.predict_proba(X)
+    actual = engine.predict_proba(X)
+    assert np.array_equal(expected, actual), (
+        f"predict_proba differs, max abs diff {np.abs(expected - actual).max()}"
+    )
+    assert np.array_equal(forest.predict(X), engine.predict(X)), "predict differs"
+    print(f"Parity OK on {len(X)} rows")
+
+
+def benchmark(forest, engine, batch_sizes, repeat: int = 200):
+    rng = np.random.default_rng(1)
+    print(f"{'rows':>6} {'sklearn ms':>12} {'array ms':>10} {'speedup':>8}")
+    for batch_size in batch_sizes:
+        X = rng.uniform(FEATURE_LOW, FEATURE_HIGH, size=(batch_size, len(FEATURE_LOW)))
+        sklearn_ms = min(timeit.repeat(lambda: forest.predict(X), number=1, repeat=repeat)) * 1e3
+        engine_ms = min(timeit.repeat(lambda: engine.predict(X), number=1, repeat=repeat)) * 1e3
+        print(
+            f"{batch_size:>6} {sklearn_ms:>12.3f} {engine_ms:>10.3f} {sklearn_ms / engine_ms:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the ArrayForest engine with sklearn")
+    parser.add_argument("--model", default="app/backend/model.joblib")
+    parser.add_argument("--batch-sizes", default="1,8,64,512,4096")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    forest = joblib.load(args.model)["model"]
+    engine = ArrayForest.from_sklearn(forest)
+    check_parity(forest, engine)
+    benchmark(
+        forest,
+        engine,
+        [int(size) for size in args.batch_sizes.split(",")],
+        repeat=args.repeat,
+    )
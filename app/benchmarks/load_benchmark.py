@@ -0,0 +1,341 @@
+"""
+Load-test the model API and microbenchmark the raw model calls.
+
+The script starts the backend with uvicorn (or targets an already running
+server with --url), waits until it is ready, then drives every scenario
+with an async load generator at a fixed concurrency for a fixed duration:
+- single: one random row per /predict/ call
+- repeated: /predict/ calls drawing from a small pool of rows, which the
+  prediction cache absorbs
+- bulk: --bulk-rows random rows per /predict/batch/ call
+- mixed: the three above, weighted by --mix
+
+Before the load test, the model calls are timed in-process at several
+batch sizes, to separate the model cost from the framework cost. Results
+are written as JSON, and --compare prints the change against a previous
+run.
+
+Usage (from the repository root):
+    pip install -r app/benchmarks/requirements.txt
+    python app/benchmarks/load_benchmark.py --concurrency 1,16 --duration 10
+    python app/benchmarks/load_benchmark.py --env INFERENCE_ENGINE=array \\
+        --compare app/benchmarks/results/<previous run>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import timeit
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+sys.path.insert(0, BACKEND_DIR)
+from inference import load_bundle, score  # noqa: E402
+
+# Ranges of the Streamlit sliders, used to generate realistic inputs
+FEATURE_LOW = [4.0, 2.0, 1.0, 0.0]
+FEATURE_HIGH = [8.0, 5.0, 6.9, 2.5]
+
+SCENARIOS = ("single", "repeated", "bulk", "mixed")
+
+
+def random_rows(rng: np.random.Generator, n_rows: int) -> list:
+    # Rounded like the slider values the frontend sends
+    return np.round(rng.uniform(FEATURE_LOW, FEATURE_HIGH, size=(n_rows, 4)), 1).tolist()
+
+
+def summarize(latencies: list) -> dict:
+    """Percentiles of a list of latencies in seconds, reported in milliseconds."""
+    if not latencies:
+        return {}
+    values = np.asarray(latencies) * 1e3
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def microbenchmark(model_path: str, engine: str, batch_sizes, repeat: int) -> list:
+    """
+    Time the model calls in-process, without HTTP, JSON or the event loop.
+
+    Parameters:
+    model_path (str): Path of the model bundle.
+    engine (str): Inference engine, as for INFERENCE_ENGINE.
+    batch_sizes (list[int]): Number of rows per call.
+    repeat (int): Number of timed calls per batch size.
+
+    Returns:
+    list[dict]: One entry per batch size, with the latency of model.predict
+                and of the backend's score function.
+    """
+    bundle = load_bundle(model_path, mmap=False, engine=engine)
+    model = bundle["model"]
+    rng = np.random.default_rng(0)
+    results = []
+    for batch_size in batch_sizes:
+        X = np.asarray(random_rows(rng, batch_size))
+        # One untimed call, so lazy initialization isn't measured
+        score(bundle, X)
+        entry = {"batch_size": batch_size}
+        for name, call in (
+            ("predict", lambda: model.predict(X)),
+            ("score", lambda: score(bundle, X)),
+        ):
+            timings = timeit.repeat(call, number=1, repeat=repeat)
+            stats = summarize(timings)
+            stats["us_per_row"] = stats["p50_ms"] * 1e3 / batch_size
+            entry[name] = stats
+        results.append(entry)
+        print(
+            f"model    {batch_size:>6} rows   predict p50 {entry['predict']['p50_ms']:8.3f} ms"
+            f"   score p50 {entry['score']['p50_ms']:8.3f} ms"
+            f"   {entry['score']['us_per_row']:8.2f} us/row"
+        )
+    return results
+
+
+class LoadGenerator:
+    """
+    Closed-loop load generator: each of `concurrency` clients sends its next
+    request as soon as the previous one is answered.
+
+    Attributes:
+    url (str): Base URL of the API.
+    bulk_rows (int): Number of rows per /predict/batch/ request.
+    repeated_pool (int): Number of distinct rows of the repeated scenario.
+    mix (dict): Weight of each scenario in the mixed scenario.
+    seed (int): Seed of the request generator, so runs send the same requests.
+    """
+
+    def __init__(self, url: str, bulk_rows: int, repeated_pool: int, mix: dict, seed: int = 0):
+        self.url = url
+        self.bulk_rows = bulk_rows
+        self.mix = mix
+        self.seed = seed
+        self.repeated_rows = random_rows(np.random.default_rng(seed), repeated_pool)
+
+    def request(self, scenario: str, rng: random.Random, np_rng: np.random.Generator):
+        """Return (path, JSON body, number of rows) of the next request."""
+        if scenario == "mixed":
+            scenario = rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if scenario == "single":
+            return "/predict/", {"features": random_rows(np_rng, 1)[0]}, 1
+        if scenario == "repeated":
+            return "/predict/", {"features": rng.choice(self.repeated_rows)}, 1
+        if scenario == "bulk":
+            return "/predict/batch/", {"features": random_rows(np_rng, self.bulk_rows)}, self.bulk_rows
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    async def run(self, scenario: str, concurrency: int, duration: float, warmup: float) -> dict:
+        latencies = []
+        counts = {"requests": 0, "rows": 0, "errors": 0}
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=self.url, limits=limits, timeout=30) as client:
+
+            async def worker(worker_id: int, record_after: float, stop_at: float):
+                rng = random.Random(self.seed * 1000 + worker_id)
+                np_rng = np.random.default_rng(self.seed * 1000 + worker_id)
+                while True:
+                    path, body, n_rows = self.request(scenario, rng, np_rng)
+                    started_at = time.perf_counter()
+                    if started_at >= stop_at:
+                        return
+                    try:
+                        response = await client.post(path, json=body)
+                        ok = response.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    finished_at = time.perf_counter()
+                    # Requests started during the warmup period aren't recorded
+                    if started_at < record_after:
+                        continue
+                    counts["requests"] += 1
+                    if ok:
+                        counts["rows"] += n_rows
+                        latencies.append(finished_at - started_at)
+                    else:
+                        counts["errors"] += 1
+
+            record_after = time.perf_counter() + warmup
+            stop_at = record_after + duration
+            await asyncio.gather(
+                *(worker(worker_id, record_after, stop_at) for worker_id in range(concurrency))
+            )
+            elapsed = time.perf_counter() - record_after
+
+        return {
+            "scenario": scenario,
+            "concurrency": concurrency,
+            "duration_s": elapsed,
+            **counts,
+            "requests_per_s": counts["requests"] / elapsed,
+            "rows_per_s": counts["rows"] / elapsed,
+            **summarize(latencies),
+        }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, env: dict, workers: int) -> subprocess.Popen:
+    """Start the backend with uvicorn in a subprocess."""
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--no-access-log", "--log-level", "warning",
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env={**os.environ, **env})
+
+
+def wait_until_ready(url: str, server: subprocess.Popen = None, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"The server exited with code {server.returncode}")
+        try:
+            if httpx.get(f"{url}/ready", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} was not ready after {timeout}s")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=BACKEND_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, previous: dict):
+    """Print the change of each load-test result against a previous run."""
+    print(f"\nChange against {previous['meta']['commit']} ({previous['meta']['timestamp']}):")
+    before = {(r["scenario"], r["concurrency"]): r for r in previous["load"]}
+    for result in current["load"]:
+        old = before.get((result["scenario"], result["concurrency"]))
+        if old is None or "p50_ms" not in old or "p50_ms" not in result:
+            continue
+        changes = "   ".join(
+            f"{key} {100 * (result[key] / old[key] - 1):+6.1f}%"
+            for key in ("requests_per_s", "p50_ms", "p95_ms", "p99_ms")
+        )
+        print(f"{result['scenario']:>9} c={result['concurrency']:<4} {changes}")
+
+
+def parse_pairs(text: str, value_type=str) -> dict:
+    pairs = (item.split("=", 1) for item in text.split(",") if item)
+    return {key: value_type(value) for key, value in pairs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the model API")
+    parser.add_argument("--url", help="Benchmark a running server instead of starting one")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE set for the started server")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the started server")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each run")
+    parser.add_argument("--bulk-rows", type=int, default=256)
+    parser.add_argument("--repeated-pool", type=int, default=50)
+    parser.add_argument("--mix", default="single=0.8,repeated=0.15,bulk=0.05")
+    parser.add_argument("--model", default=os.path.join(BACKEND_DIR, "model.joblib"))
+    parser.add_argument("--batch-sizes", default="1,8,64,512,4096")
+    parser.add_argument("--repeat", type=int, default=200, help="Timed calls per microbenchmark")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result file (default is results/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Previous result file to compare with")
+    args = parser.parse_args()
+
+    env = dict(item.split("=", 1) for item in args.env)
+    commit = git_commit()
+    timestamp = datetime.now(timezone.utc)
+    results = {
+        "meta": {
+            "commit": commit,
+            "timestamp": timestamp.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "server_env": env,
+            "args": vars(args),
+        },
+        "micro": [],
+        "load": [],
+    }
+
+    if not args.skip_micro:
+        results["micro"] = microbenchmark(
+            args.model,
+            env.get("INFERENCE_ENGINE", os.getenv("INFERENCE_ENGINE", "sklearn")),
+            [int(size) for size in args.batch_sizes.split(",")],
+            args.repeat,
+        )
+
+    server = None
+    url = args.url
+    if url is None:
+        url = f"http://127.0.0.1:{free_port()}"
+        server = start_server(int(url.rsplit(":", 1)[1]), env, args.workers)
+    try:
+        wait_until_ready(url, server)
+        generator = LoadGenerator(
+            url, args.bulk_rows, args.repeated_pool, parse_pairs(args.mix, float), args.seed
+        )
+        for scenario in args.scenarios.split(","):
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                result = asyncio.run(
+                    generator.run(scenario, concurrency, args.duration, args.warmup)
+                )
+                results["load"].append(result)
+                print(
+                    f"{scenario:>9} c={concurrency:<4} {result['requests_per_s']:9.1f} req/s"
+                    f" {result['rows_per_s']:10.1f} rows/s"
+                    f"   p50 {result.get('p50_ms', float('nan')):7.2f}"
+                    f"   p95 {result.get('p95_ms', float('nan')):7.2f}"
+                    f"   p99 {result.get('p99_ms', float('nan')):7.2f} ms"
+                    f"   errors {result['errors']}"
+                )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{commit}-{timestamp.strftime('%Y%m%d%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import json
+import os
+
+import numpy as np
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000")
+# Seconds before a memoized prediction is fetched from the backend again
+PREDICTION_TTL_SECONDS = float(os.getenv("PREDICTION_TTL_SECONDS", "300"))
+# Decimals the features are rounded to, like the backend's prediction cache
+FEATURE_PRECISION = int(os.getenv("FEATURE_PRECISION", "2"))
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "10"))
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    Return the HTTP session shared by every user and rerun of the app.
+
+    The session keeps its connections to the backend alive, so a prediction
+    doesn't pay for a new TCP connection. Failed connections and 502/503/504
+    responses are retried with backoff.
+    """
+    session = requests.Session()
+    retries = Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=None,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def round_features(features) -> tuple:
+    return tuple(round(float(value), FEATURE_PRECISION) for value in features)
+
+
+@st.cache_data(ttl=PREDICTION_TTL_SECONDS, max_entries=10_000, show_spinner=False)
+def predict(features: tuple) -> dict:
+    """
+    Predict the species of one feature tuple.
+
+    Results are memoized per tuple for PREDICTION_TTL_SECONDS across all
+    sessions, so moving a slider back to an earlier value doesn't reach the
+    backend. Pass the features through round_features first, so equivalent
+    slider positions share an entry.
+    """
+    response = get_session().post(
+        f"{BACKEND_URL}/predict/",
+        json={"features": list(features)},
+        timeout=REQUEST_TIMEOUT_SECONDS,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def score_matrix(features: np.ndarray, probabilities: bool = False):
+    """
+    Score a block of feature rows with one bulk request.
+
+    The rows are sent as raw little-endian float32 to /predict/stream/, which
+    answers with one int32 class index per row, followed by n_classes float32
+    probabilities when they are asked for, so neither side builds a JSON
+    document with a value per cell.
+
+    Returns:
+    tuple: The class names, the (n_rows,) class indices, and the
+           (n_rows, n_classes) probabilities or None.
+    """
+    response = get_session().post(
+        f"{BACKEND_URL}/predict/stream/",
+        params={"probabilities": "true" if probabilities else "false"},
+        data=np.ascontiguousarray(features, dtype="<f4").tobytes(),
+        headers={"Content-Type": "application/octet-stream"},
+        timeout=REQUEST_TIMEOUT_SECONDS,
+    )
+    response.raise_for_status()
+    class_names = json.loads(response.headers["X-Class-Names"])
+    dtype = np.dtype(response.headers["X-Result-Dtype"])
+    # An error after the headers were sent ends the body early
+    if len(response.content) != len(features) * dtype.itemsize:
+        raise requests.RequestException("The backend returned an incomplete response")
+    rows = np.frombuffer(response.content, dtype=dtype)
+    if not probabilities:
+        return class_names, rows, None
+    return class_names, rows["f0"], rows["f1"]
+
+
+def predict_proba_matrix(features: np.ndarray):
+    """Return the class names and the (n_rows, n_classes) probabilities of a block of rows."""
+    class_names, _, probabilities = score_matrix(features, probabilities=True)
+    return class_names, probabilities
@@ -0,0 +1,255 @@
+import contextlib
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+import streamlit as st
+from backend_client import score_matrix
+
+# Rows read from the upload and sent to the backend at a time
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "20000"))
+# Chunks scored concurrently; at most twice as many are held in memory
+CSV_WORKERS = int(os.getenv("CSV_WORKERS", "4"))
+# Streamlit holds a download in memory, so larger scored files are offered
+# gzip-compressed, and not at all if still above the limit
+CSV_DOWNLOAD_MAX_MB = float(os.getenv("CSV_DOWNLOAD_MAX_MB", "200"))
+
+
+def remove_files(paths: list):
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+class ScoredFiles:
+    """
+    The temporary files of a scoring job: the scored CSV and its compressed copy.
+
+    They are removed by remove(), or once the object is garbage collected,
+    which happens when the Streamlit session holding it ends, or at exit.
+
+    Attributes:
+    path (str): The scored CSV.
+    gzip_path (str): Its gzip-compressed copy, or None until compress() is called.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.gzip_path = None
+        self._paths = [path]
+        self._finalizer = weakref.finalize(self, remove_files, self._paths)
+
+    def compress(self) -> str:
+        if self.gzip_path is None:
+            gzip_path = f"{self.path}.gz"
+            self._paths.append(gzip_path)
+            with open(self.path, "rb") as source, gzip.open(gzip_path, "wb") as target:
+                shutil.copyfileobj(source, target)
+            self.gzip_path = gzip_path
+        return self.gzip_path
+
+    def remove(self):
+        self._finalizer()
+
+
+def score_chunk(features: np.ndarray, probabilities: bool):
+    """
+    Score one chunk, skipping the rows with missing or non-numeric values.
+
+    Returns:
+    tuple: The class names, the mask of scored rows, their class indices and
+           their probabilities (or None).
+    """
+    valid = np.isfinite(features).all(axis=1)
+    if not valid.any():
+        return None, valid, None, None
+    class_names, indices, results = score_matrix(features[valid], probabilities)
+    return class_names, valid, indices, results
+
+
+def append_results(chunk: pd.DataFrame, scored, probabilities: bool) -> pd.DataFrame:
+    class_names, valid, indices, results = scored
+    predicted = np.full(len(chunk), "", dtype=object)
+    if class_names is not None:
+        predicted[valid] = np.asarray(class_names, dtype=object)[indices]
+    chunk = chunk.assign(predicted_species=predicted)
+    if probabilities and class_names is not None:
+        for index, name in enumerate(class_names):
+            column = np.full(len(chunk), np.nan, dtype=np.float32)
+            column[valid] = results[:, index]
+            chunk[f"probability_{name}"] = column
+    return chunk
+
+
+def score_csv(source, columns, output, probabilities=False, on_progress=None):
+    """
+    Score a CSV file chunk by chunk and write it back with predictions appended.
+
+    Up to CSV_WORKERS chunks are scored concurrently. Scored chunks are
+    written to output in their original order as soon as they are ready, so
+    at most 2 * CSV_WORKERS chunks are held in memory whatever the size of
+    the file.
+
+    Parameters:
+    source: A file-like object holding the CSV.
+    columns (list[str]): The columns holding the model features, in order.
+    output: A text file-like object the scored CSV is written to.
+    probabilities (bool): Also append the probability of every class (default is False).
+    on_progress (Callable): Called with the number of rows written after every chunk.
+
+    Returns:
+    int: The number of rows written.
+    """
+    rows_written = 0
+    pending = deque()
+
+    def write_oldest():
+        nonlocal rows_written
+        chunk, future = pending.popleft()
+        scored = append_results(chunk, future.result(), probabilities)
+        scored.to_csv(output, header=rows_written == 0, index=False)
+        rows_written += len(scored)
+        if on_progress is not None:
+            on_progress(rows_written)
+
+    with ThreadPoolExecutor(CSV_WORKERS) as pool:
+        try:
+            for chunk in pd.read_csv(source, chunksize=CSV_CHUNK_ROWS):
+                features = chunk[columns].apply(pd.to_numeric, errors="coerce")
+                future = pool.submit(
+                    score_chunk, features.to_numpy(dtype=np.float32), probabilities
+                )
+                pending.append((chunk, future))
+                if len(pending) >= 2 * CSV_WORKERS:
+                    write_oldest()
+            while pending:
+                write_oldest()
+        finally:
+            for _, future in pending:
+                future.cancel()
+    return rows_written
+
+
+def default_column(label: str, columns: list, position: int) -> int:
+    """Index of the column matching a feature label, else the column at its position."""
+    wanted = label.lower().replace(" ", "")
+    for index, column in enumerate(columns):
+        normalized = str(column).lower().replace(" ", "").replace("_", "")
+        if normalized.startswith(wanted):
+            return index
+    return min(position, len(columns) - 1)
+
+
+def render_csv_scoring(features):
+    """
+    Bulk scoring page: upload a CSV of measurements and download it back
+    with the predicted species appended.
+
+    Parameters:
+    features (list[tuple]): (label, low, high) of every model feature, in column order.
+    """
+    st.header("Bulk CSV scoring")
+    upload = st.file_uploader("CSV file of measurements", type=["csv"])
+    result = st.session_state.get("csv_result")
+    if result is not None and (upload is None or result["job"][0] != upload.file_id):
+        # The file the result was scored from is gone or was replaced
+        discard_result()
+    if upload is None:
+        return
+
+    # Only the header is parsed here; the rows are read during scoring
+    upload.seek(0)
+    columns = list(pd.read_csv(upload, nrows=0).columns)
+    if not columns:
+        st.error("The file has no header row")
+        return
+    feature_columns = [
+        st.selectbox(f"Column holding {label}", columns, index=default_column(label, columns, i))
+        for i, (label, _, _) in enumerate(features)
+    ]
+    probabilities = st.checkbox("Append class probabilities")
+
+    job = (upload.file_id, tuple(feature_columns), probabilities)
+    result = st.session_state.get("csv_result")
+    if result is None or result["job"] != job:
+        if not st.button("Score file"):
+            return
+        discard_result()
+        result = run_scoring(upload, feature_columns, probabilities)
+        if result is None:
+            return
+        st.session_state["csv_result"] = dict(result, job=job)
+
+    st.success(
+        f"Scored {result['rows']:,} rows in {result['seconds']:.1f} s"
+        f" ({result['rows'] / max(result['seconds'], 1e-9):,.0f} rows/s)"
+    )
+    render_download(result["files"], f"{os.path.splitext(upload.name)[0]}_scored.csv")
+
+
+def render_download(files: ScoredFiles, file_name: str):
+    max_bytes = CSV_DOWNLOAD_MAX_MB * 1024 * 1024
+    path, mime = files.path, "text/csv"
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        with st.spinner("Compressing the scored file…"):
+            path, mime, file_name = files.compress(), "application/gzip", f"{file_name}.gz"
+        if os.path.getsize(path) > max_bytes:
+            st.error(
+                f"The scored file is {size / 1024 / 1024:,.0f} MB, too large to download"
+                f" through the browser even compressed (limit {CSV_DOWNLOAD_MAX_MB:,.0f} MB)."
+                " Score it with the backend's /predict/stream/ endpoint instead."
+            )
+            return
+        st.warning(
+            f"The scored file is {size / 1024 / 1024:,.0f} MB, above the"
+            f" {CSV_DOWNLOAD_MAX_MB:,.0f} MB download limit, so it is offered gzip-compressed."
+        )
+    # The download is read into memory once, and is at most max_bytes
+    with open(path, "rb") as f:
+        st.download_button("Download scored CSV", f, file_name=file_name, mime=mime)
+
+
+def discard_result():
+    result = st.session_state.pop("csv_result", None)
+    if result is not None:
+        result["files"].remove()
+
+
+def run_scoring(upload, feature_columns, probabilities):
+    progress = st.progress(0.0, text="Scoring…")
+    started_at = time.perf_counter()
+
+    def on_progress(rows):
+        # The reader's position in the upload tells how far along the file is
+        done = min(upload.tell() / max(upload.size, 1), 1.0)
+        rate = rows / max(time.perf_counter() - started_at, 1e-9)
+        progress.progress(done, text=f"{rows:,} rows scored, {rate:,.0f} rows/s")
+
+    # The scored file goes to disk, so only the upload itself stays in memory
+    output = tempfile.NamedTemporaryFile(
+        "w", suffix=".csv", prefix="scored-", delete=False, newline=""
+    )
+    upload.seek(0)
+    try:
+        with output:
+            rows = score_csv(upload, feature_columns, output, probabilities, on_progress)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        os.remove(output.name)
+        progress.empty()
+        st.error(f"Scoring failed: {e}")
+        return None
+    progress.progress(1.0, text=f"{rows:,} rows scored")
+    return {
+        "files": ScoredFiles(output.name),
+        "rows": rows,
+        "seconds": time.perf_counter() - started_at,
+    }
@@ -0,0 +1,119 @@
+import time
+
+import numpy as np
+import requests
+import streamlit as st
+from backend_client import PREDICTION_TTL_SECONDS, predict_proba_matrix
+
+# RGB color of each class on the surface
+CLASS_COLORS = np.array(
+    [[31, 119, 180], [255, 127, 14], [44, 160, 44], [214, 39, 40], [148, 103, 189]],
+    dtype=np.float32,
+)
+
+
+def feature_grid(ranges, x_index: int, y_index: int, fixed, resolution: int) -> np.ndarray:
+    """
+    Build the rows of a resolution x resolution sweep of two features.
+
+    Parameters:
+    ranges (list[tuple]): (low, high) of every feature.
+    x_index (int): Feature swept along the horizontal axis.
+    y_index (int): Feature swept along the vertical axis.
+    fixed (list[float]): Value of every other feature.
+    resolution (int): Number of steps along each axis.
+
+    Returns:
+    np.ndarray: A float32 array of shape (resolution * resolution, n_features),
+                with the highest y values in the first image row.
+    """
+    xs = np.linspace(*ranges[x_index], resolution, dtype=np.float32)
+    ys = np.linspace(*ranges[y_index], resolution, dtype=np.float32)[::-1]
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    rows = np.empty((resolution * resolution, len(ranges)), dtype=np.float32)
+    rows[:] = np.asarray(fixed, dtype=np.float32)
+    rows[:, x_index] = grid_x.ravel()
+    rows[:, y_index] = grid_y.ravel()
+    return rows
+
+
+@st.cache_data(ttl=PREDICTION_TTL_SECONDS, max_entries=32, show_spinner=False)
+def decision_surface(ranges, x_index: int, y_index: int, fixed: tuple, resolution: int):
+    """Return the class names and the (resolution, resolution, n_classes) probabilities."""
+    rows = feature_grid(ranges, x_index, y_index, fixed, resolution)
+    class_names, probabilities = predict_proba_matrix(rows)
+    return class_names, probabilities.reshape(resolution, resolution, -1)
+
+
+def class_image(probabilities: np.ndarray) -> np.ndarray:
+    """Color every cell by its predicted class, fading towards white as the forest is less sure."""
+    n_classes = probabilities.shape[-1]
+    predicted = probabilities.argmax(axis=-1)
+    # Map the winning probability from [1/n_classes, 1] to a [0.25, 1] color strength
+    confidence = probabilities.max(axis=-1)
+    strength = 0.25 + 0.75 * (confidence - 1 / n_classes) / (1 - 1 / n_classes)
+    colors = CLASS_COLORS[predicted % len(CLASS_COLORS)]
+    image = 255 - strength[..., np.newaxis] * (255 - colors)
+    return image.astype(np.uint8)
+
+
+def probability_image(probabilities: np.ndarray, class_index: int) -> np.ndarray:
+    """Shade every cell from white (0) to the class color (1) by the class probability."""
+    color = CLASS_COLORS[class_index % len(CLASS_COLORS)]
+    image = 255 - probabilities[..., class_index, np.newaxis] * (255 - color)
+    return image.astype(np.uint8)
+
+
+def render_decision_surface(features):
+    """
+    What-if explorer: sweep two features over a grid with the others fixed and
+    show the predicted class and probability surfaces.
+
+    The whole grid is scored by one bulk request.
+
+    Parameters:
+    features (list[tuple]): (label, low, high) of every model feature, in column order.
+    """
+    st.header("What-if explorer")
+    labels = [label for label, _, _ in features]
+    ranges = tuple((low, high) for _, low, high in features)
+    x_label = st.selectbox("Horizontal axis", labels, index=2)
+    y_label = st.selectbox("Vertical axis", [l for l in labels if l != x_label], index=2)
+    x_index, y_index = labels.index(x_label), labels.index(y_label)
+    resolution = st.select_slider("Grid resolution", [50, 100, 200, 400], value=200)
+
+    fixed = []
+    for index, (label, low, high) in enumerate(features):
+        if index in (x_index, y_index):
+            fixed.append(0.0)
+        else:
+            fixed.append(st.slider(f"{label} (fixed)", low, high, (low + high) / 2))
+
+    started_at = time.perf_counter()
+    try:
+        class_names, probabilities = decision_surface(
+            ranges, x_index, y_index, tuple(fixed), resolution
+        )
+    except requests.RequestException as e:
+        st.error(f"The prediction service is unavailable: {e}")
+        return
+    elapsed_ms = (time.perf_counter() - started_at) * 1e3
+
+    caption = (
+        f"{x_label}: {ranges[x_index][0]} → {ranges[x_index][1]} (left → right), "
+        f"{y_label}: {ranges[y_index][0]} → {ranges[y_index][1]} (bottom → top)"
+    )
+    legend = " ".join(
+        f"<span style='color:rgb{tuple(int(c) for c in CLASS_COLORS[i % len(CLASS_COLORS)])}'>■</span> {name}"
+        for i, name in enumerate(class_names)
+    )
+    st.markdown(legend, unsafe_allow_html=True)
+    st.image(class_image(probabilities), caption=caption, width=480)
+
+    shown = st.radio("Probability of", class_names, horizontal=True)
+    st.image(
+        probability_image(probabilities, class_names.index(shown)),
+        caption=f"P({shown}); {caption}",
+        width=480,
+    )
+    st.caption(f"{resolution * resolution:,} grid points scored in {elapsed_ms:.0f} ms")
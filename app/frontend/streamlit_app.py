@@ -1,22 +1,54 @@
+import os
+import time
+
 import requests
 import streamlit as st
+from backend_client import predict, round_features
+from csv_scoring import render_csv_scoring
+from decision_surface import render_decision_surface
+
+# Wait this long after a slider moves before calling the backend. Moving a
+# slider again meanwhile starts a new run, which replaces the pending call.
+DEBOUNCE_SECONDS = float(os.getenv("DEBOUNCE_SECONDS", "0.3"))
+
+# Label and slider range of every model feature, in column order
+FEATURES = [
+    ("Sepal Length", 4.0, 8.0),
+    ("Sepal Width", 2.0, 5.0),
+    ("petal Length", 1.0, 6.9),
+    ("petal Width", 0.0, 2.5),
+]
+
+
+def render_prediction():
+    values = [st.slider(label, low, high) for label, low, high in FEATURES]
+
+    features = round_features(values)
+    input_data = {"features": list(features)}
+    st.write(input_data)
+
+    result = st.empty()
+    if features != st.session_state.get("settled_features"):
+        # Streamlit stops this run at its next call if another slider event
+        # arrived during the sleep, so only settled values reach the backend
+        time.sleep(DEBOUNCE_SECONDS)
+        result.empty()
+        st.session_state["settled_features"] = features
+
+    try:
+        prediction = predict(features)
+    except requests.RequestException as e:
+        result.error(f"The prediction service is unavailable: {e}")
+    else:
+        result.write(f"Predicted Species: {prediction['class']}")
+
 
 st.title("Iris Species Prediction")
 
-sepal_length = st.slider("Sepal Length", 4.0, 8.0)
-sepal_width = st.slider("Sepal Width", 2.0, 5.0)
-petal_length = st.slider("petal Length", 1.0, 6.9)
-petal_width = st.slider("petal Width", 0.0, 2.5)
-
-# Convert to float
-sepal_length = float(sepal_length)
-sepal_width = float(sepal_width)
-petal_length = float(petal_length)
-petal_width = float(petal_width)
-
-input_data = {"features": [sepal_length, sepal_width, petal_length, petal_width]}
-st.write(input_data)
-response = requests.post("http://backend:8000/predict/", json=input_data)
-st.write(response.json())
-prediction = response.json()
-st.write(f"Predicted Species: {prediction}")
+mode = st.sidebar.radio("Mode", ["Prediction", "What-if explorer", "Bulk CSV scoring"])
+if mode == "Prediction":
+    render_prediction()
+elif mode == "What-if explorer":
+    render_decision_surface(FEATURES)
+else:
+    render_csv_scoring(FEATURES)
@@ -1,13 +1,405 @@
+import argparse
+import io
+import itertools
+import json
+import logging
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
 import joblib
+import numpy as np
+import sklearn
 from sklearn.datasets import load_iris
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold, cross_val_score
+
+# Bump when the layout of the bundle changes; the backend refuses newer formats
+BUNDLE_FORMAT_VERSION = 1
+
+# Hyperparameters tried by the model search
+SEARCH_GRID = {
+    "n_estimators": [5, 10, 25, 50, 100, 200],
+    "max_depth": [2, 3, 5, 8, None],
+    "min_samples_leaf": [1, 3],
+}
+
+
+def make_bundle(model, target_names, feature_names) -> dict:
+    """
+    Wrap a fitted classifier with the metadata the backend needs to serve it.
+
+    Parameters:
+    model: The fitted classifier.
+    target_names (list[str]): Name of each target value, indexed by the value itself.
+    feature_names (list[str]): Name of each input feature, in column order.
+
+    Returns:
+    dict: The versioned model bundle.
+    """
+    trained_at = datetime.now(timezone.utc)
+    return {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "model_version": trained_at.strftime("%Y%m%d%H%M%S"),
+        "trained_at": trained_at.isoformat(),
+        "sklearn_version": sklearn.__version__,
+        "model": model,
+        # class_names[i] is the name of model.classes_[i]
+        "class_names": [str(target_names[label]) for label in model.classes_],
+        "feature_names": [str(name) for name in feature_names],
+        "n_features": model.n_features_in_,
+    }
+
+
+def fit_candidate(params: dict, X, y, cv_folds: int = 5, seed: int = 0) -> dict:
+    """
+    Cross-validate one set of hyperparameters, then fit it on all the data.
+
+    Runs in a worker process, so every estimator uses a single core.
+    """
+    model = RandomForestClassifier(random_state=seed, n_jobs=1, **params)
+    folds = StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=seed)
+    scores = cross_val_score(model, X, y, cv=folds)
+    model.fit(X, y)
+    return {
+        "params": params,
+        "cv_accuracy": float(scores.mean()),
+        "cv_accuracy_std": float(scores.std()),
+        "model": model,
+    }
+
+
+def measure_serving_cost(model, X, batch_size: int = 256, repeat: int = 20) -> dict:
+    """
+    Measure what a fitted model costs to serve: artifact size, load time and
+    predict latency for one row and for a batch of rows.
+    """
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    content = buffer.getvalue()
+
+    load_seconds = []
+    for _ in range(5):
+        started_at = time.perf_counter()
+        joblib.load(io.BytesIO(content))
+        load_seconds.append(time.perf_counter() - started_at)
+
+    rng = np.random.default_rng(0)
+    batch = X[rng.integers(len(X), size=batch_size)]
+    latency = {}
+    for name, rows in (("single", batch[:1]), ("batch", batch)):
+        model.predict(rows)
+        timings = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            model.predict(rows)
+            timings.append(time.perf_counter() - started_at)
+        latency[f"{name}_predict_ms"] = float(np.median(timings) * 1e3)
+    return {
+        "size_bytes": len(content),
+        "n_nodes": int(sum(tree.tree_.node_count for tree in model.estimators_)),
+        "load_ms": float(np.median(load_seconds) * 1e3),
+        **latency,
+        "batch_size": batch_size,
+    }
+
+
+def search(X, y, tolerance: float = 0.01, max_workers: int = None, cv_folds: int = 5):
+    """
+    Search SEARCH_GRID for the cheapest model to serve that is about as
+    accurate as the best one.
+
+    Candidates are cross-validated in parallel on all cores. Their serving
+    cost is then measured one at a time, so the timings don't compete for
+    CPU. Among the candidates within tolerance of the best cross-validated
+    accuracy, the one with the lowest single-row latency wins, then the
+    smallest artifact.
+
+    Parameters:
+    X (np.ndarray): Training features.
+    y (np.ndarray): Training targets.
+    tolerance (float): Accuracy a candidate may lose against the best one (default is 0.01).
+    max_workers (int): Number of worker processes (default is one per core).
+    cv_folds (int): Number of cross-validation folds (default is 5).
+
+    Returns:
+    tuple: The selected fitted model and the search report.
+    """
+    grid = [
+        dict(zip(SEARCH_GRID, values))
+        for values in itertools.product(*SEARCH_GRID.values())
+    ]
+    started_at = time.perf_counter()
+    with ProcessPoolExecutor(max_workers) as pool:
+        candidates = list(
+            pool.map(
+                fit_candidate,
+                grid,
+                itertools.repeat(X),
+                itertools.repeat(y),
+                itertools.repeat(cv_folds),
+            )
+        )
+    search_seconds = time.perf_counter() - started_at
+
+    for candidate in candidates:
+        candidate.update(measure_serving_cost(candidate["model"], X))
+    best_accuracy = max(candidate["cv_accuracy"] for candidate in candidates)
+    eligible = [
+        candidate
+        for candidate in candidates
+        if candidate["cv_accuracy"] >= best_accuracy - tolerance
+    ]
+    selected = min(
+        eligible, key=lambda c: (c["single_predict_ms"], c["size_bytes"])
+    )
+
+    report = {
+        "searched_at": datetime.now(timezone.utc).isoformat(),
+        "tolerance": tolerance,
+        "cv_folds": cv_folds,
+        "search_seconds": search_seconds,
+        "best_cv_accuracy": best_accuracy,
+        "selected": {k: v for k, v in selected.items() if k != "model"},
+        "candidates": sorted(
+            ({k: v for k, v in c.items() if k != "model"} for c in candidates),
+            key=lambda c: (-c["cv_accuracy"], c["single_predict_ms"]),
+        ),
+    }
+    return selected["model"], report
+
+
+def iter_chunks(path: str, chunk_rows: int):
+    """
+    Stream a CSV or Parquet file as pandas DataFrames of at most chunk_rows rows.
+
+    Parquet files are read one record batch at a time with pyarrow, which is
+    only needed for Parquet input.
+    """
+    import pandas as pd
+
+    if path.endswith((".parquet", ".pq")):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet files requires pyarrow: pip install pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+
+def split_chunk(frame, target: str, chunk_index: int, holdout_fraction: float, seed: int):
+    """
+    Split a chunk into training and held-out rows.
+
+    The split only depends on the chunk's position, so every pass over the
+    file holds out the same rows.
+    """
+    y = frame[target].to_numpy()
+    X = frame.drop(columns=[target]).to_numpy(dtype=np.float32)
+    held_out = np.random.default_rng([seed, chunk_index]).random(len(frame)) < holdout_fraction
+    return X[~held_out], y[~held_out], X[held_out], y[held_out]
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def train_out_of_core(
+    path: str,
+    target: str,
+    chunk_rows: int = 100_000,
+    trees_per_chunk: int = 10,
+    holdout_fraction: float = 0.1,
+    seed: int = 0,
+    **forest_params,
+):
+    """
+    Grow a random forest on a dataset larger than memory, one chunk at a time.
+
+    A first pass collects the classes and one example row of each. Each
+    chunk then adds trees_per_chunk trees with warm_start, fitted on that
+    chunk only, so memory is bounded by the chunk size plus the forest. A
+    chunk missing some classes gets their example rows with a zero sample
+    weight, so every tree knows all the classes without learning from rows
+    outside its chunk. A held-out fraction of every chunk is never trained
+    on. It scores the forest as it grows, and a final pass over the
+    held-out stream reports the accuracy of the finished forest.
+
+    Parameters:
+    path (str): CSV or Parquet file with one row per sample.
+    target (str): Name of the target column; every other column is a feature.
+    chunk_rows (int): Number of rows read at a time (default is 100000).
+    trees_per_chunk (int): Number of trees added per chunk (default is 10).
+    holdout_fraction (float): Fraction of the rows held out for validation (default is 0.1).
+    seed (int): Seed of the held-out split and of the trees (default is 0).
+    forest_params: Other RandomForestClassifier parameters, e.g. max_depth.
+
+    Returns:
+    tuple: The fitted forest, the feature names and a training report.
+    """
+    started_at = time.perf_counter()
+    examples, feature_names, n_rows = {}, None, 0
+    for frame in iter_chunks(path, chunk_rows):
+        feature_names = [column for column in frame.columns if column != target]
+        for label, row in zip(frame[target], frame[feature_names].to_numpy(np.float32)):
+            examples.setdefault(label, row)
+        n_rows += len(frame)
+    if feature_names is None:
+        raise ValueError(f"{path} holds no rows")
+    classes = sorted(examples)
+    logging.info(
+        f"Scanned {n_rows} rows, {len(feature_names)} features and"
+        f" {len(classes)} classes in {time.perf_counter() - started_at:.1f}s"
+    )
+
+    model = RandomForestClassifier(
+        n_estimators=0, warm_start=True, random_state=seed, n_jobs=-1, **forest_params
+    )
+    trained_rows = held_out_correct = held_out_rows = 0
+    training_started_at = time.perf_counter()
+    for chunk_index, frame in enumerate(iter_chunks(path, chunk_rows)):
+        X, y, X_held_out, y_held_out = split_chunk(
+            frame, target, chunk_index, holdout_fraction, seed
+        )
+        del frame
+        if len(y) == 0:
+            continue
+        # Keep every class in every tree through zero-weight example rows
+        missing = [label for label in classes if label not in set(y.tolist())]
+        weights = np.ones(len(y) + len(missing))
+        weights[len(y):] = 0.0
+        if missing:
+            X = np.vstack([X, [examples[label] for label in missing]])
+            y = np.concatenate([y, np.asarray(missing, dtype=y.dtype)])
+
+        model.set_params(n_estimators=model.n_estimators + trees_per_chunk)
+        model.fit(X, y, sample_weight=weights)
+        trained_rows += len(y) - len(missing)
+
+        # Progressive validation: the chunk's held-out rows, scored by the
+        # forest grown so far
+        if len(y_held_out):
+            held_out_correct += int((model.predict(X_held_out) == y_held_out).sum())
+            held_out_rows += len(y_held_out)
+        elapsed = time.perf_counter() - training_started_at
+        logging.info(
+            f"Chunk {chunk_index + 1}: {trained_rows}/{n_rows} rows,"
+            f" {model.n_estimators} trees, {trained_rows / elapsed:,.0f} rows/s,"
+            f" running held-out accuracy"
+            f" {held_out_correct / max(held_out_rows, 1):.4f},"
+            f" peak RSS {peak_rss_mib():.0f} MiB"
+        )
+    training_seconds = time.perf_counter() - training_started_at
+
+    # Score the finished forest on the whole held-out stream
+    correct = total = 0
+    for chunk_index, frame in enumerate(iter_chunks(path, chunk_rows)):
+        _, _, X_held_out, y_held_out = split_chunk(
+            frame, target, chunk_index, holdout_fraction, seed
+        )
+        if len(y_held_out):
+            correct += int((model.predict(X_held_out) == y_held_out).sum())
+            total += len(y_held_out)
+    report = {
+        "dataset": os.path.abspath(path),
+        "rows": n_rows,
+        "trained_rows": trained_rows,
+        "held_out_rows": total,
+        "held_out_accuracy": correct / total if total else None,
+        "chunk_rows": chunk_rows,
+        "trees_per_chunk": trees_per_chunk,
+        "n_estimators": model.n_estimators,
+        "training_seconds": training_seconds,
+        "rows_per_second": trained_rows / training_seconds if training_seconds else None,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+    logging.info(
+        f"Trained {model.n_estimators} trees on {trained_rows} rows in"
+        f" {training_seconds:.1f}s; held-out accuracy {correct / max(total, 1):.4f}"
+    )
+    return model, feature_names, report
+
+
+def dump_atomic(obj, path: str, write=joblib.dump):
+    # Write next to the target, then rename over it, so a backend watching
+    # the file never loads a partially written model
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write(obj, f"{path}.partial")
+    os.replace(f"{path}.partial", path)
+
+
+def write_json(obj, path: str):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the iris classifier")
+    parser.add_argument("--output", default="../backend/model.joblib")
+    parser.add_argument(
+        "--search",
+        action="store_true",
+        help="Pick the cheapest model to serve within --tolerance of the best accuracy",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--data",
+        help="CSV or Parquet dataset to train on out of core, instead of iris",
+    )
+    parser.add_argument("--target", default="target", help="Target column of --data")
+    parser.add_argument("--chunk-rows", type=int, default=100_000)
+    parser.add_argument("--trees-per-chunk", type=int, default=10)
+    parser.add_argument("--holdout-fraction", type=float, default=0.1)
+    parser.add_argument("--max-depth", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
 
-# Load dataset
-data = load_iris()
-X, y = data.data, data.target
+    if args.data:
+        if args.search:
+            parser.error("--search needs an in-memory dataset and can't be combined with --data")
+        model, feature_names, report = train_out_of_core(
+            args.data,
+            args.target,
+            chunk_rows=args.chunk_rows,
+            trees_per_chunk=args.trees_per_chunk,
+            holdout_fraction=args.holdout_fraction,
+            max_depth=args.max_depth,
+        )
+        bundle = make_bundle(
+            model, {label: label for label in model.classes_}, feature_names
+        )
+        report["model_version"] = bundle["model_version"]
+        dump_atomic(report, f"{os.path.splitext(args.output)[0]}.training.json", write_json)
+        dump_atomic(bundle, args.output)
+    else:
+        # Load dataset
+        data = load_iris()
+        X, y = data.data, data.target
 
-# Train model
-model = RandomForestClassifier()
-model.fit(X, y)
+        # Train model
+        if args.search:
+            model, report = search(X, y, tolerance=args.tolerance, max_workers=args.workers)
+            selected = report["selected"]
+            print(
+                f"Selected {selected['params']}: accuracy {selected['cv_accuracy']:.3f}"
+                f" (best {report['best_cv_accuracy']:.3f}),"
+                f" {selected['size_bytes'] / 1024:.0f} KiB,"
+                f" {selected['single_predict_ms']:.2f} ms per row"
+            )
+        else:
+            model = RandomForestClassifier()
+            model.fit(X, y)
+            report = None
 
-joblib.dump(model, "../backend/model.joblib")
+        bundle = make_bundle(model, data.target_names, data.feature_names)
+        if report is not None:
+            # The report is saved next to the artifact, named after it
+            report["model_version"] = bundle["model_version"]
+            dump_atomic(report, f"{os.path.splitext(args.output)[0]}.search.json", write_json)
+        dump_atomic(bundle, args.output)
@@ -1,15 +1,84 @@
+import io
 import logging
 import os
-import time
-from typing import Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, Union
 
-import azure.cognitiveservices.speech as speech_sdk
+from segmentation import read_pcm, samples_to_ticks, split_at_silences
+from speech_backend import speech_sdk
+
+
+class _Transcription:
+    """
+    State of one transcription call.
+
+    Attributes:
+    texts (list[str]): The recognized text segments, in order.
+    segments (list[dict]): Speaker, start, duration, text and language of each recognized segment.
+    done (threading.Event): Set once the recognition session has stopped or was canceled.
+    error (str): Error details if the recognition was canceled because of an error.
+    """
+
+    def __init__(self):
+        self.texts = []
+        self.segments = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class _PipeAudioCallback(speech_sdk.audio.PullAudioInputStreamCallback):
+    """Hand the recognizer some PCM already read, then the rest of a pipe, as it asks for it."""
+
+    def __init__(self, pipe, head: bytes = b""):
+        super().__init__()
+        self._pipe = pipe
+        self._head = memoryview(head)
+
+    def read(self, buffer: memoryview) -> int:
+        if self._head:
+            size = min(len(buffer), len(self._head))
+            buffer[:size] = self._head[:size]
+            self._head = self._head[size:]
+            return size
+        # Blocks until the decoder has written more; 0 ends the stream
+        return self._pipe.readinto(buffer) or 0
+
+    def close(self):
+        self._pipe.close()
+
+
+def pcm_audio_stream(pipe, head: bytes = b"", sample_rate: int = 16000):
+    """
+    Wrap a pipe of 16-bit mono PCM in an audio stream the recognizer pulls from.
+
+    The recognizer reads the pipe only as fast as it recognizes, so the
+    process writing to it is held back instead of the audio piling up in
+    memory.
+
+    Parameters:
+    pipe: A binary file-like object the PCM is read from, e.g. the stdout of utils.open_pcm_decoder.
+    head (bytes): PCM already read from the pipe, handed to the recognizer first (default is none).
+    sample_rate (int): The sample rate of the PCM (default is 16000).
+
+    Returns:
+    PullAudioInputStream: The stream to pass to transcribe in place of a file path.
+    """
+    stream_format = speech_sdk.audio.AudioStreamFormat(
+        samples_per_second=sample_rate, bits_per_sample=16, channels=1
+    )
+    return speech_sdk.audio.PullAudioInputStream(
+        pull_stream_callback=_PipeAudioCallback(pipe, head), stream_format=stream_format
+    )
 
 
 class AzureSpeechServiceTranscription:
     """
     A class for performing speech transcription using the Azure Speech Service.
 
+    Every call to transcribe keeps its own results and completion event, so
+    one instance can run several transcriptions at the same time.
+
     Attributes:
     speech_key (str): Subscription key for the Azure Speech service.
     speech_region (str): Region for the Azure Speech service.
@@ -17,19 +86,29 @@ class AzureSpeechServiceTranscription:
     continuous_LID (bool): Flag to enable continuous Language Identification (default is False).
     possible_languages (list[str]): List of possible languages for language identification (default is ["en-US", "el-Gr"]).
     speech_config (SpeechConfig): Configuration object for the Azure Speech service.
-    transcription (list): List to store the transcribed text segments.
+    transcription (list): The transcribed text segments of the last call completed by the current thread.
+    segments (list[dict]): The segments of the last call completed by the current thread.
 
     Methods:
     __init__(self, speech_key, speech_region, speech_endpoint=None, continuous_LID=False, possible_languages=["en-US", "el-Gr"]):
         Initializes the AzureSpeechServiceTranscription object with the provided parameters.
 
-    transcribe(self, filepath, language="el-Gr") -> TranscriptionResponse:
+    transcribe(self, filepath, language="el-Gr", timeout=None) -> str:
         Performs transcription on the specified audio file and returns the transcription result.
 
-    stop_cb(self, evt):
-        Callback function to stop the speech recognizer.
+    transcribe_segmented(self, filepath, language="el-GR", max_segment_seconds=60.0, max_concurrency=4, timeout=None) -> str:
+        Splits a WAV file at pauses and transcribes the segments concurrently.
+
+    transcribe_detecting_language(self, filepath, timeout=None, max_segment_seconds=None, max_concurrency=4) -> tuple:
+        Transcribes an audio file and identifies its language in the same pass; needs continuous_LID.
 
-    transcribe_sound(self, evt):
+    transcribe_many(self, filepaths, language="el-GR", max_concurrency=4, timeout=None, return_exceptions=False) -> list:
+        Transcribes several audio files concurrently, returning the results in input order.
+
+    stop_cb(self, call, evt):
+        Callback signalling the end of the recognition session of a call.
+
+    transcribe_sound(self, call, evt):
         Callback function to handle recognized speech events and store the transcribed text.
     """
 
@@ -56,6 +135,11 @@ class AzureSpeechServiceTranscription:
             self.speech_config = speech_sdk.SpeechConfig(
                 subscription=speech_key, endpoint=endpoint_string
             )
+            # Set the LanguageIdMode (Optional; Either Continuous or AtStart are accepted; Default AtStart)
+            self.speech_config.set_property(
+                property_id=speech_sdk.PropertyId.SpeechServiceConnection_LanguageIdMode,
+                value="Continuous",
+            )
         else:
             if speech_endpoint:
                 self.speech_config = speech_sdk.SpeechConfig(
@@ -70,75 +154,347 @@ class AzureSpeechServiceTranscription:
             property_id=speech_sdk.PropertyId.SpeechServiceResponse_ProfanityOption,
             value="masked",
         )
-        self.transcription = []
+        # The recognition language is set on the shared config right before a
+        # recognizer copies it, so concurrent calls must not interleave there
+        self._config_lock = threading.Lock()
+        # The service is shared by the invocations of a worker, so every
+        # thread sees the results of its own last call
+        self._last_call = threading.local()
 
-    def transcribe(self, filepath: os.PathLike, language: Optional[str] = "el-GR"):
-        print(f"Transcribing the audio file with SPEECH: {filepath}")
-        if self.continuous_LID:
-            # Set the LanguageIdMode (Optional; Either Continuous or AtStart are accepted; Default AtStart)
-            self.speech_config.set_property(
-                property_id=speech_sdk.PropertyId.SpeechServiceConnection_LanguageIdMode,
-                value="Continuous",
+    @property
+    def transcription(self) -> list:
+        return getattr(self._last_call, "transcription", [])
+
+    @transcription.setter
+    def transcription(self, texts: list):
+        self._last_call.transcription = texts
+
+    @property
+    def segments(self) -> list:
+        return getattr(self._last_call, "segments", [])
+
+    @segments.setter
+    def segments(self, segments: list):
+        self._last_call.segments = segments
+
+    def _create_recognizer(self, filepath, language: Optional[str]):
+        # Initialize audio config
+        if isinstance(filepath, speech_sdk.audio.AudioInputStream):
+            audio_config = speech_sdk.audio.AudioConfig(stream=filepath)
+        else:
+            audio_config = speech_sdk.audio.AudioConfig(
+                use_default_microphone=False, filename=filepath
             )
-            auto_detect_source_language_config = (
-                speech_sdk.languageconfig.AutoDetectSourceLanguageConfig(
-                    languages=self.possible_languages
+        with self._config_lock:
+            if self.continuous_LID:
+                auto_detect_source_language_config = (
+                    speech_sdk.languageconfig.AutoDetectSourceLanguageConfig(
+                        languages=self.possible_languages
+                    )
                 )
+            else:
+                # Set the found language
+                self.speech_config.speech_recognition_language = language
+                auto_detect_source_language_config = None
+            # If there is continuous Language Identification add the auto_detect_source_language_config
+            return speech_sdk.SpeechRecognizer(
+                speech_config=self.speech_config,
+                audio_config=audio_config,
+                auto_detect_source_language_config=auto_detect_source_language_config,
             )
-        else:
-            # Set the found language
-            self.speech_config.speech_recognition_language = language
 
-        # Initialize audio config
-        audio_config = speech_sdk.audio.AudioConfig(
-            use_default_microphone=False, filename=filepath
-        )
+    def transcribe(
+        self,
+        filepath: os.PathLike,
+        language: Optional[str] = "el-GR",
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Transcribe an audio file with continuous recognition.
+
+        Returns as soon as the service stops the session, without polling.
+
+        Parameters:
+        filepath (os.PathLike | AudioInputStream): The WAV file to transcribe, or a stream such as pcm_audio_stream returns.
+        language (str): The language spoken in the file, ignored with continuous_LID (default is "el-GR").
+        timeout (float): Maximum number of seconds to wait for the transcription (default is None, no limit).
+
+        Returns:
+        str: The transcription.
+        """
+        call = self._recognize(filepath, language, timeout)
+        self.transcription = call.texts
+        self.segments = call.segments
+        transcription = " ".join(call.texts)
+        return transcription
 
-        # Initialize speech recognizer
-        # If there is continuous Language Identification add the auto_detect_source_language_config
-        self.speech_recognizer = speech_sdk.SpeechRecognizer(
-            speech_config=self.speech_config,
-            audio_config=audio_config,
-            auto_detect_source_language_config=auto_detect_source_language_config
-            if self.continuous_LID
-            else None,
+    def transcribe_segmented(
+        self,
+        filepath: os.PathLike,
+        language: Optional[str] = "el-GR",
+        max_segment_seconds: float = 60.0,
+        max_concurrency: int = 4,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Transcribe a WAV file as segments recognized concurrently.
+
+        A continuous recognition session takes about as long as the audio, so
+        the file is split at pauses into segments of at most
+        max_segment_seconds, which are recognized by up to max_concurrency
+        sessions at once. The segments are stitched back in order, with their
+        offsets in the file.
+
+        Parameters:
+        filepath (os.PathLike): The 16-bit PCM WAV file to transcribe.
+        language (str): The language spoken in the file, ignored with continuous_LID (default is "el-GR").
+        max_segment_seconds (float): The maximum length of a segment (default is 60).
+        max_concurrency (int): Maximum number of concurrent recognizers (default is 4).
+        timeout (float): Maximum number of seconds to wait for each segment (default is None, no limit).
+
+        Returns:
+        str: The transcription.
+        """
+        call = self._recognize_segmented(
+            filepath, language, timeout, max_segment_seconds, max_concurrency
         )
+        self.transcription = call.texts
+        self.segments = call.segments
+        return " ".join(call.texts)
 
-        # Set the callbacks
-        self.speech_recognizer.recognized.connect(self.transcribe_sound)
-        self.speech_recognizer.session_started.connect(
-            lambda evt: print("Session Started.")
+    def transcribe_detecting_language(
+        self,
+        filepath: os.PathLike,
+        timeout: Optional[float] = None,
+        max_segment_seconds: Optional[float] = None,
+        max_concurrency: int = 4,
+    ) -> tuple:
+        """
+        Transcribe an audio file and identify its language in a single pass.
+
+        The service identifies the language of every segment. The call's
+        language is the one spoken for the longest time.
+
+        Parameters:
+        filepath (os.PathLike | AudioInputStream): The WAV file to transcribe, or a stream such as pcm_audio_stream returns.
+        timeout (float): Maximum number of seconds to wait for the transcription (default is None, no limit).
+        max_segment_seconds (float): Transcribe the WAV file as concurrent segments of at most this length, see transcribe_segmented (default is None, in one session).
+        max_concurrency (int): Maximum number of concurrent recognizers of the segments (default is 4).
+
+        Returns:
+        tuple: The transcription, and the detected language code or None if nothing was recognized.
+        """
+        if not self.continuous_LID:
+            raise ValueError("Identifying the language while transcribing needs continuous_LID")
+        if max_segment_seconds:
+            call = self._recognize_segmented(
+                filepath, None, timeout, max_segment_seconds, max_concurrency
+            )
+        else:
+            call = self._recognize(filepath, None, timeout)
+        self.transcription = call.texts
+        self.segments = call.segments
+
+        durations = {}
+        for segment in call.segments:
+            if segment["language"]:
+                durations[segment["language"]] = (
+                    durations.get(segment["language"], 0) + segment["duration"]
+                )
+        detected_language = max(durations, key=durations.get) if durations else None
+        return " ".join(call.texts), detected_language
+
+    def _recognize_segmented(
+        self,
+        filepath: os.PathLike,
+        language: Optional[str],
+        timeout: Optional[float],
+        max_segment_seconds: float,
+        max_concurrency: int,
+    ) -> _Transcription:
+        samples, sample_rate = read_pcm(filepath)
+        bounds = split_at_silences(samples, sample_rate, max_segment_seconds)
+        logging.info(
+            f"Transcribing {filepath} as {len(bounds)} segments, {max_concurrency} at a time"
         )
-        self.speech_recognizer.session_stopped.connect(
-            lambda evt: print("Session Stopped.")
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+            futures = [
+                pool.submit(
+                    self._recognize_pcm,
+                    samples[start:end].tobytes(),
+                    sample_rate,
+                    language,
+                    timeout,
+                )
+                for start, end in bounds
+            ]
+            try:
+                parts = [future.result() for future in futures]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        # Stitch the segments back, moving their offsets to the whole file's timeline
+        call = _Transcription()
+        for (start, _), part in zip(bounds, parts):
+            offset = samples_to_ticks(start, sample_rate)
+            call.texts.extend(part.texts)
+            call.segments.extend(
+                dict(segment, start=segment["start"] + offset) for segment in part.segments
+            )
+        call.done.set()
+        return call
+
+    def _recognize_pcm(
+        self, pcm: bytes, sample_rate: int, language: Optional[str], timeout: Optional[float]
+    ) -> _Transcription:
+        # Recognizes one segment of transcribe_segmented; a fake recognizer can override it
+        stream = pcm_audio_stream(io.BytesIO(pcm), sample_rate=sample_rate)
+        return self._recognize(stream, language, timeout)
+
+    def _recognize(
+        self, filepath: os.PathLike, language: Optional[str], timeout: Optional[float]
+    ) -> _Transcription:
+        logging.info(f"Transcribing the audio file with SPEECH: {filepath}")
+        call = _Transcription()
+        speech_recognizer = self._create_recognizer(filepath, language)
+
+        # Set the callbacks; they only touch the state of this call
+        speech_recognizer.recognized.connect(lambda evt: self.transcribe_sound(call, evt))
+        speech_recognizer.session_started.connect(
+            lambda evt: logging.info(f"Session started: {filepath}")
         )
-        self.speech_recognizer.canceled.connect(self.stop_cb)
+        speech_recognizer.session_stopped.connect(lambda evt: self.stop_cb(call, evt))
+        speech_recognizer.canceled.connect(lambda evt: self.stop_cb(call, evt))
 
-        self.speech_recognizer.start_continuous_recognition()
-        global done
-        done = False
-        while not done:
-            time.sleep(0.5)
+        speech_recognizer.start_continuous_recognition()
+        try:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Transcribing {filepath} took more than {timeout}s")
+        finally:
+            # Stopping from a callback can deadlock the SDK, so stop from here
+            speech_recognizer.stop_continuous_recognition()
+        if call.error is not None:
+            raise RuntimeError(f"Transcription of {filepath} canceled: {call.error}")
+        return call
 
-        transcription = " ".join(self.transcription)
-        return transcription
+    def transcribe_many(
+        self,
+        filepaths: Sequence[os.PathLike],
+        language: Union[str, Sequence[str], None] = "el-GR",
+        max_concurrency: int = 4,
+        timeout: Optional[float] = None,
+        return_exceptions: bool = False,
+    ) -> list:
+        """
+        Transcribe several audio files concurrently.
+
+        At most max_concurrency recognizers run at a time. Recognition is I/O
+        bound on the service, so threads are enough.
 
-    def stop_cb(self, evt):
-        print("Terminating the speech recognizer...")
-        self.speech_recognizer.stop_continuous_recognition()
-        global done
-        done = True
+        Parameters:
+        filepaths (list[os.PathLike]): The WAV files to transcribe.
+        language (str | list[str]): The language of every file, or one language per file (default is "el-GR").
+        max_concurrency (int): Maximum number of concurrent recognizers (default is 4).
+        timeout (float): Maximum number of seconds to wait for each file (default is None, no limit).
+        return_exceptions (bool): Return the exception of a failed file in its place instead of raising it (default is False).
+
+        Returns:
+        list: The transcription of every file, in the order of filepaths.
+        """
+        if language is None or isinstance(language, str):
+            languages = [language] * len(filepaths)
+        else:
+            languages = list(language)
+            if len(languages) != len(filepaths):
+                raise ValueError("Give one language per file, or a single language")
 
-    def transcribe_sound(self, evt):
-        print("SOUND")
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+            futures = [
+                pool.submit(self.transcribe, filepath, file_language, timeout)
+                for filepath, file_language in zip(filepaths, languages)
+            ]
+            results = []
+            for filepath, future in zip(filepaths, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    if not return_exceptions:
+                        for pending in futures:
+                            pending.cancel()
+                        raise
+                    logging.warning(f"Error transcribing {filepath}: {e}")
+                    results.append(e)
+        return results
+
+    def stop_cb(self, call: _Transcription, evt):
+        if (
+            isinstance(evt, speech_sdk.SpeechRecognitionCanceledEventArgs)
+            and evt.cancellation_details.reason == speech_sdk.CancellationReason.Error
+        ):
+            call.error = evt.cancellation_details.error_details
+            logging.error(f"The speech recognizer was canceled: {call.error}")
+        logging.info("Terminating the speech recognizer...")
+        call.done.set()
+
+    def transcribe_sound(self, call: _Transcription, evt):
         if evt.result.reason == speech_sdk.ResultReason.RecognizedSpeech:
-            print("Recognized Text")
             # Append the transcription
-            self.transcription.append(evt.result.text)
-            self.segments.append(
+            call.texts.append(evt.result.text)
+            call.segments.append(
                 {
-                    "speaker": evt.result.speaker_id,
+                    # Only conversation transcription results carry a speaker
+                    "speaker": getattr(evt.result, "speaker_id", None),
                     "start": evt.result.offset,
                     "duration": evt.result.duration,
+                    "text": evt.result.text,
+                    # Only continuous LID results carry the identified language
+                    "language": evt.result.properties.get(
+                        speech_sdk.PropertyId.SpeechServiceConnection_AutoDetectSourceLanguageResult
+                    )
+                    if self.continuous_LID
+                    else None,
                 }
             )
+
+
+# Configured services of this worker, reused by every invocation it handles
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_transcription_service(
+    speech_key: str,
+    speech_region: str,
+    speech_endpoint: str = None,
+    continuous_LID: bool = False,
+    possible_languages: Optional[list[str]] = ["en-US", "el-GR"],
+) -> AzureSpeechServiceTranscription:
+    """
+    Return the transcription service for these settings, creating it on first use.
+
+    A warm function instance reuses the same SpeechConfig for every blob it
+    processes. The service keeps no state between calls, so sharing it is safe.
+    """
+    cache_key = (
+        speech_key,
+        speech_region,
+        speech_endpoint,
+        continuous_LID,
+        tuple(possible_languages or ()),
+    )
+    service = _services.get(cache_key)
+    if service is None:
+        with _services_lock:
+            service = _services.get(cache_key)
+            if service is None:
+                service = _services[cache_key] = AzureSpeechServiceTranscription(
+                    speech_key=speech_key,
+                    speech_region=speech_region,
+                    speech_endpoint=speech_endpoint,
+                    continuous_LID=continuous_LID,
+                    possible_languages=possible_languages,
+                )
+    return service
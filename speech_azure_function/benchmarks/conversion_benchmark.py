@@ -0,0 +1,115 @@
+"""
+Compare converting a batch of recordings to WAV one at a time, with
+convert_mp3_to_wav_subprocess, and with the parallel convert_files_to_wav,
+in audio seconds converted per wall second.
+
+Without recordings, --generate synthesizes MP3 files with FFmpeg.
+
+Usage (from the speech_azure_function directory):
+    python benchmarks/conversion_benchmark.py path/to/mp3s --concurrency 1,4,8
+    python benchmarks/conversion_benchmark.py --generate 32 --seconds 120
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from utils import (  # noqa: E402
+    available_cores,
+    convert_files_to_wav,
+    convert_mp3_to_wav_subprocess,
+    wav_duration_seconds,
+)
+
+
+def generate_mp3s(directory: str, count: int, seconds: float) -> list:
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"recording_{index:04d}.mp3")
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-nostdin",
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                f"sine=frequency={200 + 10 * index}:duration={seconds}",
+                "-ac",
+                "1",
+                "-ar",
+                "44100",
+                "-b:a",
+                "64k",
+                path,
+            ],
+            check=True,
+        )
+        paths.append(path)
+    return paths
+
+
+def one_at_a_time(mp3_paths: list) -> tuple:
+    """Convert like the function does, returning the audio seconds converted and the wall time."""
+    started_at = time.perf_counter()
+    outputs = [
+        convert_mp3_to_wav_subprocess(path, timeout_threshold_seconds=120)
+        for path in mp3_paths
+    ]
+    seconds = time.perf_counter() - started_at
+    audio_seconds = sum(wav_duration_seconds(path) for path in outputs if path)
+    for path in outputs:
+        if path:
+            os.remove(path)
+    return audio_seconds, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the batch WAV conversion")
+    parser.add_argument("inputs", nargs="*", help="MP3 files or directories of them")
+    parser.add_argument("--generate", type=int, default=0, help="Synthesize this many MP3 files")
+    parser.add_argument("--seconds", type=float, default=120, help="Length of the synthesized files")
+    parser.add_argument("--concurrency", default=f"1,{available_cores()}")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    mp3_paths = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            mp3_paths += sorted(glob.glob(os.path.join(path, "*.mp3")))
+        else:
+            mp3_paths.append(path)
+    if args.generate:
+        mp3_paths += generate_mp3s(workdir, args.generate, args.seconds)
+    if not mp3_paths:
+        sys.exit("Give MP3 files or --generate")
+    # Work on copies, since the one-at-a-time path writes next to its inputs
+    copies = os.path.join(workdir, "inputs")
+    os.makedirs(copies, exist_ok=True)
+    mp3_paths = [shutil.copy(path, copies) for path in mp3_paths]
+
+    audio_seconds, seconds = one_at_a_time(mp3_paths)
+    baseline = audio_seconds / seconds
+    print(f"{len(mp3_paths)} files, {audio_seconds:.0f} s of audio, {available_cores()} cores")
+    print(f"\n{'mode':<28} {'wall s':>8} {'audio s/s':>10} {'speedup':>8}")
+    print(f"{'one at a time':<28} {seconds:>8.2f} {baseline:>10.1f} {1:>8.2f}")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        output_dir = os.path.join(workdir, f"wav_{concurrency}")
+        report = convert_files_to_wav(mp3_paths, output_dir, max_concurrency=concurrency)
+        failed = [result for result in report["files"] if result["error"]]
+        if failed:
+            print(f"{len(failed)} files failed, e.g. {failed[0]['input']}: {failed[0]['error']}")
+        print(
+            f"{f'batch, {concurrency} processes':<28} {report['seconds']:>8.2f}"
+            f" {report['throughput']:>10.1f} {report['throughput'] / baseline:>8.2f}"
+        )
+        shutil.rmtree(output_dir)
+    shutil.rmtree(workdir)
@@ -0,0 +1,106 @@
+"""
+Compare the end-to-end wall time per recording of the language detection
+modes of the transcription function: a detection pass over the whole file,
+over its first seconds, or continuous language identification during the
+transcription pass.
+
+The recordings are converted to WAV once, before any timing, so every mode
+is timed on the same input: language detection plus transcription, as the
+blob trigger runs them. The detected languages are compared with the first
+mode's. The Azure Speech key and region are read from AZURE_SPEECH_KEY and
+AZURE_SPEECH_REGION.
+
+Usage (from the speech_azure_function directory):
+    python benchmarks/lid_benchmark.py path/to/recordings --modes file,prefix,continuous
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from function_app import LANGUAGE_DETECTION_MODES, transcribe_recording  # noqa: E402
+from utils import convert_mp3_to_wav_subprocess  # noqa: E402
+
+
+def wav_seconds(filepath) -> float:
+    with wave.open(filepath, "rb") as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def list_recordings(paths) -> list:
+    recordings = []
+    for path in paths:
+        if os.path.isdir(path):
+            for extension in ("mp3", "wav"):
+                recordings += glob.glob(os.path.join(path, f"*.{extension}"))
+        else:
+            recordings.append(path)
+    return sorted(recordings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the language detection modes")
+    parser.add_argument("recordings", nargs="+", help="MP3/WAV files or directories of them")
+    parser.add_argument("--modes", default=",".join(LANGUAGE_DETECTION_MODES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="Write the timings of every run to this JSON file")
+    args = parser.parse_args()
+    modes = args.modes.split(",")
+
+    wav_paths = []
+    for recording in list_recordings(args.recordings):
+        filepath_wav = convert_mp3_to_wav_subprocess(os.path.abspath(recording))
+        if filepath_wav is None:
+            print(f"Skipping {recording}: it could not be converted to WAV")
+        else:
+            wav_paths.append(filepath_wav)
+    if not wav_paths:
+        sys.exit("No recordings to benchmark")
+
+    runs = []
+    # Every mode sees every recording once before the next repeat, so a
+    # slow period of the service doesn't fall on one mode only
+    for repeat in range(args.repeat):
+        for filepath_wav in wav_paths:
+            for mode in modes:
+                started_at = time.perf_counter()
+                language, transcript, _ = transcribe_recording(filepath_wav, mode)
+                runs.append(
+                    {
+                        "mode": mode,
+                        "recording": filepath_wav,
+                        "audio_seconds": wav_seconds(filepath_wav),
+                        "seconds": time.perf_counter() - started_at,
+                        "language": language,
+                        "words": len(transcript.split()),
+                    }
+                )
+
+    reference = {
+        run["recording"]: run["language"] for run in runs if run["mode"] == modes[0]
+    }
+    print(
+        f"\n{'mode':<12} {'runs':>5} {'mean s':>8} {'median s':>9} {'max s':>7}"
+        f" {'s/audio min':>12} {'same language':>14}"
+    )
+    for mode in modes:
+        mode_runs = [run for run in runs if run["mode"] == mode]
+        seconds = [run["seconds"] for run in mode_runs]
+        audio_minutes = sum(run["audio_seconds"] for run in mode_runs) / 60
+        agreeing = sum(run["language"] == reference[run["recording"]] for run in mode_runs)
+        print(
+            f"{mode:<12} {len(mode_runs):>5} {statistics.mean(seconds):>8.2f}"
+            f" {statistics.median(seconds):>9.2f} {max(seconds):>7.2f}"
+            f" {sum(seconds) / max(audio_minutes, 1e-9):>12.2f}"
+            f" {agreeing:>8}/{len(mode_runs):<5}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"modes": modes, "runs": runs}, f, indent=2)
@@ -0,0 +1,190 @@
+"""
+Run the whole transcription pipeline offline over a generated corpus of
+call recordings, and report where the time of a recording goes.
+
+The speech service is replaced by the local stand-in of local_speech.py,
+with the given session latency and real-time factor. Everything else runs
+as in the function: writing the blob, FFmpeg conversion, trimming,
+language detection and transcription, with --concurrency recordings
+processed at a time like concurrent invocations of one instance. Pipeline
+settings are passed as environment variables with --env.
+
+The corpus is synthesized once: a ringing tone, then turns of voiced
+speech separated by pauses, with a stretch of hold music in some calls,
+encoded to MP3 with FFmpeg.
+
+Usage (from the speech_azure_function directory):
+    python benchmarks/pipeline_benchmark.py --recordings 40 --concurrency 4
+    python benchmarks/pipeline_benchmark.py --env VAD_TRIMMING=true \
+        --env LANGUAGE_DETECTION_MODE=prefix
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def tone(seconds: float, rng, frequencies, level: float) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return level * sum(np.sin(2 * np.pi * f * t + rng.uniform(0, 6)) for f in frequencies)
+
+
+def speech(seconds: float, rng) -> np.ndarray:
+    """Harmonics of a voice whose loudness rises and falls with 4 Hz syllables."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = rng.uniform(100, 220)
+    voice = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 16))
+    syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t + rng.uniform(0, 6)), 0, None)
+    return 3000 * voice * syllables**2
+
+
+def synthesize_call(seconds: float, rng) -> np.ndarray:
+    t = np.arange(int(rng.uniform(3, 9) * SAMPLE_RATE)) / SAMPLE_RATE
+    parts = [tone(len(t) / SAMPLE_RATE, rng, [425], 3000) * ((t % 3) < 1)]
+    music_at = rng.uniform(0.3, 0.7) * seconds if rng.random() < 0.4 else None
+    while sum(map(len, parts)) < seconds * SAMPLE_RATE:
+        if music_at is not None and sum(map(len, parts)) >= music_at * SAMPLE_RATE:
+            parts.append(tone(rng.uniform(15, 45), rng, [262, 330, 392], 1500))
+            music_at = None
+        else:
+            parts.append(speech(rng.uniform(2, 15), rng))
+            parts.append(np.zeros(int(rng.uniform(0.3, 2.5) * SAMPLE_RATE)))
+    samples = np.concatenate(parts)
+    samples += rng.normal(0, 40, len(samples))
+    return np.clip(samples, -32768, 32767).astype(np.int16)
+
+
+def ffmpeg(*arguments):
+    subprocess.run(["ffmpeg", "-nostdin", "-y", "-loglevel", "error", *arguments], check=True)
+
+
+def generate_corpus(directory: str, count: int, min_seconds: float, max_seconds: float, seed: int):
+    from segmentation import write_pcm
+
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(count):
+        wav_path = os.path.join(directory, f"call_{index:04d}.wav")
+        samples = synthesize_call(rng.uniform(min_seconds, max_seconds), rng)
+        write_pcm(wav_path, samples, SAMPLE_RATE)
+        mp3_path = wav_path.replace(".wav", ".mp3")
+        ffmpeg("-i", wav_path, "-b:a", "32k", mp3_path)
+        os.remove(wav_path)
+        paths.append(mp3_path)
+    return paths
+
+
+def describe(values) -> str:
+    values = np.asarray(values)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return (
+        f"{len(values):>5} {values.mean():>8.3f} {p50:>8.3f} {p90:>8.3f}"
+        f" {p99:>8.3f} {values.max():>8.3f} {values.sum():>9.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the transcription pipeline offline")
+    parser.add_argument("--recordings", type=int, default=20)
+    parser.add_argument("--min-seconds", type=float, default=60)
+    parser.add_argument("--max-seconds", type=float, default=300)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--latency", type=float, default=0.2, help="Session latency of the fake service"
+    )
+    parser.add_argument(
+        "--real-time-factor",
+        type=float,
+        default=0.05,
+        help="Seconds the fake service takes per second of audio",
+    )
+    parser.add_argument(
+        "--corpus", help="Reuse the MP3 files of this directory, or generate them into it"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        help="Pipeline setting as KEY=VALUE, e.g. VAD_TRIMMING=true",
+    )
+    args = parser.parse_args()
+
+    # The settings are read when the modules are imported
+    os.environ["SPEECH_BACKEND"] = "local"
+    os.environ.setdefault("AZURE_SPEECH_KEY", "local")
+    os.environ.setdefault("AZURE_SPEECH_REGION", "local")
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        os.environ[key] = value
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    import local_speech  # noqa: E402
+    from function_app import process_recording  # noqa: E402
+    from utils import wav_duration_seconds  # noqa: E402
+
+    local_speech.LATENCY_SECONDS = args.latency
+    local_speech.REAL_TIME_FACTOR = args.real_time_factor
+
+    corpus = args.corpus or tempfile.mkdtemp()
+    os.makedirs(corpus, exist_ok=True)
+    paths = sorted(
+        os.path.join(corpus, name) for name in os.listdir(corpus) if name.endswith(".mp3")
+    )
+    if not paths:
+        started_at = time.perf_counter()
+        paths = generate_corpus(
+            corpus, args.recordings, args.min_seconds, args.max_seconds, args.seed
+        )
+        print(
+            f"Generated {len(paths)} recordings in {corpus}"
+            f" in {time.perf_counter() - started_at:.1f} s"
+        )
+
+    def run(path):
+        started_at = time.perf_counter()
+        with open(path, "rb") as source:
+            result = process_recording(source, os.path.basename(path))
+        result["timings"]["total"] = time.perf_counter() - started_at
+        return result
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(run, paths))
+    wall_seconds = time.perf_counter() - started_at
+
+    # The audio length, from a conversion outside of the timed run
+    audio_seconds = 0.0
+    wav_path = os.path.join(tempfile.mkdtemp(), "audio.wav")
+    for path in paths:
+        ffmpeg("-i", path, wav_path)
+        audio_seconds += wav_duration_seconds(wav_path)
+    os.remove(wav_path)
+
+    stages = []
+    for result in results:
+        stages += [stage for stage in result["timings"] if stage not in stages]
+    print(
+        f"\n{len(results)} recordings, {audio_seconds / 60:.1f} min of audio,"
+        f" {args.concurrency} at a time, {sum(r['cached'] for r in results)} from the cache"
+    )
+    print(f"Settings: {' '.join(args.env) or 'defaults'}")
+    print(
+        f"\n{'stage':<12} {'runs':>5} {'mean s':>8} {'p50 s':>8} {'p90 s':>8}"
+        f" {'p99 s':>8} {'max s':>8} {'total s':>9}"
+    )
+    for stage in stages:
+        values = [r["timings"][stage] for r in results if stage in r["timings"]]
+        print(f"{stage:<12} {describe(values)}")
+    print(
+        f"\n{len(results) / wall_seconds * 60:.1f} recordings/min,"
+        f" {audio_seconds / wall_seconds:.1f} min of audio per min,"
+        f" {wall_seconds:.1f} s wall time"
+    )
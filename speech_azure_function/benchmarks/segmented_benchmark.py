@@ -0,0 +1,144 @@
+"""
+Compare transcribing a long call in one recognition session with
+transcribing it as silence-split segments in parallel, against a local fake
+recognizer, so no Azure Speech resource is needed.
+
+The call is synthesized as utterances of noise separated by quieter pauses.
+The fake recognizer takes real_time_factor seconds per second of audio,
+like a recognition session, and recognizes one segment per utterance. The
+stitched transcript is checked to hold every utterance once, at its offset
+in the call, which fails if a cut fell inside an utterance.
+
+Usage (from the speech_azure_function directory):
+    python benchmarks/segmented_benchmark.py --minutes 20 --concurrency 1,4,8
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from azure_speech import AzureSpeechServiceTranscription, _Transcription  # noqa: E402
+from segmentation import TICKS_PER_SECOND, frame_energy  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+
+def synthesize_call(minutes: float, seed: int = 0):
+    """
+    Return the int16 samples of a synthetic call and the (start, end) seconds of its utterances.
+    """
+    rng = np.random.default_rng(seed)
+    parts, utterances, position = [], [], 0.0
+    while position < minutes * 60:
+        pause = rng.uniform(0.4, 2.0)
+        speech = rng.uniform(1.0, 12.0)
+        parts.append(rng.normal(0, 30, int(pause * SAMPLE_RATE)))
+        parts.append(rng.normal(0, 3000, int(speech * SAMPLE_RATE)))
+        start = position + int(pause * SAMPLE_RATE) / SAMPLE_RATE
+        position = start + int(speech * SAMPLE_RATE) / SAMPLE_RATE
+        utterances.append((start, position))
+    samples = np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+    return samples, utterances
+
+
+class FakeRecognizerTranscription(AzureSpeechServiceTranscription):
+    """
+    Transcription service whose recognizer runs locally: every run of loud
+    frames is recognized as one segment, after real_time_factor seconds per
+    second of audio.
+    """
+
+    def __init__(self, real_time_factor: float):
+        super().__init__(speech_key="fake", speech_region="local")
+        self.real_time_factor = real_time_factor
+
+    def recognize_samples(self, samples: np.ndarray, sample_rate: int) -> _Transcription:
+        call = _Transcription()
+        loud = frame_energy(samples, sample_rate, smoothing_seconds=0.05) > 40
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], loud.astype(np.int8), [0]])))
+        for start, end in zip(edges[::2], edges[1::2]):
+            offset = int(start) * TICKS_PER_SECOND // 100
+            call.texts.append(f"utterance at {offset}")
+            call.segments.append(
+                {
+                    "speaker": None,
+                    "start": offset,
+                    "duration": int(end - start) * TICKS_PER_SECOND // 100,
+                    "text": f"utterance at {offset}",
+                    "language": None,
+                }
+            )
+        time.sleep(len(samples) / sample_rate * self.real_time_factor)
+        call.done.set()
+        return call
+
+    def _recognize_pcm(self, pcm, sample_rate, language, timeout):
+        return self.recognize_samples(np.frombuffer(pcm, dtype="<i2"), sample_rate)
+
+
+def check_stitching(segments: list, utterances: list):
+    starts = np.array([segment["start"] / TICKS_PER_SECOND for segment in segments])
+    expected = np.array([start for start, _ in utterances])
+    if len(starts) != len(expected):
+        raise AssertionError(
+            f"{len(starts)} segments recognized for {len(expected)} utterances: a cut fell inside one"
+        )
+    error = np.abs(starts - expected).max()
+    if error > 0.05:
+        raise AssertionError(f"Segment offsets are up to {error:.3f} s off")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark segmented parallel transcription")
+    parser.add_argument("--minutes", type=float, default=20)
+    parser.add_argument("--max-segment-seconds", type=float, default=60)
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument(
+        "--real-time-factor",
+        type=float,
+        default=0.02,
+        help="Seconds the fake recognizer takes per second of audio",
+    )
+    args = parser.parse_args()
+
+    samples, utterances = synthesize_call(args.minutes)
+    filepath = os.path.join(tempfile.mkdtemp(), "call.wav")
+    with wave.open(filepath, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+    audio_seconds = len(samples) / SAMPLE_RATE
+
+    service = FakeRecognizerTranscription(args.real_time_factor)
+    started_at = time.perf_counter()
+    single = service.recognize_samples(samples, SAMPLE_RATE)
+    single_seconds = time.perf_counter() - started_at
+    check_stitching(single.segments, utterances)
+
+    print(
+        f"{audio_seconds / 60:.1f} min of audio, {len(utterances)} utterances,"
+        f" real time factor {args.real_time_factor}"
+    )
+    print(f"\n{'mode':<24} {'seconds':>8} {'speedup':>8}")
+    print(f"{'one session':<24} {single_seconds:>8.2f} {1:>8.2f}")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        started_at = time.perf_counter()
+        service.transcribe_segmented(
+            filepath,
+            max_segment_seconds=args.max_segment_seconds,
+            max_concurrency=concurrency,
+        )
+        seconds = time.perf_counter() - started_at
+        check_stitching(service.segments, utterances)
+        print(
+            f"{f'segmented, {concurrency} at a time':<24} {seconds:>8.2f}"
+            f" {single_seconds / seconds:>8.2f}"
+        )
+    os.remove(filepath)
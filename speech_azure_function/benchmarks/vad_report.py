@@ -0,0 +1,65 @@
+"""
+Report how much of every recording the voice activity trimming removes,
+and how long the trimming takes.
+
+The recordings are converted to WAV like the function does. The trimmed
+copies are written to --output-dir, to listen to what the transcription
+would receive.
+
+Usage (from the speech_azure_function directory):
+    python benchmarks/vad_report.py path/to/recordings --output-dir /tmp/trimmed
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from segmentation import trim_wav  # noqa: E402
+from utils import convert_mp3_to_wav_subprocess  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the voice activity trimming of recordings")
+    parser.add_argument("recordings", nargs="+", help="MP3/WAV files or directories of them")
+    parser.add_argument("--output-dir", default=None)
+    args = parser.parse_args()
+    output_dir = args.output_dir or tempfile.mkdtemp()
+    os.makedirs(output_dir, exist_ok=True)
+
+    recordings = []
+    for path in args.recordings:
+        if os.path.isdir(path):
+            recordings += glob.glob(os.path.join(path, "*.mp3"))
+            recordings += glob.glob(os.path.join(path, "*.wav"))
+        else:
+            recordings.append(path)
+
+    print(f"{'recording':<40} {'original s':>11} {'trimmed s':>10} {'kept':>6} {'trim s':>7}")
+    total_original = total_trimmed = 0.0
+    for recording in sorted(recordings):
+        filepath_wav = convert_mp3_to_wav_subprocess(os.path.abspath(recording))
+        if filepath_wav is None:
+            print(f"{os.path.basename(recording):<40} could not be converted to WAV")
+            continue
+        name = os.path.splitext(os.path.basename(recording))[0]
+        started_at = time.perf_counter()
+        _, offset_map = trim_wav(
+            filepath_wav, os.path.join(output_dir, f"{name}.trimmed.wav")
+        )
+        seconds = time.perf_counter() - started_at
+        total_original += offset_map.original_seconds
+        total_trimmed += offset_map.trimmed_seconds
+        print(
+            f"{name[:40]:<40} {offset_map.original_seconds:>11.1f}"
+            f" {offset_map.trimmed_seconds:>10.1f}"
+            f" {offset_map.trimmed_seconds / max(offset_map.original_seconds, 1e-9):>6.0%}"
+            f" {seconds:>7.2f}"
+        )
+    print(
+        f"{'total':<40} {total_original:>11.1f} {total_trimmed:>10.1f}"
+        f" {total_trimmed / max(total_original, 1e-9):>6.0%}"
+    )
+    print(f"\nTrimmed recordings written to {output_dir}")
@@ -1,15 +1,382 @@
+import io
 import logging
 import os
 import tempfile
+import threading
+import time
 import uuid
+import wave
+from contextlib import contextmanager
 
 import azure.functions as func
-from azure_speech import AzureSpeechServiceTranscription
-from language import speech_language_detection_once_from_file
-from utils import convert_mp3_to_wav_subprocess
+from azure_speech import get_transcription_service, pcm_audio_stream
+from language import (
+    get_language_detection_config,
+    speech_language_detection_once_from_file,
+    speech_language_detection_once_from_pcm,
+    speech_language_detection_once_from_prefix,
+)
+from result_cache import ResultCache, copy_hashing, hash_bytes
+from segmentation import trim_wav
+from utils import convert_mp3_to_wav_subprocess, decoder_stderr, open_pcm_decoder
+
+# How the language of a call is identified:
+# - "file": a detection pass over the WAV, then a transcription pass
+# - "prefix": a detection pass over the first LANGUAGE_DETECTION_PREFIX_SECONDS
+#   of the WAV, then a transcription pass
+# - "continuous": one transcription pass with continuous language identification
+LANGUAGE_DETECTION_MODE = os.getenv("LANGUAGE_DETECTION_MODE", "file")
+LANGUAGE_DETECTION_PREFIX_SECONDS = float(
+    os.getenv("LANGUAGE_DETECTION_PREFIX_SECONDS", "15")
+)
+LANGUAGE_DETECTION_MODES = ("file", "prefix", "continuous")
+# Pipe the blob through FFmpeg into the recognizer instead of converting it
+# to a WAV file first. The whole file is not available then, so the "file"
+# mode detects the language from the prefix too.
+AUDIO_STREAMING = os.getenv("AUDIO_STREAMING", "false").lower() == "true"
+STREAMING_SAMPLE_RATE = 16000
+# Above 1, a WAV recording is split at pauses into segments of at most
+# MAX_SEGMENT_SECONDS, which are transcribed this many at a time
+TRANSCRIPTION_MAX_CONCURRENCY = int(os.getenv("TRANSCRIPTION_MAX_CONCURRENCY", "1"))
+MAX_SEGMENT_SECONDS = float(os.getenv("MAX_SEGMENT_SECONDS", "60"))
+# Cut silence, ringing and hold music out of the WAV before detecting its
+# language and transcribing it
+VAD_TRIMMING = os.getenv("VAD_TRIMMING", "false").lower() == "true"
+# Directory of the cache of results by recording content, which skips the
+# stages already done for a retried or re-uploaded recording. The cache is
+# off without it. Pointing it to a share mounted by every instance makes
+# them share the results.
+TRANSCRIPTION_CACHE_DIR = os.getenv("TRANSCRIPTION_CACHE_DIR")
+TRANSCRIPTION_CACHE_MAX_MB = float(os.getenv("TRANSCRIPTION_CACHE_MAX_MB", "2048"))
+TRANSCRIPTION_CACHE_MAX_AGE_DAYS = float(os.getenv("TRANSCRIPTION_CACHE_MAX_AGE_DAYS", "7"))
+# Results read or stored this recently are never evicted, since an invocation
+# may still be using them; keep it above the function timeout
+TRANSCRIPTION_CACHE_LEASE_MINUTES = float(os.getenv("TRANSCRIPTION_CACHE_LEASE_MINUTES", "60"))
 
 app = func.FunctionApp()
 
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the result cache of this instance, opening it on first use, or None if it is off."""
+    global _result_cache
+    if TRANSCRIPTION_CACHE_DIR and _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(
+                    TRANSCRIPTION_CACHE_DIR,
+                    max_bytes=int(TRANSCRIPTION_CACHE_MAX_MB * 1024 * 1024),
+                    max_age_seconds=TRANSCRIPTION_CACHE_MAX_AGE_DAYS * 24 * 3600,
+                    lease_seconds=TRANSCRIPTION_CACHE_LEASE_MINUTES * 60,
+                )
+    return _result_cache
+
+
+def cache_stage(name: str) -> str:
+    """Name a cached pipeline stage after the settings its result depends on."""
+    segments = MAX_SEGMENT_SECONDS if TRANSCRIPTION_MAX_CONCURRENCY > 1 else 0
+    mode = LANGUAGE_DETECTION_MODE
+    # The streaming "file" mode also detects the language from the prefix
+    if mode == "prefix" or (AUDIO_STREAMING and mode != "continuous"):
+        mode = f"{mode}={LANGUAGE_DETECTION_PREFIX_SECONDS:g}"
+    if AUDIO_STREAMING:
+        return f"{name}:stream:{mode}"
+    if name == "language":
+        return f"{name}:{mode}:vad={VAD_TRIMMING}"
+    return f"{name}:{mode}:vad={VAD_TRIMMING}:segments={segments}"
+
+
+def wav_seconds(filepath_wav) -> float:
+    with wave.open(filepath_wav, "rb") as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def speech_service(mode: str, continuous_LID: bool = None):
+    """
+    Return the transcription service for a language detection mode.
+
+    The speech configs are created by the first invocation on this instance
+    and reused by the next ones.
+    """
+    if mode not in LANGUAGE_DETECTION_MODES:
+        raise ValueError(
+            f"Unknown language detection mode {mode!r}, expected one of {LANGUAGE_DETECTION_MODES}"
+        )
+    if continuous_LID is None:
+        continuous_LID = mode == "continuous"
+    setup_started_at = time.perf_counter()
+    service = get_transcription_service(
+        speech_key=os.getenv("AZURE_SPEECH_KEY"),
+        speech_region=os.getenv("AZURE_SPEECH_REGION"),
+        continuous_LID=continuous_LID,
+    )
+    if not continuous_LID:
+        get_language_detection_config()
+    logging.info(
+        f"Speech setup took {(time.perf_counter() - setup_started_at) * 1e3:.2f} ms"
+    )
+    return service
+
+
+def detect_language(filepath_wav, mode: str = None):
+    """
+    Identify the language of a WAV recording before transcribing it.
+
+    Parameters:
+    filepath_wav (os.PathLike): The WAV file.
+    mode (str): "file" or "prefix" (default is LANGUAGE_DETECTION_MODE).
+
+    Returns:
+    str: The detected language code, or None if no speech was recognized.
+    """
+    mode = mode or LANGUAGE_DETECTION_MODE
+    detected_language = None
+    if mode == "prefix":
+        detected_language = speech_language_detection_once_from_prefix(
+            filepath_wav, LANGUAGE_DETECTION_PREFIX_SECONDS
+        )
+    # Nothing may be said in the prefix, e.g. during a hold message
+    if detected_language is None:
+        detected_language = speech_language_detection_once_from_file(filepath_wav)
+    logging.info(f"Detected language: {detected_language}")
+    return detected_language
+
+
+def transcribe_recording(
+    filepath_wav, mode: str = None, language: str = None, language_detected: bool = False
+):
+    """
+    Identify the language of a WAV recording and transcribe it.
+
+    Parameters:
+    filepath_wav (os.PathLike): The WAV file to transcribe.
+    mode (str): One of LANGUAGE_DETECTION_MODES (default is LANGUAGE_DETECTION_MODE).
+    language (str): The language of the recording if already detected; the continuous mode ignores it (default is None).
+    language_detected (bool): The detection already ran and language is its
+        result, even if None, so it is not run again (default is False).
+
+    Returns:
+    tuple: The detected language code, the transcription and its segments.
+    """
+    mode = mode or LANGUAGE_DETECTION_MODE
+    service = speech_service(mode)
+
+    if mode == "continuous":
+        logging.info("Going to transcribe with Speech Service with continous LID")
+        transcript, detected_language = service.transcribe_detecting_language(
+            filepath_wav,
+            max_segment_seconds=MAX_SEGMENT_SECONDS
+            if TRANSCRIPTION_MAX_CONCURRENCY > 1
+            else None,
+            max_concurrency=TRANSCRIPTION_MAX_CONCURRENCY,
+        )
+        logging.info(f"Detected language: {detected_language}")
+        return detected_language, transcript, service.segments
+
+    # Detect the language of the audio file
+    detected_language = language
+    if detected_language is None and not language_detected:
+        detected_language = detect_language(filepath_wav, mode)
+
+    logging.info("Going to transcribe with Speech Service")
+    if TRANSCRIPTION_MAX_CONCURRENCY > 1:
+        transcript = service.transcribe_segmented(
+            filepath_wav,
+            language=detected_language,
+            max_segment_seconds=MAX_SEGMENT_SECONDS,
+            max_concurrency=TRANSCRIPTION_MAX_CONCURRENCY,
+        )
+    else:
+        transcript = service.transcribe(filepath_wav, language=detected_language)
+    return detected_language, transcript, service.segments
+
+
+def transcribe_audio_stream(source, mode: str = None):
+    """
+    Identify the language of an encoded recording and transcribe it, without temp files.
+
+    The recording is piped through FFmpeg and the recognizer pulls the PCM
+    as it is decoded, so transcription starts before the conversion ends.
+    Only the language detection prefix is held in memory.
+
+    Parameters:
+    source: A binary file-like object, or an iterable of bytes chunks, holding the encoded audio.
+    mode (str): One of LANGUAGE_DETECTION_MODES (default is LANGUAGE_DETECTION_MODE).
+
+    Returns:
+    tuple: The detected language code, the transcription and its segments.
+    """
+    mode = mode or LANGUAGE_DETECTION_MODE
+    service = speech_service(mode)
+    process = open_pcm_decoder(source, sample_rate=str(STREAMING_SAMPLE_RATE))
+    try:
+        detected_language = None
+        prefix = b""
+        if mode != "continuous":
+            # 16-bit mono: 2 bytes per sample
+            prefix = process.stdout.read(
+                int(LANGUAGE_DETECTION_PREFIX_SECONDS * STREAMING_SAMPLE_RATE) * 2
+            )
+            detected_language = speech_language_detection_once_from_pcm(
+                prefix, sample_rate=STREAMING_SAMPLE_RATE
+            )
+        stream = pcm_audio_stream(process.stdout, prefix, STREAMING_SAMPLE_RATE)
+
+        if detected_language is None:
+            # The rest of the stream can't be replayed, so identify the
+            # language while transcribing when the prefix had no speech
+            logging.info("Going to transcribe with Speech Service with continous LID")
+            service = speech_service(mode, continuous_LID=True)
+            transcript, detected_language = service.transcribe_detecting_language(stream)
+        else:
+            logging.info("Going to transcribe with Speech Service")
+            transcript = service.transcribe(stream, language=detected_language)
+        logging.info(f"Detected language: {detected_language}")
+
+        # A decoding error ends the PCM early, which looks like the end of the call
+        if process.wait(timeout=60) != 0:
+            error = decoder_stderr(process) or f"exit code {process.returncode}"
+            logging.warning(f"Decoding the audio failed: {error}")
+            raise RuntimeError(f"FFmpeg failed to decode the audio: {error}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return detected_language, transcript, service.segments
+
+
+@contextmanager
+def timed(timings: dict, stage: str):
+    """Add the wall time of the block to timings[stage]."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started_at
+
+
+def process_recording(source, fullname: str) -> dict:
+    """
+    Run the whole pipeline on one uploaded recording.
+
+    Parameters:
+    source: A binary file-like object holding the recording.
+    fullname (str): The file name of the recording.
+
+    Returns:
+    dict: The "language", "transcript" and "segments" of the recording,
+          "cached" if they came from the result cache, and "timings", the
+          seconds spent in every stage of the pipeline.
+    """
+    cache = get_result_cache()
+    timings = {}
+
+    if AUDIO_STREAMING:
+        # ========================== Extract Transcription ==========================
+
+        # The host has already read the whole blob into memory
+        with timed(timings, "read"):
+            data = source.read()
+            content_hash = hash_bytes(data)
+        stage = cache_stage("transcript")
+        result = cache.get(content_hash, stage) if cache else None
+        if result is not None:
+            return dict(result, cached=True, timings=timings)
+        with timed(timings, "transcribe"):
+            detected_language, transcript, segments = transcribe_audio_stream(
+                io.BytesIO(data)
+            )
+        result = {
+            "language": detected_language,
+            "transcript": transcript,
+            "segments": segments,
+        }
+        if cache:
+            cache.put(content_hash, stage, result)
+        return dict(result, cached=False, timings=timings)
+
+    # ========================== Preprocess Audio Call ==========================
+
+    # Store a file locally
+    tempFilePath = tempfile.gettempdir()
+    random_id = uuid.uuid4().hex
+    temp_audio_path = f"{tempFilePath}/{random_id}_{fullname}"
+    wav_path = temp_audio_path.replace(".mp3", ".wav")
+    trimmed_path = f"{os.path.splitext(wav_path)[0]}.trimmed.wav"
+    with timed(timings, "write"):
+        content_hash = copy_hashing(source, temp_audio_path)
+
+    try:
+        # Retries and re-uploads of a recording already processed stop here
+        stage = cache_stage("transcript")
+        result = cache.get(content_hash, stage) if cache else None
+        if result is not None:
+            return dict(result, cached=True, timings=timings)
+
+        converted = cache.get(content_hash, "wav") if cache else None
+        if converted is not None:
+            filepath_wav = converted["path"]
+        else:
+            # Convert the file to WAV format if needed
+            with timed(timings, "convert"):
+                filepath_wav = convert_mp3_to_wav_subprocess(
+                    temp_audio_path, timeout_threshold_seconds=120
+                )
+            if filepath_wav is None:
+                raise RuntimeError(f"Could not convert {fullname} to WAV")
+            if cache:
+                filepath_wav = cache.put_wav(
+                    content_hash, filepath_wav, wav_seconds(filepath_wav)
+                )
+
+        offset_map = None
+        if VAD_TRIMMING:
+            with timed(timings, "trim"):
+                filepath_wav, offset_map = trim_wav(filepath_wav, trimmed_path)
+            logging.info(
+                f"Trimmed {fullname} from {offset_map.original_seconds:.1f} s"
+                f" to {offset_map.trimmed_seconds:.1f} s of audio"
+                f" in {timings['trim']:.2f} s"
+            )
+
+        # ========================== Extract Transcription ==========================
+
+        # The continuous mode identifies the language while transcribing
+        detected_language = None
+        if LANGUAGE_DETECTION_MODE != "continuous":
+            language_stage = cache_stage("language")
+            detected = cache.get(content_hash, language_stage) if cache else None
+            if detected is None:
+                with timed(timings, "language"):
+                    detected = {"language": detect_language(filepath_wav)}
+                if cache:
+                    cache.put(content_hash, language_stage, detected)
+            detected_language = detected["language"]
+
+        with timed(timings, "transcribe"):
+            detected_language, transcript, segments = transcribe_recording(
+                filepath_wav,
+                language=detected_language,
+                language_detected=LANGUAGE_DETECTION_MODE != "continuous",
+            )
+        if offset_map is not None:
+            # Time the segments in the uploaded recording, not the trimmed one
+            segments = offset_map.restore_segments(segments)
+        result = {
+            "language": detected_language,
+            "transcript": transcript,
+            "segments": segments,
+        }
+        if cache:
+            cache.put(content_hash, stage, result)
+    finally:
+        for path in {temp_audio_path, wav_path, trimmed_path}:
+            if os.path.exists(path):
+                os.remove(path)
+    return dict(result, cached=False, timings=timings)
+
 
 @app.function_name(name="call-center-transcription")
 @app.blob_trigger(
@@ -28,33 +395,9 @@ def blob_trigger(myblob: func.InputStream):
     filename = fullname.split(".")[0]
     logging.info(f"Processing file: {fullname}")
 
-    # ========================== Preprocess Audio Call ==========================
-
-    # Store a file locally
-    tempFilePath = tempfile.gettempdir()
-    random_id = uuid.uuid4().hex
-    temp_audio_path = f"{tempFilePath}/{random_id}_{fullname}"
-    with open(temp_audio_path, "wb") as f:
-        f.write(myblob.read())
-        f.close()
-
-    # Convert the file to WAV format if needed
-    filepath_wav = convert_mp3_to_wav_subprocess(
-        temp_audio_path, timeout_threshold_seconds=120
+    result = process_recording(myblob, fullname)
+    logging.info(
+        f"Stage timings of {fullname}: "
+        + ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in result["timings"].items())
     )
-
-    # ========================== Extract Transcription ==========================
-
-    service = AzureSpeechServiceTranscription(
-        speech_key=os.getenv("AZURE_SPEECH_KEY"),
-        speech_region=os.getenv("AZURE_SPEECH_REGION"),
-        continuous_LID=False,
-    )
-
-    # Detect the language of the audio file
-    detected_language = speech_language_detection_once_from_file(filepath_wav)
-    logging.info(f"Detected language: {detected_language}")
-
-    logging.info("Going to transcribe with Speech Service with continous LID")
-    transcript = service.transcribe(filepath_wav, language=detected_language)
-    logging.info(f"Transcription: {transcript}")
+    logging.info(f"Transcription: {result['transcript']}")
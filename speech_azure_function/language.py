@@ -1,27 +1,81 @@
 import logging
 import os
+import threading
+import wave
 
-import azure.cognitiveservices.speech as speechsdk
+from speech_backend import speech_sdk as speechsdk
 
 # Get the necessary values for the azure speech key and region for Speech Language
 AZURE_SPEECH_KEY = os.getenv("AZURE_SPEECH_KEY")
 AZURE_SPEECH_REGION = os.getenv("AZURE_SPEECH_REGION")
 # AZURE_SPEECH_ENDPOINT = os.getenv("AZURE_SPEECH_ENDPOINT")
+POSSIBLE_LANGUAGES = ("en-US", "el-GR")
 
+# Language detection configs of this worker, reused by every invocation it handles
+_detection_configs = {}
+_detection_configs_lock = threading.Lock()
 
-def speech_language_detection_once_from_file(filepath):
+
+def get_language_detection_config(
+    speech_key: str = None,
+    speech_region: str = None,
+    languages=POSSIBLE_LANGUAGES,
+):
+    """
+    Return the SpeechConfig and AutoDetectSourceLanguageConfig for language
+    detection, creating them on first use.
+
+    Parameters:
+    speech_key (str): Subscription key for the Azure Speech service (default is AZURE_SPEECH_KEY).
+    speech_region (str): Region for the Azure Speech service (default is AZURE_SPEECH_REGION).
+    languages (tuple[str]): The possible spoken languages (default is POSSIBLE_LANGUAGES).
+
+    Returns:
+    tuple: The SpeechConfig and the AutoDetectSourceLanguageConfig.
+    """
+    cache_key = (
+        speech_key or AZURE_SPEECH_KEY,
+        speech_region or AZURE_SPEECH_REGION,
+        tuple(languages),
+    )
+    configs = _detection_configs.get(cache_key)
+    if configs is None:
+        with _detection_configs_lock:
+            configs = _detection_configs.get(cache_key)
+            if configs is None:
+                # Creates an AutoDetectSourceLanguageConfig, which defines a number of possible spoken languages
+                auto_detect_source_language_config = (
+                    speechsdk.languageconfig.AutoDetectSourceLanguageConfig(
+                        languages=list(cache_key[2])
+                    )
+                )
+                # Creates a SpeechConfig from your speech key and region
+                speech_config = speechsdk.SpeechConfig(
+                    subscription=cache_key[0],
+                    region=cache_key[1],
+                    # endpoint=AZURE_SPEECH_ENDPOINT,
+                )
+                configs = _detection_configs[cache_key] = (
+                    speech_config,
+                    auto_detect_source_language_config,
+                )
+    return configs
+
+
+def speech_language_detection_once_from_file(filepath, languages=POSSIBLE_LANGUAGES):
     """
     Perform one-shot speech language detection with input from an audio file.
 
     Parameters:
     filepath (os.PathLike): The path to the audio file to be used for language detection.
+    languages (tuple[str]): The possible spoken languages (default is POSSIBLE_LANGUAGES).
 
     Returns:
     str: The detected language code if speech is recognized, otherwise None.
 
     Notes:
-    - The function creates an `AutoDetectSourceLanguageConfig` with a list of possible spoken languages.
-    - A `SpeechConfig` is created using the Azure Speech key and endpoint.
+    - The `AutoDetectSourceLanguageConfig` with the possible spoken languages and the `SpeechConfig`
+      are created on the first call and reused afterwards, see `get_language_detection_config`.
     - An `AudioConfig` is created from the provided WAV file.
     - A `SourceLanguageRecognizer` is initialized with the speech, auto-detect language, and audio configurations.
     - The recognizer performs language detection with the `recognize_once` method.
@@ -34,25 +88,77 @@ def speech_language_detection_once_from_file(filepath):
     "en-US"
     """
 
-    # Creates an AutoDetectSourceLanguageConfig, which defines a number of possible spoken languages
-    auto_detect_source_language_config = (
-        speechsdk.languageconfig.AutoDetectSourceLanguageConfig(
-            languages=[
-                "en-US",
-                "el-GR",
-            ]
+    # Creates an AudioConfig from a given WAV file
+    audio_config = speechsdk.audio.AudioConfig(filename=filepath)
+    return _detect_language(audio_config, languages)
+
+
+def speech_language_detection_once_from_prefix(
+    filepath, prefix_seconds: float = 15.0, languages=POSSIBLE_LANGUAGES
+):
+    """
+    Perform one-shot speech language detection on the first seconds of a WAV file.
+
+    The prefix is read from the decoded WAV into memory and pushed to the
+    recognizer as a stream, so the service never receives more than
+    prefix_seconds of audio, however long the call is.
+
+    Parameters:
+    filepath (os.PathLike): The path to the PCM WAV file to be used for language detection.
+    prefix_seconds (float): The number of seconds from the start of the file to detect the language from (default is 15).
+    languages (tuple[str]): The possible spoken languages (default is POSSIBLE_LANGUAGES).
+
+    Returns:
+    str: The detected language code if speech is recognized in the prefix, otherwise None.
+    """
+    with wave.open(os.fspath(filepath), "rb") as wav:
+        prefix = wav.readframes(int(prefix_seconds * wav.getframerate()))
+        return speech_language_detection_once_from_pcm(
+            prefix,
+            sample_rate=wav.getframerate(),
+            bits_per_sample=wav.getsampwidth() * 8,
+            channels=wav.getnchannels(),
+            languages=languages,
         )
-    )
 
-    # Creates a SpeechConfig from your speech key and region
-    speech_config = speechsdk.SpeechConfig(
-        subscription=AZURE_SPEECH_KEY,
-        region=AZURE_SPEECH_REGION,
-        # endpoint=AZURE_SPEECH_ENDPOINT,
+
+def speech_language_detection_once_from_pcm(
+    pcm: bytes,
+    sample_rate: int = 16000,
+    bits_per_sample: int = 16,
+    channels: int = 1,
+    languages=POSSIBLE_LANGUAGES,
+):
+    """
+    Perform one-shot speech language detection on raw PCM audio held in memory.
+
+    Parameters:
+    pcm (bytes): The PCM samples.
+    sample_rate (int): The sample rate of the PCM (default is 16000).
+    bits_per_sample (int): The size of every sample (default is 16).
+    channels (int): The number of interleaved channels (default is 1).
+    languages (tuple[str]): The possible spoken languages (default is POSSIBLE_LANGUAGES).
+
+    Returns:
+    str: The detected language code if speech is recognized, otherwise None.
+    """
+    stream_format = speechsdk.audio.AudioStreamFormat(
+        samples_per_second=sample_rate,
+        bits_per_sample=bits_per_sample,
+        channels=channels,
     )
+    stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+    stream.write(pcm)
+    # Closing the stream tells the recognizer the audio ends here
+    stream.close()
+    audio_config = speechsdk.audio.AudioConfig(stream=stream)
+    return _detect_language(audio_config, languages)
 
-    # Creates an AudioConfig from a given WAV file
-    audio_config = speechsdk.audio.AudioConfig(filename=filepath)
+
+def _detect_language(audio_config, languages):
+    speech_config, auto_detect_source_language_config = get_language_detection_config(
+        languages=languages
+    )
 
     # Creates a source language recognizer using a file as audio input, also specify the speech language
     source_language_recognizer = speechsdk.SourceLanguageRecognizer(
@@ -82,5 +188,5 @@ def speech_language_detection_once_from_file(filepath):
             )
         )
         # detected_src_lang = "el-GR"
-        raise "Speech Language Detection canceled"
+        raise RuntimeError("Speech Language Detection canceled")
     return detected_src_lang
@@ -0,0 +1,241 @@
+"""
+A local stand-in for the parts of the Azure Speech SDK the function uses.
+
+With SPEECH_BACKEND=local the function recognizes speech with this module
+instead of the service, so the pipeline runs without credentials or
+network. Every run of loud audio is recognized as one utterance, after a
+session latency plus a real-time factor times the audio read, and is
+reported in the language of the recognizer's config.
+
+The latency and real-time factor come from LOCAL_SPEECH_LATENCY_SECONDS
+and LOCAL_SPEECH_REAL_TIME_FACTOR, or can be set on the module.
+"""
+
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from segmentation import TICKS_PER_SECOND, frame_energy, read_pcm
+
+# Seconds before a session starts returning results
+LATENCY_SECONDS = float(os.getenv("LOCAL_SPEECH_LATENCY_SECONDS", "0.2"))
+# Seconds of recognition per second of audio
+REAL_TIME_FACTOR = float(os.getenv("LOCAL_SPEECH_REAL_TIME_FACTOR", "0.05"))
+# Seconds of audio read from a stream at a time
+CHUNK_SECONDS = 0.1
+
+
+class PropertyId:
+    SpeechServiceResponse_ProfanityOption = "SpeechServiceResponse_ProfanityOption"
+    SpeechServiceConnection_LanguageIdMode = "SpeechServiceConnection_LanguageIdMode"
+    SpeechServiceConnection_AutoDetectSourceLanguageResult = (
+        "SpeechServiceConnection_AutoDetectSourceLanguageResult"
+    )
+
+
+class ResultReason:
+    RecognizedSpeech = "RecognizedSpeech"
+    NoMatch = "NoMatch"
+    Canceled = "Canceled"
+
+
+class CancellationReason:
+    Error = "Error"
+    EndOfStream = "EndOfStream"
+
+
+class SpeechConfig:
+    def __init__(self, subscription=None, region=None, endpoint=None):
+        self.speech_recognition_language = "en-US"
+        self.properties = {}
+
+    def set_property(self, property_id, value):
+        self.properties[property_id] = value
+
+
+class _Audio:
+    class AudioStreamFormat:
+        def __init__(self, samples_per_second=16000, bits_per_sample=16, channels=1):
+            self.samples_per_second = samples_per_second
+            self.bits_per_sample = bits_per_sample
+            self.channels = channels
+
+    class AudioInputStream:
+        pass
+
+    class PullAudioInputStreamCallback:
+        def read(self, buffer: memoryview) -> int:
+            return 0
+
+        def close(self):
+            pass
+
+    class PullAudioInputStream(AudioInputStream):
+        def __init__(self, pull_stream_callback, stream_format=None):
+            self.callback = pull_stream_callback
+            self.stream_format = stream_format or _Audio.AudioStreamFormat()
+
+    class PushAudioInputStream(AudioInputStream):
+        def __init__(self, stream_format=None):
+            self.stream_format = stream_format or _Audio.AudioStreamFormat()
+            self.data = bytearray()
+
+        def write(self, buffer: bytes):
+            self.data += buffer
+
+        def close(self):
+            pass
+
+    class AudioConfig:
+        def __init__(self, use_default_microphone=False, filename=None, stream=None):
+            self.filename = filename
+            self.stream = stream
+
+
+audio = _Audio
+languageconfig = SimpleNamespace(
+    AutoDetectSourceLanguageConfig=lambda languages=None: SimpleNamespace(languages=languages)
+)
+
+
+class SpeechRecognitionCanceledEventArgs:
+    def __init__(self, reason, error_details=""):
+        self.cancellation_details = SimpleNamespace(reason=reason, error_details=error_details)
+
+
+class _Signal:
+    def __init__(self):
+        self._callbacks = []
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def emit(self, evt):
+        for callback in self._callbacks:
+            callback(evt)
+
+
+def _read_audio(audio_config, stop: threading.Event = None, pace: bool = True):
+    """
+    Read the mono int16 samples and sample rate of an audio config, taking
+    REAL_TIME_FACTOR seconds per second of audio read unless pace is False.
+    """
+    if audio_config.filename is not None:
+        samples, sample_rate = read_pcm(audio_config.filename)
+    elif isinstance(audio_config.stream, audio.PushAudioInputStream):
+        samples = np.frombuffer(bytes(audio_config.stream.data), dtype="<i2")
+        sample_rate = audio_config.stream.stream_format.samples_per_second
+    else:
+        return _read_pull_stream(audio_config.stream, stop)
+    if pace:
+        time.sleep(len(samples) / sample_rate * REAL_TIME_FACTOR)
+    return samples, sample_rate
+
+
+def _read_pull_stream(stream, stop: threading.Event = None):
+    # Pull streams are read chunk by chunk, like the service does
+    sample_rate = stream.stream_format.samples_per_second
+    chunks = []
+    buffer = bytearray(int(sample_rate * CHUNK_SECONDS) * 2)
+    while stop is None or not stop.is_set():
+        size = stream.callback.read(memoryview(buffer))
+        if not size:
+            break
+        chunks.append(bytes(buffer[:size]))
+        time.sleep(size / 2 / sample_rate * REAL_TIME_FACTOR)
+    stream.callback.close()
+    data = b"".join(chunks)
+    return np.frombuffer(data[: len(data) // 2 * 2], dtype="<i2"), sample_rate
+
+
+def _utterances(samples: np.ndarray, sample_rate: int, frame_seconds: float = 0.01):
+    """The (start, end) seconds of the runs of loud audio, bridging pauses under 300 ms."""
+    if len(samples) < sample_rate * frame_seconds:
+        return []
+    energy = frame_energy(samples, sample_rate, frame_seconds, smoothing_seconds=0.05)
+    loud = np.concatenate([[0], energy > np.percentile(energy, 10) + 15, [0]])
+    edges = np.flatnonzero(np.diff(loud.astype(np.int8)))
+    starts, ends = edges[::2], edges[1::2]
+    if not len(starts):
+        return []
+    separate = starts[1:] - ends[:-1] > int(0.3 / frame_seconds)
+    starts = np.concatenate([starts[:1], starts[1:][separate]])
+    ends = np.concatenate([ends[:-1][separate], ends[-1:]])
+    return [
+        (start * frame_seconds, end * frame_seconds)
+        for start, end in zip(starts, ends)
+        if end - start >= int(0.1 / frame_seconds)
+    ]
+
+
+def _result(language, start, end, index):
+    # A word every 350 ms, roughly the pace of conversation
+    text = " ".join(f"word{index}" for _ in range(max(1, int((end - start) / 0.35))))
+    return SimpleNamespace(
+        reason=ResultReason.RecognizedSpeech,
+        text=text,
+        offset=int(start * TICKS_PER_SECOND),
+        duration=int((end - start) * TICKS_PER_SECOND),
+        properties={PropertyId.SpeechServiceConnection_AutoDetectSourceLanguageResult: language},
+    )
+
+
+def _language(speech_config, auto_detect_source_language_config):
+    if auto_detect_source_language_config is not None:
+        return auto_detect_source_language_config.languages[0]
+    return speech_config.speech_recognition_language
+
+
+class SpeechRecognizer:
+    def __init__(self, speech_config, audio_config, auto_detect_source_language_config=None):
+        self._audio_config = audio_config
+        self._language = _language(speech_config, auto_detect_source_language_config)
+        self._stop = threading.Event()
+        self._thread = None
+        self.recognized = _Signal()
+        self.session_started = _Signal()
+        self.session_stopped = _Signal()
+        self.canceled = _Signal()
+
+    def _run(self):
+        self.session_started.emit(SimpleNamespace())
+        time.sleep(LATENCY_SECONDS)
+        try:
+            samples, sample_rate = _read_audio(self._audio_config, self._stop)
+        except Exception as e:
+            self.canceled.emit(SpeechRecognitionCanceledEventArgs(CancellationReason.Error, str(e)))
+            return
+        for index, (start, end) in enumerate(_utterances(samples, sample_rate)):
+            if self._stop.is_set():
+                break
+            self.recognized.emit(SimpleNamespace(result=_result(self._language, start, end, index)))
+        self.canceled.emit(SpeechRecognitionCanceledEventArgs(CancellationReason.EndOfStream))
+        self.session_stopped.emit(SimpleNamespace())
+
+    def start_continuous_recognition(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop_continuous_recognition(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+class SourceLanguageRecognizer:
+    def __init__(self, speech_config, auto_detect_source_language_config, audio_config):
+        self._audio_config = audio_config
+        self._language = _language(speech_config, auto_detect_source_language_config)
+
+    def recognize_once(self):
+        time.sleep(LATENCY_SECONDS)
+        samples, sample_rate = _read_audio(self._audio_config, pace=False)
+        utterances = _utterances(samples, sample_rate)
+        # The service stops listening at the end of the first utterance
+        listened = utterances[0][1] if utterances else len(samples) / sample_rate
+        time.sleep(listened * REAL_TIME_FACTOR)
+        if not utterances:
+            return SimpleNamespace(reason=ResultReason.NoMatch, no_match_details="No speech")
+        return _result(self._language, *utterances[0], 0)
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Optional
+
+
+def copy_hashing(source, destination, chunk_bytes: int = 1024 * 1024) -> str:
+    """
+    Copy a binary stream to a file, hashing it on the way.
+
+    Parameters:
+    source: A binary file-like object to read.
+    destination (os.PathLike): The file to write.
+    chunk_bytes (int): The size of the chunks read from the source (default is 1 MiB).
+
+    Returns:
+    str: The hex SHA-256 of the content.
+    """
+    digest = hashlib.sha256()
+    with open(destination, "wb") as f:
+        for chunk in iter(lambda: source.read(chunk_bytes), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """
+    Results of the transcription pipeline, stored by the hash of the recording.
+
+    Every stage of a recording is one row of a SQLite database: its value as
+    JSON, its size and when it was stored and last read. A converted WAV is
+    moved into the cache directory and its row holds its path, so its size
+    counts towards the limit and evicting the row removes the file. Rows are
+    evicted once older than max_age_seconds, and least recently read first
+    once the cache holds more than max_bytes.
+
+    Reading or storing a row leases it for lease_seconds, during which it is
+    never evicted: an invocation, on this instance or another one sharing
+    the directory, may still be converting or transcribing from its WAV. So
+    the cache can exceed max_bytes while the rows above it are leased.
+
+    Attributes:
+    directory (str): The directory holding the database and the WAV files.
+    max_bytes (int): The size above which the least recently read rows are evicted.
+    max_age_seconds (float): The age after which rows are evicted.
+    lease_seconds (float): How long a row read or stored is kept from eviction (default is 1 hour).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        max_age_seconds: float,
+        lease_seconds: float = 3600,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.lease_seconds = lease_seconds
+        os.makedirs(os.path.join(directory, "wav"), exist_ok=True)
+        self._path = os.path.join(directory, "results.sqlite3")
+        self._lock = threading.Lock()
+        # Hits and misses of every stage since the worker started
+        self._counts = {}
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " content_hash TEXT NOT NULL,"
+                " stage TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " path TEXT,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (content_hash, stage))"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)"
+            )
+
+    def _connect(self):
+        # A connection per operation, since invocations run on several threads
+        return closing(sqlite3.connect(self._path, timeout=30, isolation_level=None))
+
+    def get(self, content_hash: str, stage: str) -> Optional[dict]:
+        """Return the value stored for a stage of a recording, or None, and log the hit rate."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT value, path FROM results"
+                " WHERE content_hash = ? AND stage = ? AND created_at > ?",
+                (content_hash, stage, time.time() - self.max_age_seconds),
+            ).fetchone()
+            # A WAV file removed behind the cache's back is a miss
+            if row is not None and row[1] is not None and not os.path.exists(row[1]):
+                connection.execute(
+                    "DELETE FROM results WHERE content_hash = ? AND stage = ?",
+                    (content_hash, stage),
+                )
+                row = None
+            if row is not None:
+                connection.execute(
+                    "UPDATE results SET accessed_at = ? WHERE content_hash = ? AND stage = ?",
+                    (time.time(), content_hash, stage),
+                )
+
+        with self._lock:
+            hits, misses = self._counts.get(stage, (0, 0))
+            hits, misses = (hits + 1, misses) if row is not None else (hits, misses + 1)
+            self._counts[stage] = hits, misses
+        logging.info(
+            f"Result cache {'hit' if row is not None else 'miss'} for {stage}:"
+            f" {hits}/{hits + misses} hits ({hits / (hits + misses):.0%}) since start"
+        )
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, content_hash: str, stage: str, value: dict, path: str = None):
+        """
+        Store the value of a stage of a recording, then evict what is too old or too much.
+
+        Parameters:
+        content_hash (str): The hash of the recording.
+        stage (str): The pipeline stage, including the settings its value depends on.
+        value (dict): A JSON-serializable value.
+        path (str): A file in the cache directory the row owns (default is None).
+        """
+        encoded = json.dumps(value)
+        size = len(encoded) + (os.path.getsize(path) if path else 0)
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, stage, encoded, path, size, now, now),
+            )
+        self.evict()
+
+    def put_wav(self, content_hash: str, filepath_wav: str, duration_seconds: float) -> str:
+        """
+        Move a converted WAV into the cache and store its path and duration.
+
+        Returns:
+        str: The path of the WAV in the cache.
+        """
+        cached_path = os.path.join(self.directory, "wav", f"{content_hash}.wav")
+        shutil.move(filepath_wav, cached_path)
+        self.put(
+            content_hash,
+            "wav",
+            {"path": cached_path, "duration_seconds": duration_seconds},
+            path=cached_path,
+        )
+        return cached_path
+
+    def evict(self):
+        """
+        Remove the rows older than max_age_seconds, then the least recently
+        read ones above max_bytes, except the leased ones.
+        """
+        now = time.time()
+        cutoff = now - self.max_age_seconds
+        lease_cutoff = now - self.lease_seconds
+        with self._connect() as connection:
+            evicted = connection.execute(
+                "SELECT content_hash, stage, path FROM results"
+                " WHERE created_at <= ? AND accessed_at <= ?",
+                (cutoff, lease_cutoff),
+            ).fetchall()
+            total = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM results"
+                " WHERE created_at > ? OR accessed_at > ?",
+                (cutoff, lease_cutoff),
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                for content_hash, stage, path, size in connection.execute(
+                    "SELECT content_hash, stage, path, size FROM results"
+                    " WHERE created_at > ? AND accessed_at <= ? ORDER BY accessed_at",
+                    (cutoff, lease_cutoff),
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((content_hash, stage, path))
+                    total -= size
+            connection.executemany(
+                "DELETE FROM results WHERE content_hash = ? AND stage = ?",
+                [(content_hash, stage) for content_hash, stage, _ in evicted],
+            )
+        for _, _, path in evicted:
+            if path and os.path.exists(path):
+                os.remove(path)
+        if evicted:
+            logging.info(f"Evicted {len(evicted)} results from the result cache")
@@ -0,0 +1,301 @@
+import os
+import wave
+
+import numpy as np
+
+# Speech SDK offsets and durations are in ticks of 100 ns
+TICKS_PER_SECOND = 10_000_000
+
+
+def read_pcm(filepath: os.PathLike):
+    """
+    Read a 16-bit PCM WAV file as mono samples.
+
+    Parameters:
+    filepath (os.PathLike): The WAV file to read.
+
+    Returns:
+    tuple: The int16 samples, averaged over the channels, and the sample rate.
+    """
+    with wave.open(os.fspath(filepath), "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{filepath} is not 16-bit PCM")
+        channels = wav.getnchannels()
+        sample_rate = wav.getframerate()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples, sample_rate
+
+
+def frame_energy(
+    samples: np.ndarray,
+    sample_rate: int,
+    frame_seconds: float = 0.01,
+    smoothing_seconds: float = 0.3,
+) -> np.ndarray:
+    """
+    Return the energy in dB of every frame of the samples, smoothed over a window.
+
+    The smoothing keeps the short gaps inside words from looking like pauses.
+
+    Parameters:
+    samples (np.ndarray): The mono samples.
+    sample_rate (int): The sample rate of the samples.
+    frame_seconds (float): The length of a frame (default is 10 ms).
+    smoothing_seconds (float): The length of the moving average window (default is 300 ms).
+
+    Returns:
+    np.ndarray: The float32 energy of every whole frame.
+    """
+    frame = max(1, int(sample_rate * frame_seconds))
+    frames = samples[: len(samples) // frame * frame].reshape(-1, frame)
+    energy = np.square(frames, dtype=np.float32).mean(axis=1)
+    window = max(1, int(smoothing_seconds / frame_seconds))
+    if window > 1 and len(energy) >= window:
+        energy = np.convolve(energy, np.full(window, 1 / window, np.float32), mode="same")
+    return 10 * np.log10(energy + 1e-10)
+
+
+def split_at_silences(
+    samples: np.ndarray,
+    sample_rate: int,
+    max_segment_seconds: float = 60.0,
+    min_segment_seconds: float = None,
+    frame_seconds: float = 0.01,
+) -> list:
+    """
+    Split audio into segments of bounded length, cutting at the quietest moments.
+
+    Every cut is placed in the quietest frame between min_segment_seconds and
+    max_segment_seconds after the previous cut, which is a pause between
+    utterances unless someone speaks for the whole window.
+
+    Parameters:
+    samples (np.ndarray): The mono samples.
+    sample_rate (int): The sample rate of the samples.
+    max_segment_seconds (float): The maximum length of a segment (default is 60).
+    min_segment_seconds (float): The minimum length of a segment but the last (default is half the maximum).
+    frame_seconds (float): The resolution of the cuts (default is 10 ms).
+
+    Returns:
+    list[tuple]: The (start, end) sample indices of every segment, in order.
+    """
+    if min_segment_seconds is None:
+        min_segment_seconds = max_segment_seconds / 2
+    frame = max(1, int(sample_rate * frame_seconds))
+    max_frames = max(1, int(max_segment_seconds / frame_seconds))
+    min_frames = min(max(0, int(min_segment_seconds / frame_seconds)), max_frames - 1)
+
+    energy = frame_energy(samples, sample_rate, frame_seconds)
+    cuts = [0]
+    while len(energy) - cuts[-1] > max_frames:
+        start = cuts[-1] + min_frames + 1
+        window = energy[start : cuts[-1] + max_frames + 1]
+        cuts.append(start + int(window.argmin()))
+
+    bounds = [cut * frame for cut in cuts] + [len(samples)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def samples_to_ticks(sample_index: int, sample_rate: int) -> int:
+    return sample_index * TICKS_PER_SECOND // sample_rate
+
+
+def write_pcm(filepath: os.PathLike, samples: np.ndarray, sample_rate: int):
+    """Write mono int16 samples to a WAV file."""
+    with wave.open(os.fspath(filepath), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+
+
+def _moving_average(values: np.ndarray, window: int) -> np.ndarray:
+    if window <= 1 or len(values) < window:
+        return values
+    return np.convolve(values, np.full(window, 1 / window, np.float32), mode="same")
+
+
+def voice_activity(
+    samples: np.ndarray,
+    sample_rate: int,
+    frame_seconds: float = 0.02,
+    energy_margin_db: float = 10.0,
+    min_band_ratio: float = 0.5,
+    min_modulation_db: float = 4.0,
+    modulation_seconds: float = 0.5,
+    block_frames: int = 4096,
+) -> np.ndarray:
+    """
+    Tell which frames of the audio hold speech.
+
+    A frame holds speech when it is louder than the noise floor, most of
+    its energy is in the 80-4000 Hz voice band, and the loudness around it
+    rises and falls like syllables do. The last test is what tells speech
+    from ringing tones and hold music, whose loudness is steadier.
+
+    Parameters:
+    samples (np.ndarray): The mono samples.
+    sample_rate (int): The sample rate of the samples.
+    frame_seconds (float): The length of a frame (default is 20 ms).
+    energy_margin_db (float): How much louder than the noise floor speech is (default is 10 dB).
+    min_band_ratio (float): The minimum share of the energy in the voice band (default is 0.5).
+    min_modulation_db (float): The minimum standard deviation of the loudness around speech (default is 4 dB).
+    modulation_seconds (float): The window the loudness deviation is measured over (default is 500 ms).
+    block_frames (int): Frames whose spectrum is computed at once, which bounds the memory used (default is 4096).
+
+    Returns:
+    np.ndarray: A bool per whole frame, True for speech.
+    """
+    frame = max(1, int(sample_rate * frame_seconds))
+    n_frames = len(samples) // frame
+    frames = samples[: n_frames * frame].reshape(-1, frame)
+    taper = np.hanning(frame).astype(np.float32)
+    frequencies = np.fft.rfftfreq(frame, 1 / sample_rate)
+    in_band = (frequencies >= 80) & (frequencies <= 4000)
+
+    energy_db = np.empty(n_frames, dtype=np.float32)
+    band_ratio = np.empty(n_frames, dtype=np.float32)
+    for start in range(0, n_frames, block_frames):
+        block = frames[start : start + block_frames].astype(np.float32) * taper
+        power = np.square(np.abs(np.fft.rfft(block, axis=1)))
+        total = power.sum(axis=1) + 1e-10
+        energy_db[start : start + block_frames] = 10 * np.log10(total / frame)
+        band_ratio[start : start + block_frames] = power[:, in_band].sum(axis=1) / total
+
+    if not n_frames:
+        return np.zeros(0, dtype=bool)
+    loud = energy_db > np.percentile(energy_db, 10) + energy_margin_db
+    # Standard deviation of the loudness over the surrounding window
+    window = max(1, int(modulation_seconds / frame_seconds))
+    mean = _moving_average(energy_db, window)
+    variance = _moving_average(np.square(energy_db), window) - np.square(mean)
+    modulation = np.sqrt(np.maximum(variance, 0))
+    return loud & (band_ratio > min_band_ratio) & (modulation > min_modulation_db)
+
+
+class OffsetMap:
+    """
+    Maps times in trimmed audio back to the recording it was trimmed from.
+
+    Attributes:
+    sample_rate (int): The sample rate of both recordings.
+    trimmed_starts (np.ndarray): The sample where every kept span starts in the trimmed audio.
+    original_starts (np.ndarray): The sample where every kept span starts in the original audio.
+    original_samples (int): The length of the original audio.
+    trimmed_samples (int): The length of the trimmed audio.
+    """
+
+    def __init__(
+        self, sample_rate, trimmed_starts, original_starts, original_samples, trimmed_samples
+    ):
+        self.sample_rate = sample_rate
+        self.trimmed_starts = np.asarray(trimmed_starts, dtype=np.int64)
+        self.original_starts = np.asarray(original_starts, dtype=np.int64)
+        self.original_samples = original_samples
+        self.trimmed_samples = trimmed_samples
+
+    @property
+    def original_seconds(self) -> float:
+        return self.original_samples / self.sample_rate
+
+    @property
+    def trimmed_seconds(self) -> float:
+        return self.trimmed_samples / self.sample_rate
+
+    def to_original(self, ticks: int, end: bool = False) -> int:
+        """
+        Translate an offset in ticks in the trimmed audio to the original audio.
+
+        An end offset falling on a cut belongs to the span before it.
+        """
+        if not len(self.trimmed_starts):
+            return ticks
+        sample = ticks * self.sample_rate // TICKS_PER_SECOND
+        side = "left" if end else "right"
+        span = max(int(np.searchsorted(self.trimmed_starts, sample, side=side)) - 1, 0)
+        return (
+            ticks
+            + samples_to_ticks(int(self.original_starts[span]), self.sample_rate)
+            - samples_to_ticks(int(self.trimmed_starts[span]), self.sample_rate)
+        )
+
+    def restore_segments(self, segments: list) -> list:
+        """Return the transcription segments with their start and duration in the original audio."""
+        restored = []
+        for segment in segments:
+            start = self.to_original(segment["start"])
+            end = self.to_original(segment["start"] + segment["duration"], end=True)
+            restored.append(dict(segment, start=start, duration=end - start))
+        return restored
+
+
+def trim_silences(
+    samples: np.ndarray,
+    sample_rate: int,
+    padding_seconds: float = 0.2,
+    min_gap_seconds: float = 0.5,
+    kept_gap_seconds: float = 0.3,
+    frame_seconds: float = 0.02,
+):
+    """
+    Drop the audio around speech and shorten the pauses between it.
+
+    Every speech span found by voice_activity is padded, spans closer than
+    min_gap_seconds are merged, and at most kept_gap_seconds of every gap
+    is kept so the recognizer still hears the pause. Audio with no speech
+    found is returned whole.
+
+    Parameters:
+    samples (np.ndarray): The mono samples.
+    sample_rate (int): The sample rate of the samples.
+    padding_seconds (float): The audio kept before and after every speech span (default is 200 ms).
+    min_gap_seconds (float): Shorter gaps between speech spans are kept whole (default is 500 ms).
+    kept_gap_seconds (float): The audio kept of a longer gap (default is 300 ms).
+    frame_seconds (float): The resolution of the voice activity (default is 20 ms).
+
+    Returns:
+    tuple: The trimmed samples and the OffsetMap back to the original ones.
+    """
+    frame = max(1, int(sample_rate * frame_seconds))
+    active = voice_activity(samples, sample_rate, frame_seconds)
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], active.astype(np.int8), [0]])))
+    if not len(edges):
+        return samples, OffsetMap(sample_rate, [0], [0], len(samples), len(samples))
+
+    padding = int(padding_seconds / frame_seconds)
+    starts = np.maximum(edges[::2] - padding, 0)
+    ends = np.minimum(edges[1::2] + padding, len(active))
+    # Merge the spans separated by short gaps
+    separate = starts[1:] - ends[:-1] > int(min_gap_seconds / frame_seconds)
+    starts = np.concatenate([starts[:1], starts[1:][separate]])
+    ends = np.concatenate([ends[:-1][separate], ends[-1:]])
+    # Keep the start of every remaining gap as a shortened pause
+    ends[:-1] = np.minimum(ends[:-1] + int(kept_gap_seconds / frame_seconds), starts[1:])
+
+    starts, ends = starts * frame, np.minimum(ends * frame, len(samples))
+    lengths = ends - starts
+    trimmed_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    trimmed = np.concatenate([samples[start:end] for start, end in zip(starts, ends)])
+    return trimmed, OffsetMap(sample_rate, trimmed_starts, starts, len(samples), len(trimmed))
+
+
+def trim_wav(filepath: os.PathLike, output_path: os.PathLike = None, **kwargs):
+    """
+    Write a copy of a WAV file without its non-speech audio, see trim_silences.
+
+    Parameters:
+    filepath (os.PathLike): The 16-bit PCM WAV file to trim.
+    output_path (os.PathLike): Where to write the trimmed WAV (default is next to the file, ending in .trimmed.wav).
+    **kwargs: Passed to trim_silences.
+
+    Returns:
+    tuple: The path of the trimmed WAV and the OffsetMap back to the original one.
+    """
+    if output_path is None:
+        output_path = f"{os.path.splitext(filepath)[0]}.trimmed.wav"
+    samples, sample_rate = read_pcm(filepath)
+    trimmed, offset_map = trim_silences(samples, sample_rate, **kwargs)
+    write_pcm(output_path, trimmed, sample_rate)
+    return output_path, offset_map
@@ -0,0 +1,13 @@
+import os
+
+# The speech recognizer the function uses: "azure" for the Azure Speech
+# service, or "local" for the stand-in of local_speech.py, which needs no
+# credentials nor network
+SPEECH_BACKEND = os.getenv("SPEECH_BACKEND", "azure")
+
+if SPEECH_BACKEND == "azure":
+    import azure.cognitiveservices.speech as speech_sdk
+elif SPEECH_BACKEND == "local":
+    import local_speech as speech_sdk
+else:
+    raise ValueError(f"Unknown SPEECH_BACKEND {SPEECH_BACKEND!r}, expected 'azure' or 'local'")
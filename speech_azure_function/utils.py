@@ -1,11 +1,18 @@
+import glob
 import logging
 import os
 import subprocess
+import threading
+import time
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-from pydub import AudioSegment
-
 EMPTY_STRING = ""
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".ogg", ".flac", ".wma", ".aac")
+# Last lines of a streaming decoder's stderr kept for the error report
+DECODER_STDERR_LINES = 20
 
 
 def convert_file_to_wav_if_needed(filepath: os.PathLike, sample_rate: int = 16000):
@@ -16,12 +23,18 @@ def convert_file_to_wav_if_needed(filepath: os.PathLike, sample_rate: int = 1600
         logging.info(
             f"The file extension is {file_extension}, converting to WAV format..."
         )
-        # Convert the audio file to WAV format
-        audio = AudioSegment.from_file(filepath)
-        # Set the frame rate to 16kHz as the speech service requires in this format
-        audio = audio.set_frame_rate(sample_rate)
-        filepath = f"{os.path.splitext(filepath)[0]}.wav"
-        audio.export(filepath, format="wav")
+        # Convert the audio file to WAV format, at the 16kHz frame rate the
+        # speech service requires. FFmpeg decodes and resamples as it reads,
+        # so the memory used doesn't grow with the length of the file.
+        wav_filepath = f"{os.path.splitext(filepath)[0]}.wav"
+        subprocess.run(
+            ffmpeg_wav_command(filepath, wav_filepath, str(sample_rate)),
+            check=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        filepath = wav_filepath
         logging.info(f"File {file_name} converted to WAV format!")
     return filepath, file_extension
 
@@ -69,6 +82,269 @@ def convert_mp3_to_wav_subprocess(
     return abs_filepath
 
 
+def ffmpeg_wav_command(input_path, output_path, sample_rate: str = "16000") -> list:
+    """The FFmpeg command converting one file to WAV, overwriting the output, on one thread."""
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-y",
+        "-loglevel",
+        "error",
+        "-threads",
+        "1",
+        "-i",
+        os.fspath(input_path),
+        "-f",
+        "wav",
+        "-ar",
+        sample_rate,
+        os.fspath(output_path),
+    ]
+
+
+def available_cores() -> int:
+    """The number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def wav_duration_seconds(filepath) -> float:
+    with wave.open(os.fspath(filepath), "rb") as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def _convert_with_retries(
+    input_path, output_path, sample_rate, timeout_threshold_seconds, retries
+):
+    started_at = time.perf_counter()
+    error = None
+    for attempt in range(1, retries + 2):
+        try:
+            subprocess.run(
+                ffmpeg_wav_command(input_path, output_path, sample_rate),
+                check=True,
+                timeout=timeout_threshold_seconds,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            return {
+                "input": input_path,
+                "output": output_path,
+                "audio_seconds": wav_duration_seconds(output_path),
+                "seconds": time.perf_counter() - started_at,
+                "attempts": attempt,
+                "error": None,
+            }
+        except subprocess.CalledProcessError as e:
+            error = e.stderr.decode(errors="replace").strip() or str(e)
+        except (subprocess.TimeoutExpired, OSError, wave.Error, EOFError) as e:
+            error = str(e)
+        logging.warning(f"Converting {input_path} failed, attempt {attempt}: {error}")
+        if attempt <= retries:
+            time.sleep(0.5 * 2 ** (attempt - 1))
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    return {
+        "input": input_path,
+        "output": None,
+        "audio_seconds": 0.0,
+        "seconds": time.perf_counter() - started_at,
+        "attempts": retries + 1,
+        "error": error,
+    }
+
+
+def convert_files_to_wav(
+    inputs,
+    output_dir: os.PathLike = None,
+    sample_rate: str = "16000",
+    max_concurrency: int = None,
+    timeout_threshold_seconds: float = 120,
+    retries: int = 2,
+):
+    """
+    Convert many audio files to WAV with parallel FFmpeg processes.
+
+    Every FFmpeg process runs on one thread, and at most max_concurrency of
+    them run at a time. A file that fails or takes longer than
+    timeout_threshold_seconds is tried again up to retries times, with
+    backoff, and reported with its error if it never succeeds. A file whose
+    WAV would overwrite an input or another file's WAV, e.g. one of two
+    inputs named alike with the same output_dir, is reported without being
+    converted.
+
+    Parameters:
+    inputs (os.PathLike | list[os.PathLike]): The audio files, or a directory holding them (without the outputs of earlier runs).
+    output_dir (os.PathLike): Where to write the WAV files (default is next to every input).
+    sample_rate (str): The sample rate of the WAV files (default is "16000").
+    max_concurrency (int): Maximum number of FFmpeg processes at a time (default is the number of available cores).
+    timeout_threshold_seconds (float): The timeout of every attempt (default is 120).
+    retries (int): The number of attempts after the first one (default is 2).
+
+    Returns:
+    dict: "files", the input, output, audio_seconds, seconds, attempts and
+          error of every file in input order; "audio_seconds" and "seconds",
+          the audio converted and the wall time; and "throughput", the audio
+          seconds converted per wall second.
+    """
+    if isinstance(inputs, (str, os.PathLike)) and os.path.isdir(inputs):
+        paths = [
+            path
+            for path in glob.glob(os.path.join(inputs, "*"))
+            if os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS
+        ]
+        # Outputs of earlier runs aren't inputs: the conversions of WAV files,
+        # and a WAV next to another audio file of the same name
+        converted = {
+            f"{os.path.splitext(path)[0]}.wav" for path in paths if not path.endswith(".wav")
+        }
+        inputs = sorted(
+            path
+            for path in paths
+            if not path.endswith(".converted.wav") and path not in converted
+        )
+    inputs = [os.fspath(path) for path in inputs]
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    def output_path(input_path):
+        stem = os.path.splitext(input_path)[0]
+        if output_dir is not None:
+            stem = os.path.join(output_dir, os.path.basename(stem))
+        # Never overwrite an input WAV with its own conversion
+        return f"{stem}.converted.wav" if input_path.endswith(".wav") else f"{stem}.wav"
+
+    started_at = time.perf_counter()
+    results = [None] * len(inputs)
+    # Inputs with the same name, e.g. from several directories into one
+    # output_dir, would overwrite each other's output, and an output may not
+    # replace an input; such files are reported instead of converted
+    claimed = {os.path.abspath(path): None for path in inputs}
+    for index, input_path in enumerate(inputs):
+        target = os.path.abspath(output_path(input_path))
+        if target in claimed:
+            owner = claimed[target]
+            reason = f"the output of {owner}" if owner else "an input"
+            results[index] = {
+                "input": input_path,
+                "output": None,
+                "audio_seconds": 0.0,
+                "seconds": 0.0,
+                "attempts": 0,
+                "error": f"{output_path(input_path)} would overwrite {reason}",
+            }
+            logging.warning(f"Not converting {input_path}: {results[index]['error']}")
+        else:
+            claimed[target] = input_path
+    with ThreadPoolExecutor(max_workers=max_concurrency or available_cores()) as pool:
+        futures = {
+            pool.submit(
+                _convert_with_retries,
+                input_path,
+                output_path(input_path),
+                sample_rate,
+                timeout_threshold_seconds,
+                retries,
+            ): index
+            for index, input_path in enumerate(inputs)
+            if results[index] is None
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    seconds = time.perf_counter() - started_at
+
+    audio_seconds = sum(result["audio_seconds"] for result in results)
+    failed = sum(result["error"] is not None for result in results)
+    throughput = audio_seconds / seconds if seconds else 0.0
+    logging.info(
+        f"Converted {len(inputs) - failed}/{len(inputs)} files,"
+        f" {audio_seconds:.0f} s of audio in {seconds:.1f} s:"
+        f" {throughput:.1f} audio seconds per second"
+    )
+    return {
+        "files": results,
+        "audio_seconds": audio_seconds,
+        "seconds": seconds,
+        "throughput": throughput,
+    }
+
+
+def open_pcm_decoder(
+    source, sample_rate: str = "16000", chunk_bytes: int = 64 * 1024
+) -> subprocess.Popen:
+    """
+    Start an FFmpeg process decoding audio to raw 16-bit mono PCM through pipes.
+
+    A thread copies the source to FFmpeg's stdin chunk by chunk while the
+    caller reads the PCM from its stdout, so nothing is written to disk and
+    the PCM can be consumed while the rest is still being decoded. The pipes
+    block when full, so memory stays bounded however long the audio is.
+
+    FFmpeg's stderr is drained by another thread, keeping its last
+    DECODER_STDERR_LINES lines; read them with decoder_stderr.
+
+    Parameters:
+    source: A binary file-like object, or an iterable of bytes chunks, holding the encoded audio.
+    sample_rate (str): The sample rate of the PCM (default is "16000").
+    chunk_bytes (int): The size of the chunks read from a file-like source (default is 64 KiB).
+
+    Returns:
+    subprocess.Popen: The FFmpeg process; read the PCM from its stdout.
+    """
+    process = subprocess.Popen(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-i",
+            "pipe:0",
+            "-f",
+            "s16le",
+            "-ac",
+            "1",
+            "-ar",
+            sample_rate,
+            "pipe:1",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    process.stderr_tail = deque(maxlen=DECODER_STDERR_LINES)
+
+    def drain_stderr():
+        # Lines are read in bounded pieces, so a runaway line can't grow memory
+        for line in iter(lambda: process.stderr.readline(1024), b""):
+            process.stderr_tail.append(line.decode(errors="replace").rstrip())
+
+    process.stderr_reader = threading.Thread(target=drain_stderr, daemon=True)
+    process.stderr_reader.start()
+
+    def feed():
+        if hasattr(source, "read"):
+            chunks = iter(lambda: source.read(chunk_bytes), b"")
+        else:
+            chunks = source
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+            process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            # FFmpeg exited or was killed before reading all of the input
+            pass
+
+    threading.Thread(target=feed, daemon=True).start()
+    return process
+
+
+def decoder_stderr(process: subprocess.Popen, timeout: float = 5) -> str:
+    """Return the last lines FFmpeg wrote to stderr, once a decoder from open_pcm_decoder exited."""
+    process.stderr_reader.join(timeout)
+    return "\n".join(line for line in process.stderr_tail if line)
+
+
 def bcp47_to_iso6391(locale):
     """
     Convert a BCP-47 locale tag to an ISO 639-1 language code.